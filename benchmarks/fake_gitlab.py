@@ -0,0 +1,450 @@
+"""
+A stand-in for the GitLab REST and GraphQL endpoints used by IAMKSM, serving
+synthetic repositories and merge requests, for benchmarks.
+
+Every request is answered after `latency` seconds. Notes, discussions and
+approvals posted by the bot are recorded with the time they arrived, so a
+benchmark can tell when each review finished.
+"""
+
+import hashlib
+import io
+import json
+import random
+import re
+import sys
+import threading
+import time
+import zipfile
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, unquote, urlsplit
+
+WORDS: List[str] = [f"symbol_{i}" for i in range(2000)]
+BOT_USER = {"id": 352, "username": "iamksm-bot", "name": "iamksm bot"}
+
+
+def fake_sha(*parts: Any) -> str:
+    return hashlib.sha1(":".join(map(str, parts)).encode()).hexdigest()
+
+
+def git_blob_id(content: str) -> str:
+    data: bytes = content.encode()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
+
+
+def synthetic_module(rng: random.Random, package: str, lines: int) -> str:
+    imports: List[str] = [
+        f"from {package}.module_{rng.randrange(1000)} import {rng.choice(WORDS)}"
+        for _ in range(3)
+    ]
+    body: List[str] = [
+        f"def {rng.choice(WORDS)}({rng.choice(WORDS)}):\n"
+        f"    return {rng.choice(WORDS)}({rng.choice(WORDS)})\n"
+        for _ in range(max(lines // 3, 1))
+    ]
+    return "\n".join(imports) + "\n\n\n" + "\n".join(body)
+
+
+def synthetic_diff(rng: random.Random, added_lines: int) -> str:
+    added: List[str] = [
+        f"+    {rng.choice(WORDS)} = {rng.choice(WORDS)}({rng.choice(WORDS)})"
+        for _ in range(added_lines)
+    ]
+    return (
+        f"@@ -1,3 +1,{3 + added_lines} @@\n"
+        " import os\n"
+        f"{chr(10).join(added)}\n"
+        " \n"
+        " \n"
+    )
+
+
+def zip_archive(name: str, sha: str, files: Dict[str, str]) -> bytes:
+    buffer = io.BytesIO()
+
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+        for path, content in files.items():
+            archive.writestr(f"{name}-{sha}/{path}", content)
+
+    return buffer.getvalue()
+
+
+@dataclass
+class SyntheticMR:
+    iid: int
+    title: str
+    base_sha: str
+    head_sha: str
+    changes: List[Dict[str, Any]]
+    commits: List[Dict[str, Any]]
+    labels: List[str] = field(default_factory=list)
+
+
+@dataclass
+class SyntheticProject:
+    id: int
+    path: str
+    sha: str
+    files: Dict[str, str]
+    merge_requests: Dict[int, SyntheticMR]
+    archive: bytes = b""
+
+    def __post_init__(self):
+        name: str = self.path.rsplit("/", 1)[-1]
+        self.archive = zip_archive(name, self.sha, self.files)
+
+    def attributes(self, gitlab_url: str) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.path.rsplit("/", 1)[-1],
+            "path_with_namespace": self.path,
+            "default_branch": "main",
+            "http_url_to_repo": f"{gitlab_url}/{self.path}.git",
+        }
+
+    def merge_request(self, mr: SyntheticMR) -> Dict[str, Any]:
+        return {
+            "id": self.id * 100000 + mr.iid,
+            "iid": mr.iid,
+            "project_id": self.id,
+            "title": mr.title,
+            "description": f"Synthetic change {mr.iid} of {self.path}",
+            "state": "opened",
+            "draft": False,
+            "work_in_progress": False,
+            "blocking_discussions_resolved": True,
+            "source_branch": f"feature-{mr.iid}",
+            "target_branch": "main",
+            "labels": mr.labels,
+            "sha": mr.head_sha,
+            "diff_refs": {
+                "base_sha": mr.base_sha,
+                "start_sha": mr.base_sha,
+                "head_sha": mr.head_sha,
+            },
+        }
+
+
+def synthetic_project(
+    project_id: int,
+    files: int,
+    lines: int,
+    mrs: int,
+    changed_files: int,
+    added_lines: int,
+) -> SyntheticProject:
+    """
+    Builds a repository of `files` Python modules of about `lines` lines and
+    `mrs` merge requests, each adding `added_lines` lines to `changed_files`
+    existing modules.
+    """
+    rng = random.Random(project_id)
+    package: str = f"pkg_{project_id}"
+    contents: Dict[str, str] = {
+        f"{package}/module_{i}.py": synthetic_module(rng, package, lines)
+        for i in range(files)
+    }
+    contents["README.md"] = f"# Synthetic project {project_id}\n"
+    sha: str = fake_sha(project_id, "main")
+    paths: List[str] = sorted(contents)
+    merge_requests: Dict[int, SyntheticMR] = {}
+
+    for iid in range(1, mrs + 1):
+        changes: List[Dict[str, Any]] = [
+            {
+                "old_path": path,
+                "new_path": path,
+                "new_file": False,
+                "renamed_file": False,
+                "deleted_file": False,
+                "diff": synthetic_diff(rng, added_lines),
+            }
+            for path in rng.sample(paths, min(changed_files, len(paths)))
+        ]
+        head_sha: str = fake_sha(project_id, iid, "head")
+        merge_requests[iid] = SyntheticMR(
+            iid=iid,
+            title=f"Change {iid} of project {project_id}",
+            base_sha=sha,
+            head_sha=head_sha,
+            changes=changes,
+            commits=[
+                {
+                    "id": head_sha,
+                    "short_id": head_sha[:8],
+                    "title": f"Change {iid}",
+                    "message": f"Change {iid}\n\nTouches {len(changes)} files",
+                }
+            ],
+        )
+
+    return SyntheticProject(
+        id=project_id,
+        path=f"bench/project-{project_id}",
+        sha=sha,
+        files=contents,
+        merge_requests=merge_requests,
+    )
+
+
+def merge_request_event(project: SyntheticProject, mr: SyntheticMR) -> Dict[str, Any]:
+    return {
+        "event_type": "merge_request",
+        "project": {"id": project.id, "path_with_namespace": project.path},
+        "object_attributes": {
+            "iid": mr.iid,
+            "action": "open",
+            "state": "opened",
+            "draft": False,
+            "work_in_progress": False,
+            "blocking_discussions_resolved": True,
+            "last_commit": {"id": mr.head_sha},
+        },
+    }
+
+
+class FakeGitLabServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, projects: List[SyntheticProject], latency: float):
+        super().__init__(address, FakeGitLabHandler)
+        self.projects: Dict[int, SyntheticProject] = {p.id: p for p in projects}
+        self.latency = latency
+        self.requests: int = 0
+        self.posts: List[Tuple[float, int, int, str]] = []
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def handle_error(self, request, client_address):
+        # Clients dropping idle keep-alive connections are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+    def count_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def record(self, project_id: int, iid: int, kind: str) -> None:
+        with self._lock:
+            self.posts.append((time.monotonic(), project_id, iid, kind))
+
+    def reviewed_at(self) -> Dict[Tuple[int, int], float]:
+        with self._lock:
+            reviewed: Dict[Tuple[int, int], float] = {}
+
+            for at, project_id, iid, kind in self.posts:
+                if kind in ("notes", "discussions"):
+                    reviewed.setdefault((project_id, iid), at)
+
+            return reviewed
+
+
+Route = Tuple[str, "re.Pattern[str]", str]
+ROUTES: List[Route] = [
+    ("GET", re.compile(r"/api/v4/user"), "user"),
+    ("GET", re.compile(r"/api/v4/projects/(\d+)"), "project"),
+    ("GET", re.compile(r"/api/v4/groups/([^/]+)/merge_requests"), "group_mrs"),
+    ("GET", re.compile(r"/api/v4/projects/(\d+)/merge_requests"), "project_mrs"),
+    ("GET", re.compile(r"/api/v4/projects/(\d+)/merge_requests/(\d+)"), "mr"),
+    (
+        "GET",
+        re.compile(r"/api/v4/projects/(\d+)/merge_requests/(\d+)/changes"),
+        "changes",
+    ),
+    (
+        "GET",
+        re.compile(r"/api/v4/projects/(\d+)/merge_requests/(\d+)/commits"),
+        "commits",
+    ),
+    (
+        "GET",
+        re.compile(r"/api/v4/projects/(\d+)/merge_requests/(\d+)/approvals"),
+        "approvals",
+    ),
+    (
+        "GET",
+        re.compile(r"/api/v4/projects/(\d+)/repository/archive(?:\.zip)?"),
+        "archive",
+    ),
+    (
+        "GET",
+        re.compile(r"/api/v4/projects/(\d+)/repository/files/(.+)/raw"),
+        "raw_file",
+    ),
+    ("GET", re.compile(r"/api/v4/projects/(\d+)/repository/branches/(.+)"), "branch"),
+    ("POST", re.compile(r"/api/graphql"), "graphql"),
+    (
+        "POST",
+        re.compile(
+            r"/api/v4/projects/(\d+)/merge_requests/(\d+)/"
+            r"(notes|discussions|approve|unapprove)"
+        ),
+        "post",
+    ),
+    (
+        "POST",
+        re.compile(
+            r"/api/v4/projects/(\d+)/merge_requests/(\d+)/discussions/([^/]+)/notes"
+        ),
+        "reply",
+    ),
+    (
+        "PUT",
+        re.compile(r"/api/v4/projects/(\d+)/merge_requests/(\d+)/discussions/([^/]+)"),
+        "resolve",
+    ),
+]
+
+
+class FakeGitLabHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeGitLabServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(
+        self, body: bytes, status: int = 200, content_type="application/json"
+    ) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Next-Page", "")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_json(self, payload: Any, status: int = 200) -> None:
+        self.send_body(json.dumps(payload).encode(), status)
+
+    def read_json(self) -> Dict[str, Any]:
+        length: int = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def route(self, method: str) -> None:
+        time.sleep(self.server.latency)
+        self.server.count_request()
+        url = urlsplit(self.path)
+        query: Dict[str, List[str]] = parse_qs(url.query)
+
+        for route_method, pattern, name in ROUTES:
+            match: Optional[re.Match] = pattern.fullmatch(url.path)
+
+            if route_method == method and match:
+                handler: Callable = getattr(self, f"handle_{name}")
+                return handler(*match.groups(), query=query)
+
+        self.send_json({"message": "404 Not Found"}, status=404)
+
+    def do_GET(self):
+        self.route("GET")
+
+    def do_POST(self):
+        self.route("POST")
+
+    def do_PUT(self):
+        self.route("PUT")
+
+    def project(self, project_id: str) -> SyntheticProject:
+        return self.server.projects[int(project_id)]
+
+    def mr(self, project_id: str, iid: str) -> SyntheticMR:
+        return self.project(project_id).merge_requests[int(iid)]
+
+    def handle_user(self, query):
+        self.send_json(BOT_USER)
+
+    def handle_project(self, project_id, query):
+        self.send_json(self.project(project_id).attributes(self.server.url))
+
+    def handle_group_mrs(self, group, query):
+        # Every synthetic project belongs to the one group
+        self.send_json(
+            [
+                project.merge_request(mr)
+                for project in self.server.projects.values()
+                for mr in project.merge_requests.values()
+            ]
+        )
+
+    def handle_project_mrs(self, project_id, query):
+        project: SyntheticProject = self.project(project_id)
+        self.send_json(
+            [project.merge_request(mr) for mr in project.merge_requests.values()]
+        )
+
+    def handle_mr(self, project_id, iid, query):
+        self.send_json(self.project(project_id).merge_request(self.mr(project_id, iid)))
+
+    def handle_changes(self, project_id, iid, query):
+        mr: SyntheticMR = self.mr(project_id, iid)
+        payload = self.project(project_id).merge_request(mr)
+        self.send_json(dict(payload, changes=mr.changes))
+
+    def handle_commits(self, project_id, iid, query):
+        self.send_json(self.mr(project_id, iid).commits)
+
+    def handle_approvals(self, project_id, iid, query):
+        self.send_json({"approved": False, "approved_by": []})
+
+    def handle_archive(self, project_id, query):
+        self.send_body(self.project(project_id).archive, content_type="application/zip")
+
+    def handle_raw_file(self, project_id, path, query):
+        content: Optional[str] = self.project(project_id).files.get(unquote(path))
+
+        if content is None:
+            return self.send_json({"message": "404 File Not Found"}, status=404)
+
+        self.send_body(content.encode(), content_type="text/plain")
+
+    def handle_branch(self, project_id, branch, query):
+        project: SyntheticProject = self.project(project_id)
+        self.send_json(
+            {"name": unquote(branch), "commit": {"id": project.sha}, "protected": False}
+        )
+
+    def handle_graphql(self, query):
+        variables: Dict[str, Any] = self.read_json().get("variables", {})
+        projects = {p.path: p for p in self.server.projects.values()}
+        project: SyntheticProject = projects[variables["project"]]
+        nodes: List[Dict[str, str]] = [
+            {
+                "path": path,
+                "oid": git_blob_id(project.files[path]),
+                "rawTextBlob": project.files[path],
+            }
+            for path in variables["paths"]
+            if path in project.files
+        ]
+        self.send_json(
+            {"data": {"project": {"repository": {"blobs": {"nodes": nodes}}}}}
+        )
+
+    def handle_post(self, project_id, iid, kind, query):
+        self.read_json()
+        self.server.record(int(project_id), int(iid), kind)
+        self.send_json({"id": len(self.server.posts), "author": BOT_USER}, status=201)
+
+    def handle_reply(self, project_id, iid, discussion_id, query):
+        # Replies count as reviews like new notes do
+        self.read_json()
+        self.server.record(int(project_id), int(iid), "notes")
+        self.send_json({"id": len(self.server.posts), "author": BOT_USER}, status=201)
+
+    def handle_resolve(self, project_id, iid, discussion_id, query):
+        self.read_json()
+        self.server.record(int(project_id), int(iid), "resolve")
+        self.send_json({"id": discussion_id, "resolved": True})
+
+
+def start_fake_gitlab(
+    projects: List[SyntheticProject], latency: float = 0.0, port: int = 0
+) -> FakeGitLabServer:
+    server = FakeGitLabServer(("127.0.0.1", port), projects, latency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,158 @@
+"""
+A deterministic stand-in for the Ollama HTTP API, for benchmarks.
+
+Embeddings are bag-of-words vectors built with the hashing trick, so texts
+sharing identifiers end up close to each other without a real model.
+
+Generations stream a canned review at `tokens_per_second`, after spending
+as long on the prompt as a server evaluating `prompt_tokens_per_second`
+would. At most `parallel` generations run at once, like `OLLAMA_NUM_PARALLEL`,
+and the others wait for a slot.
+"""
+
+import hashlib
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterable, List
+
+EMBEDDING_DIM = 256
+WORD_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]+")
+NANOSECONDS = 1e9
+REVIEW = (
+    "1. 🧰 **MR Type**: 📡 Enhancement\n"
+    "2. 📝 **Summary**: The change looks consistent with the codebase.\n"
+    "3. 🔍 **Review**: No blocking issues found.\n"
+    "4. ✅ Approved\n"
+)
+
+
+def fake_embedding(text: str, dim: int = EMBEDDING_DIM) -> List[float]:
+    vector: List[float] = [0.0] * dim
+
+    for word in WORD_PATTERN.findall(text):
+        digest: bytes = hashlib.md5(word.lower().encode()).digest()
+        bucket: int = int.from_bytes(digest[:4], "little") % dim
+        vector[bucket] += 1.0 if digest[4] % 2 else -1.0
+
+    return vector
+
+
+def review_tokens(count: int) -> List[str]:
+    words: List[str] = REVIEW.split(" ")
+    padding: int = max(count - len(words), 0)
+    return [f"{word} " for word in words[:-1]] + ["filler "] * padding + words[-1:]
+
+
+class FakeOllamaServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address,
+        tokens_per_second: float = 50.0,
+        prompt_tokens_per_second: float = 2000.0,
+        response_tokens: int = 200,
+        parallel: int = 4,
+        models: Iterable[str] = ("fake:latest",),
+    ):
+        super().__init__(address, FakeOllamaHandler)
+        self.tokens_per_second = tokens_per_second
+        self.prompt_tokens_per_second = prompt_tokens_per_second
+        self.response_tokens = response_tokens
+        self.slots = threading.BoundedSemaphore(parallel)
+        self.models = list(models)
+        self.generations: int = 0
+
+
+class FakeOllamaHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeOllamaServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status: int = 200) -> None:
+        body: bytes = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def read_json(self):
+        length: int = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def send_chunk(self, payload: Dict[str, Any]) -> None:
+        line: bytes = json.dumps(payload).encode() + b"\n"
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(line), line))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json({"models": [{"name": m} for m in self.server.models]})
+        else:
+            self.send_json({"error": f"{self.path} not found"}, status=404)
+
+    def do_POST(self):
+        payload = self.read_json()
+
+        if self.path == "/api/embeddings":
+            self.send_json({"embedding": fake_embedding(payload.get("prompt", ""))})
+        elif self.path == "/api/generate":
+            with self.server.slots:
+                self.generate(payload)
+        else:
+            self.send_json({"error": f"{self.path} not found"}, status=404)
+
+    def generate(self, payload: Dict[str, Any]) -> None:
+        server: FakeOllamaServer = self.server
+        prompt: str = payload.get("system", "") + payload.get("prompt", "")
+        prompt_tokens: int = len(prompt) // 4
+        limit: int = payload.get("options", {}).get("num_predict", -1)
+        tokens: List[str] = review_tokens(server.response_tokens)
+
+        if limit > 0:
+            tokens = tokens[-limit:]
+
+        prompt_seconds: float = prompt_tokens / server.prompt_tokens_per_second
+        time.sleep(prompt_seconds)
+        server.generations += 1
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        start: float = time.monotonic()
+
+        try:
+            for token in tokens:
+                time.sleep(1 / server.tokens_per_second)
+                self.send_chunk({"response": token, "done": False})
+
+            self.send_chunk(
+                {
+                    "response": "",
+                    "done": True,
+                    "done_reason": "stop",
+                    "prompt_eval_count": prompt_tokens,
+                    "prompt_eval_duration": int(prompt_seconds * NANOSECONDS),
+                    "eval_count": len(tokens),
+                    "eval_duration": int((time.monotonic() - start) * NANOSECONDS),
+                }
+            )
+            self.wfile.write(b"0\r\n\r\n")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client aborted the generation
+            pass
+
+
+def start_fake_ollama(
+    host: str = "127.0.0.1", port: int = 0, **options: Any
+) -> FakeOllamaServer:
+    server = FakeOllamaServer((host, port), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
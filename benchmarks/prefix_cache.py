@@ -0,0 +1,103 @@
+"""
+Measures how much prompt evaluation Ollama saves on a project's second review.
+
+Usage: python benchmarks/prefix_cache.py [--host http://localhost:11434]
+    [--model llama3:8b]
+
+Needs a running Ollama server. Three prompts are generated with a few tokens
+each and the prompt-eval time of each is printed:
+- `cold`: the first review of a synthetic project.
+- `warm`: another MR of the same project at the same commit, sharing the
+    instructions and project overview prefix with the first review.
+- `control`: the same MR with an altered project overview, so no prefix is
+    shared and the whole prompt is evaluated again.
+"""
+
+import argparse
+import random
+from typing import Any, Dict, List
+
+import ollama
+
+from iamksm_bot.app.generation import GenerationStats, stream_generate
+from iamksm_bot.app.prompt import PromptBuilder
+from iamksm_bot.app.template import PROMPT_TEMPLATE, SYSTEM_PERSONA
+
+WORDS: List[str] = [f"symbol_{i}" for i in range(500)]
+
+
+def synthetic_files(files: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    return [f"pkg_{rng.randrange(40)}/{rng.choice(WORDS)}_{i}.py" for i in range(files)]
+
+
+def synthetic_mr(number: int, lines: int = 60) -> Dict[str, Any]:
+    rng = random.Random(number)
+    path: str = f"pkg_{number}/feature_{number}.py"
+    diff: str = "\n".join(
+        f"+def {rng.choice(WORDS)}({rng.choice(WORDS)}): return {rng.choice(WORDS)}"
+        for _ in range(lines)
+    )
+    return {
+        "mr_title": f"Add feature {number}",
+        "mr_desc": f"Implements feature {number} of the synthetic project.",
+        "commits": [{"title": f"Add feature {number}", "message": ""}],
+        "changes": [{"new_path": path, "new_file": True, "diff": diff}],
+    }
+
+
+def build_prompt(
+    builder: PromptBuilder, files: List[str], sha: str, mr: Dict[str, Any]
+) -> str:
+    sections: Dict[str, str] = builder.sections(
+        project="benchmarks/synthetic",
+        project_sha=sha,
+        project_files=files,
+        repo={},
+        file_paths_context={},
+        **mr,
+    )
+    return builder.render(PROMPT_TEMPLATE, sections).text
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--host", default="http://localhost:11434")
+    parser.add_argument("--model", default="llama3:8b")
+    parser.add_argument("--files", type=int, default=400)
+    parser.add_argument("--keep-alive", default="30m")
+    args = parser.parse_args()
+
+    client = ollama.Client(host=args.host)
+    builder = PromptBuilder()
+    files: List[str] = synthetic_files(args.files)
+    runs: Dict[str, str] = {
+        "cold": build_prompt(builder, files, "a" * 40, synthetic_mr(1)),
+        "warm": build_prompt(builder, files, "a" * 40, synthetic_mr(2)),
+        "control": build_prompt(
+            builder, synthetic_files(args.files, seed=1), "b" * 40, synthetic_mr(2)
+        ),
+    }
+
+    print(f"{'run':>8} {'prompt tok':>11} {'eval s':>8} {'tok/s':>9}")
+
+    for name, prompt in runs.items():
+        stats: GenerationStats
+        _, stats = stream_generate(
+            client=client,
+            model=args.model,
+            prompt=prompt,
+            system=SYSTEM_PERSONA,
+            options={"temperature": 0},
+            timeout=600,
+            max_tokens=8,
+            keep_alive=args.keep_alive,
+        )
+        print(
+            f"{name:>8} {stats.prompt_tokens:>11} {stats.prompt_eval_seconds:>8.2f} "
+            f"{stats.prompt_tokens_per_second:>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
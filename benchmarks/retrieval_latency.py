@@ -0,0 +1,89 @@
+"""
+Measures embedding index build time and retrieval latency against repo size.
+
+Usage: python benchmarks/retrieval_latency.py [--sizes 100 1000 5000]
+
+Runs against the deterministic fake Ollama server in `fake_ollama.py`, so the
+numbers reflect indexing and search overhead rather than model speed.
+"""
+
+import argparse
+import random
+import statistics
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import ollama
+from fake_ollama import start_fake_ollama
+
+from iamksm_bot.app.retrieval import EmbeddingIndex, OllamaEmbedder, retrieve_context
+
+WORDS: List[str] = [f"symbol_{i}" for i in range(2000)]
+
+
+def synthetic_repo(files: int, lines: int = 120) -> Dict[str, str]:
+    rng = random.Random(files)
+    return {
+        f"pkg_{i % 20}/module_{i}.py": "\n".join(
+            f"def {rng.choice(WORDS)}({rng.choice(WORDS)}): return {rng.choice(WORDS)}"
+            for _ in range(lines)
+        )
+        for i in range(files)
+    }
+
+
+def synthetic_changes(repo: Dict[str, str], count: int = 5) -> List[Dict[str, str]]:
+    paths: List[str] = sorted(repo)[:count]
+    return [
+        {
+            "new_path": path,
+            "diff": "@@ -1,3 +1,3 @@\n"
+            + "\n".join(f"+{line}" for line in repo[path].splitlines()[:3]),
+        }
+        for path in paths
+    ]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", nargs="+", type=int, default=[100, 1000, 5000])
+    parser.add_argument("--queries", type=int, default=20)
+    parser.add_argument("--top-k", type=int, default=20)
+    args = parser.parse_args()
+
+    server = start_fake_ollama()
+    client = ollama.Client(host=f"http://127.0.0.1:{server.server_address[1]}")
+    embed = OllamaEmbedder(model="fake", executor=ThreadPoolExecutor(16), client=client)
+
+    print(f"{'files':>8} {'chunks':>8} {'build s':>9} {'p50 ms':>8} {'p95 ms':>8}")
+
+    for size in args.sizes:
+        repo: Dict[str, str] = synthetic_repo(size)
+        changes = synthetic_changes(repo)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            start: float = time.perf_counter()
+            index = EmbeddingIndex.build(Path(tmp) / "index", repo, embed, "fake")
+            build: float = time.perf_counter() - start
+
+            latencies: List[float] = []
+
+            for _ in range(args.queries):
+                start = time.perf_counter()
+                retrieve_context(index, repo, changes, embed, args.top_k)
+                latencies.append((time.perf_counter() - start) * 1000)
+
+            p95: float = statistics.quantiles(latencies, n=20)[-1]
+            print(
+                f"{size:>8} {len(index.meta):>8} {build:>9.2f} "
+                f"{statistics.median(latencies):>8.1f} {p95:>8.1f}"
+            )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Replays bursts of merge request webhooks against the review bot and reports
+review latency, throughput, peak memory and time spent per stage.
+
+Usage: python benchmarks/review_throughput.py [--projects 2] [--mrs 20]
+    [--burst 10] [--app flask|asgi]
+
+GitLab and Ollama are replaced by the local servers in `fake_gitlab.py` and
+`fake_ollama.py`, so the numbers reflect the bot's own overhead under the
+configured GitLab latency and model speed. The fake servers run in the
+benchmark process, so peak RSS includes them and the synthetic projects.
+`--app asgi` needs `iamksm-bot[asgi]`.
+"""
+
+import argparse
+import json
+import logging
+import os
+import resource
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import httpx
+import yaml
+from fake_gitlab import (
+    SyntheticMR,
+    SyntheticProject,
+    merge_request_event,
+    start_fake_gitlab,
+    synthetic_project,
+)
+from fake_ollama import start_fake_ollama
+
+HEADER_TOKEN = "benchmark"
+REPO_ROOT = Path(__file__).resolve().parent.parent
+
+
+def write_config(
+    args: argparse.Namespace, gitlab_url: str, ollama_url: str, tmp: Path
+) -> Path:
+    config: Dict[str, Any] = yaml.safe_load(
+        (REPO_ROOT / "config-example.yml").read_text()
+    )
+    config.update(
+        GITLAB_URL=gitlab_url,
+        GITLAB_TOKEN="benchmark",
+        GITLAB_HEADER_TOKEN=HEADER_TOKEN,
+        REPO_INSTALL_PATH=str(tmp / "repos"),
+        REVIEW_QUEUE="memory",
+        REVIEW_DEBOUNCE_SECONDS=0,
+        REVIEW_CONCURRENCY=args.concurrency,
+        REVIEW_STATE_PATH=str(tmp / "state.sqlite3"),
+        RESPONSE_CACHE_ENABLED=False,
+        RESPONSE_CACHE_PATH=str(tmp / "responses"),
+        BLOB_CACHE_PATH=str(tmp / "blobs"),
+        OLLAMA_MODEL="fake",
+        OLLAMA_MODEL_RULES=[],
+        OLLAMA_ENDPOINTS=[{"host": ollama_url, "concurrency": args.model_slots}],
+    )
+    path: Path = tmp / "config.yml"
+    path.write_text(yaml.safe_dump(config))
+    return path
+
+
+def serve_flask(port: int) -> None:
+    from werkzeug.serving import make_server
+
+    from iamksm_bot.app.webhook import create_app
+
+    server = make_server("127.0.0.1", port, create_app(), threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+
+def serve_asgi(port: int) -> None:
+    import uvicorn
+
+    from iamksm_bot.app.asgi import create_app
+
+    server = uvicorn.Server(
+        uvicorn.Config(
+            create_app,
+            factory=True,
+            host="127.0.0.1",
+            port=port,
+            log_level="warning",
+        )
+    )
+    threading.Thread(target=server.run, daemon=True).start()
+
+    while not server.started:
+        time.sleep(0.05)
+
+
+def free_port() -> int:
+    import socket
+
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def replay(
+    url: str,
+    mrs: List[Tuple[SyntheticProject, SyntheticMR]],
+    burst: int,
+    interval: float,
+) -> Dict[Tuple[int, int], float]:
+    """
+    Posts the webhook events of `mrs` in bursts of `burst` concurrent
+    requests, `interval` seconds apart, returning when each was sent.
+    """
+    sent: Dict[Tuple[int, int], float] = {}
+
+    def post(item: Tuple[SyntheticProject, SyntheticMR]) -> None:
+        project, mr = item
+        sent[(project.id, mr.iid)] = time.monotonic()
+        response = httpx.post(
+            url,
+            content=json.dumps(merge_request_event(project, mr)),
+            headers={
+                "X-Gitlab-Token": HEADER_TOKEN,
+                "Content-Type": "application/json",
+            },
+        )
+        response.raise_for_status()
+
+    with ThreadPoolExecutor(max_workers=burst) as executor:
+        for start in range(0, len(mrs), burst):
+            end: int = start + burst
+            list(executor.map(post, mrs[start:end]))
+
+            if end < len(mrs):
+                time.sleep(interval)
+
+    return sent
+
+
+def wait_for_reviews(gitlab, expected: int, timeout: float) -> Dict:
+    deadline: float = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        reviewed = gitlab.reviewed_at()
+
+        if len(reviewed) >= expected:
+            return reviewed
+
+        time.sleep(0.1)
+
+    return gitlab.reviewed_at()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    ordered: List[float] = sorted(values)
+    index: int = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+def report(
+    sent: Dict[Tuple[int, int], float],
+    reviewed: Dict[Tuple[int, int], float],
+    wall_seconds: float,
+) -> None:
+    from iamksm_bot.app.metrics import STAGE_SECONDS
+
+    latencies: List[float] = [
+        reviewed[key] - sent[key] for key in sent if key in reviewed
+    ]
+    print(f"reviews          {len(latencies)}/{len(sent)}")
+
+    if latencies:
+        print(
+            "latency s        "
+            f"p50 {percentile(latencies, 0.5):.2f}  "
+            f"p90 {percentile(latencies, 0.9):.2f}  "
+            f"p99 {percentile(latencies, 0.99):.2f}  "
+            f"max {max(latencies):.2f}  "
+            f"mean {statistics.mean(latencies):.2f}"
+        )
+
+    print(f"reviews/minute   {len(latencies) / wall_seconds * 60:.1f}")
+    # Linux reports the peak resident set size in kilobytes
+    peak_mb: float = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak RSS MB      {peak_mb:.1f}")
+    print(f"\n{'stage':<18} {'count':>6} {'total s':>9} {'mean ms':>9}")
+
+    totals = sorted(STAGE_SECONDS.totals().items(), key=lambda item: -item[1][1])
+
+    for (stage,), (count, total) in totals:
+        print(f"{stage:<18} {count:>6} {total:>9.2f} {total / count * 1000:>9.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--app", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--projects", type=int, default=2)
+    parser.add_argument("--files", type=int, default=300)
+    parser.add_argument("--lines", type=int, default=90)
+    parser.add_argument("--mrs", type=int, default=10, help="MRs per project")
+    parser.add_argument("--changed-files", type=int, default=5)
+    parser.add_argument("--added-lines", type=int, default=20)
+    parser.add_argument("--burst", type=int, default=10)
+    parser.add_argument("--interval", type=float, default=1.0)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--model-slots", type=int, default=4)
+    parser.add_argument("--gitlab-latency", type=float, default=0.02)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--prompt-tokens-per-second", type=float, default=20000.0)
+    parser.add_argument("--response-tokens", type=int, default=150)
+    parser.add_argument("--timeout", type=float, default=600.0)
+    parser.add_argument("--verbose", action="store_true", help="Log every stage")
+    args = parser.parse_args()
+
+    projects: List[SyntheticProject] = [
+        synthetic_project(
+            project_id,
+            files=args.files,
+            lines=args.lines,
+            mrs=args.mrs,
+            changed_files=args.changed_files,
+            added_lines=args.added_lines,
+        )
+        for project_id in range(1, args.projects + 1)
+    ]
+    gitlab = start_fake_gitlab(projects, latency=args.gitlab_latency)
+    ollama = start_fake_ollama(
+        tokens_per_second=args.tokens_per_second,
+        prompt_tokens_per_second=args.prompt_tokens_per_second,
+        response_tokens=args.response_tokens,
+        parallel=args.model_slots,
+    )
+    ollama_url: str = f"http://127.0.0.1:{ollama.server_address[1]}"
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["CONFIG_FILE_PATH"] = str(
+            write_config(args, gitlab.url, ollama_url, Path(tmp))
+        )
+        sys.path.insert(0, str(REPO_ROOT))
+        port: int = free_port()
+
+        if args.app == "flask":
+            serve_flask(port)
+        else:
+            serve_asgi(port)
+
+        if not args.verbose:
+            logging.getLogger().setLevel(logging.WARNING)
+            logging.getLogger("werkzeug").setLevel(logging.WARNING)
+
+        # Interleave projects, like webhooks from a busy GitLab instance
+        mrs: List[Tuple[SyntheticProject, SyntheticMR]] = [
+            (project, project.merge_requests[iid])
+            for iid in range(1, args.mrs + 1)
+            for project in projects
+        ]
+        start: float = time.monotonic()
+        sent = replay(
+            f"http://127.0.0.1:{port}/review-mr", mrs, args.burst, args.interval
+        )
+        reviewed = wait_for_reviews(gitlab, len(mrs), args.timeout)
+        wall_seconds: float = max(reviewed.values(), default=start) - start
+
+        print(
+            f"\n{args.app} app, {len(projects)} projects of {args.files} files, "
+            f"{len(mrs)} MRs in bursts of {args.burst}, "
+            f"{gitlab.requests} GitLab requests, "
+            f"{ollama.generations} generations\n"
+        )
+        report(sent, reviewed, max(wall_seconds, 1e-9))
+
+
+if __name__ == "__main__":
+    main()
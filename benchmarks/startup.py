@@ -0,0 +1,200 @@
+"""
+Measures how long a fresh process takes to import the webhook, create the
+app and answer its first merge request event, with GitLab unreachable.
+
+Usage: python benchmarks/startup.py [--runs 5] [--app flask|asgi]
+    [--gitlab-url http://10.255.255.1]
+
+Every run starts a new interpreter so imports are cold. The default GitLab
+URL is a non-routable address, so any request to it hangs until it times
+out, which is what a slow or unreachable GitLab looks like to a worker.
+The time until the reviewer was built in the background is reported too.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+import yaml
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+HEADER_TOKEN = "benchmark"
+EVENT: Dict[str, Any] = {
+    "event_type": "merge_request",
+    "project": {"id": 1},
+    "object_attributes": {
+        "iid": 1,
+        "action": "open",
+        "state": "opened",
+        "draft": False,
+        "work_in_progress": False,
+        "blocking_discussions_resolved": True,
+        "last_commit": {"id": "0" * 40},
+    },
+}
+# Seconds a run waits for the background build of the reviewer
+REVIEWER_WAIT = 30.0
+
+
+def write_config(gitlab_url: str, tmp: Path) -> Path:
+    config: Dict[str, Any] = yaml.safe_load(
+        (REPO_ROOT / "config-example.yml").read_text()
+    )
+    config.update(
+        GITLAB_URL=gitlab_url,
+        GITLAB_TOKEN="benchmark",
+        GITLAB_HEADER_TOKEN=HEADER_TOKEN,
+        REPO_INSTALL_PATH=str(tmp / "repos"),
+        REVIEW_QUEUE="memory",
+        # Keep the event queued, only the startup is measured
+        REVIEW_DEBOUNCE_SECONDS=3600,
+        REVIEW_STATE_PATH=str(tmp / "state.sqlite3"),
+        RESPONSE_CACHE_PATH=str(tmp / "responses"),
+        BLOB_CACHE_PATH=str(tmp / "blobs"),
+    )
+    path: Path = tmp / "config.yml"
+    path.write_text(yaml.safe_dump(config))
+    return path
+
+
+def wait_until_built(lazy) -> float | None:
+    deadline: float = time.perf_counter() + REVIEWER_WAIT
+
+    while not lazy.built:
+        if time.perf_counter() > deadline:
+            return None
+
+        time.sleep(0.01)
+
+    return time.perf_counter()
+
+
+def run_flask(start: float) -> Dict[str, float | None]:
+    from iamksm_bot.app import webhook
+
+    imported: float = time.perf_counter()
+    app = webhook.create_app()
+    created: float = time.perf_counter()
+    response = app.test_client().post(
+        "/review-mr", json=EVENT, headers={"X-Gitlab-Token": HEADER_TOKEN}
+    )
+    assert response.status_code == 200, response.status_code
+    answered: float = time.perf_counter()
+    built: float | None = wait_until_built(webhook.REVIEWER)
+
+    return {
+        "import": imported - start,
+        "create_app": created - start,
+        "first_response": answered - start,
+        "reviewer_built": None if built is None else built - start,
+    }
+
+
+async def run_asgi(start: float) -> Dict[str, float | None]:
+    import httpx
+
+    from iamksm_bot.app import asgi
+
+    imported: float = time.perf_counter()
+    app = asgi.create_app()
+    created: float = time.perf_counter()
+    messages: asyncio.Queue = asyncio.Queue()
+    await messages.put({"type": "lifespan.startup"})
+    sent: List[Dict[str, Any]] = []
+
+    async def send(message: Dict[str, Any]) -> None:
+        sent.append(message)
+
+    lifespan = asyncio.create_task(app({"type": "lifespan"}, messages.get, send))
+
+    while not sent:
+        await asyncio.sleep(0)
+
+    transport = httpx.ASGITransport(app=app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://bot") as client:
+        response = await client.post(
+            "/review-mr", json=EVENT, headers={"X-Gitlab-Token": HEADER_TOKEN}
+        )
+
+    assert response.status_code == 200, response.status_code
+    answered: float = time.perf_counter()
+    built: float | None = await asyncio.to_thread(wait_until_built, asgi.PIPELINE)
+    await messages.put({"type": "lifespan.shutdown"})
+    await lifespan
+
+    return {
+        "import": imported - start,
+        "create_app": created - start,
+        "first_response": answered - start,
+        "reviewer_built": None if built is None else built - start,
+    }
+
+
+def child(app: str) -> None:
+    start: float = time.perf_counter()
+    sys.path.insert(0, str(REPO_ROOT))
+
+    if app == "flask":
+        timings = run_flask(start)
+    else:
+        timings = asyncio.run(run_asgi(start))
+
+    print(json.dumps(timings))
+    sys.stdout.flush()
+    # Skip waiting on the background GitLab authentication
+    os._exit(0)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--app", choices=("flask", "asgi"), default="flask")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--gitlab-url", default="http://10.255.255.1")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return child(args.app)
+
+    runs: List[Dict[str, float | None]] = []
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env: Dict[str, str] = {
+            **os.environ,
+            "CONFIG_FILE_PATH": str(write_config(args.gitlab_url, Path(tmp))),
+        }
+
+        for _ in range(args.runs):
+            output: str = subprocess.run(
+                [sys.executable, __file__, "--child", "--app", args.app],
+                env=env,
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"\n{args.app} app, GitLab at {args.gitlab_url}, {args.runs} cold starts\n")
+    print(f"{'seconds since start':<22} {'median':>8} {'max':>8}")
+
+    for name in ("import", "create_app", "first_response", "reviewer_built"):
+        values: List[float] = [run[name] for run in runs if run[name] is not None]
+
+        if not values:
+            print(f"{name:<22} {'-':>8} {'-':>8}")
+            continue
+
+        print(f"{name:<22} {statistics.median(values):>8.3f} {max(values):>8.3f}")
+
+
+if __name__ == "__main__":
+    main()
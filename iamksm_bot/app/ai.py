@@ -1,143 +1,556 @@
-import base64
+import contextvars
+import fnmatch
 import logging
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from typing import Any, Dict, Iterable, List
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Event, Lock, Thread
+from typing import Any, Dict, Iterable, List, Mapping, Set, Tuple
 
-import gitlab
-import ollama
-import ollama._client
-from gitlab.base import RESTObjectList
+import requests
+from gitlab.exceptions import GitlabError
 from gitlab.v4.objects.merge_request_approvals import ProjectMergeRequestApproval
 from gitlab.v4.objects.merge_requests import ProjectMergeRequest
 from gitlab.v4.objects.projects import Project
-from requests import Response
 
-from iamksm_bot.app.template import PROMPT_TEMPLATE, SYSTEM_PERSONA
-from iamksm_bot.app.utils import download_and_read_repo_files_from_path, timer
+from iamksm_bot.app.cache import BlobCache, ResponseCache, cache_key, normalize_diff
+from iamksm_bot.app.context import (
+    ContextPlan,
+    ContextPlanner,
+    changed_lines,
+    identifiers,
+)
+from iamksm_bot.app.depindex import INDEX_FILENAME, DependencyIndex
+from iamksm_bot.app.gitlab_client import BlobReader, create_gitlab
+from iamksm_bot.app.ingest import ArchiveContents, IngestFilter
+from iamksm_bot.app.mapreduce import diff_tokens, split_review_units
+from iamksm_bot.app.mirror import GitMirror
+from iamksm_bot.app.modelpool import ModelPool, ModelRule, select_model
+from iamksm_bot.app.prompt import PromptBuilder
+from iamksm_bot.app.retrieval import (
+    INDEX_DIRNAME,
+    EmbeddingIndex,
+    OllamaEmbedder,
+    retrieve_context,
+)
+from iamksm_bot.app.scheduler import raise_if_cancelled
+from iamksm_bot.app.snapshots import SnapshotStore
+from iamksm_bot.app.state import ReviewState, ReviewStateStore, summarize_review
+from iamksm_bot.app.template import (
+    FOLLOWUP_TEMPLATE,
+    PROMPT_TEMPLATE,
+    REDUCE_TEMPLATE,
+    SYSTEM_PERSONA,
+    TEMPLATE_VERSION,
+    UNIT_REVIEW_TEMPLATE,
+)
+from iamksm_bot.app.tracing import span, trace
+from iamksm_bot.app.utils import LruCache, timer
 from iamksm_bot.config.settings import settings
 
 LOGGER: logging.Logger = logging.getLogger(__name__)
 GITLAB_URL: str = settings.GITLAB_URL
 GITLAB_TOKEN: str = settings.GITLAB_TOKEN
+GITLAB_BLOB_BATCH_SIZE = settings.GITLAB_BLOB_BATCH_SIZE
 REPO_INSTALL_PATH = settings.REPO_INSTALL_PATH
+REPO_CACHE_QUOTA_MB = settings.REPO_CACHE_QUOTA_MB
+REPO_SOURCE = settings.REPO_SOURCE
+REPO_CONTENTS_CACHE_SIZE = settings.REPO_CONTENTS_CACHE_SIZE
 OLLAMA_OPTIONS = settings.OLLAMA_OPTIONS
 OLLAMA_MODEL = settings.OLLAMA_MODEL
+OLLAMA_TIMEOUT = settings.OLLAMA_TIMEOUT
+OLLAMA_MAX_TOKENS = settings.OLLAMA_MAX_TOKENS
+OLLAMA_KEEP_ALIVE = settings.OLLAMA_KEEP_ALIVE
+MAP_REDUCE_MIN_FILES = settings.MAP_REDUCE_MIN_FILES
+MAP_REDUCE_MIN_DIFF_TOKENS = settings.MAP_REDUCE_MIN_DIFF_TOKENS
+MAP_REDUCE_UNIT_TOKENS = settings.MAP_REDUCE_UNIT_TOKENS
+RESPONSE_CACHE_ENABLED = settings.RESPONSE_CACHE_ENABLED
+RESPONSE_CACHE_HIT_ACTION = settings.RESPONSE_CACHE_HIT_ACTION
+INCREMENTAL_REVIEW = settings.INCREMENTAL_REVIEW
+REVIEW_SUMMARY_CHARS = settings.REVIEW_SUMMARY_CHARS
+CONTEXT_TOKEN_BUDGET = settings.CONTEXT_TOKEN_BUDGET
+CONTEXT_SHORTLIST_SIZE = settings.CONTEXT_SHORTLIST_SIZE
+PROMPT_CONTEXT_LINES = settings.PROMPT_CONTEXT_LINES
+PROJECT_OVERVIEW_TOKENS = settings.PROJECT_OVERVIEW_TOKENS
+RETRIEVAL_ENABLED = settings.RETRIEVAL_ENABLED
+RETRIEVAL_TOP_K = settings.RETRIEVAL_TOP_K
+EMBEDDING_MODEL = settings.EMBEDDING_MODEL
+PREWARM_BRANCHES = settings.PREWARM_BRANCHES
 GITLAB_BOT_USER_ID = 352
 
 
+@dataclass
+class ContextHints:
+    """
+    What context selection reads from the snapshot's index, worked out once
+    per review and shared by the parts of a large MR.
+
+    - `related`: Paths the dependency index relates to the changed files.
+    - `mentions`: Paths defining identifiers the diff uses.
+    - `embeddings`: The snapshot's embedding index, with retrieval enabled.
+    """
+
+    related: Set[str] = field(default_factory=set)
+    mentions: Set[str] = field(default_factory=set)
+    embeddings: EmbeddingIndex | None = None
+
+
+@dataclass
+class ReviewPlan:
+    """
+    Everything gathered for a review before the model is called.
+    """
+
+    project: Project
+    mr: ProjectMergeRequest
+    mr_changes: Dict[str, Any]
+    approvals: ProjectMergeRequestApproval
+    review_changes: Dict[str, Any]
+    previous: ReviewState | None
+    context_sha: str
+    file_paths_context: Dict[str, str]
+    repo_contents: Dict[str, str]
+    repo_context: Dict[str, str]
+    response_key: str
+    model: str
+    reviewed: List[str]
+    response: str | None = None
+
+    @property
+    def head_sha(self) -> str | None:
+        return (self.mr_changes.get("diff_refs") or {}).get("head_sha")
+
+    @property
+    def mr_ref(self) -> str:
+        return f"{self.project.id}!{self.mr.iid}"
+
+
 class IAMKSM:
     def __init__(self):
-        self.gl = gitlab.Gitlab(url=GITLAB_URL, private_token=GITLAB_TOKEN)
-        self.gl.auth()
         workers: int = min(os.cpu_count() * 5, 10)
+        self.gl = create_gitlab(
+            url=GITLAB_URL, private_token=GITLAB_TOKEN, pool_size=workers
+        )
+        # Credentials are checked in the background, reviews need no user
+        Thread(target=self.authenticate, name="gitlab-auth", daemon=True).start()
+        self.blobs = BlobReader(
+            self.gl,
+            batch_size=GITLAB_BLOB_BATCH_SIZE,
+            cache=BlobCache(
+                path=settings.BLOB_CACHE_PATH,
+                memory_bytes=settings.BLOB_CACHE_MEMORY_MB * 1024 * 1024,
+                max_bytes=settings.BLOB_CACHE_MAX_MB * 1024 * 1024,
+            ),
+        )
         self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.snapshots = SnapshotStore(
+            base_path=REPO_INSTALL_PATH,
+            quota_bytes=REPO_CACHE_QUOTA_MB * 1024 * 1024,
+        )
+        self.ingest_filter = IngestFilter(
+            max_file_bytes=settings.INGEST_MAX_FILE_KB * 1024,
+            skip_extensions=tuple(settings.INGEST_SKIP_EXTENSIONS),
+            denylist=tuple(settings.INGEST_DENYLIST),
+        )
+        self.response_cache = ResponseCache(
+            path=settings.RESPONSE_CACHE_PATH,
+            ttl_seconds=settings.RESPONSE_CACHE_TTL_HOURS * 3600,
+            max_bytes=settings.RESPONSE_CACHE_MAX_MB * 1024 * 1024,
+        )
+        self.review_state = ReviewStateStore(path=settings.REVIEW_STATE_PATH)
+        self.context_planner = ContextPlanner(
+            token_budget=CONTEXT_TOKEN_BUDGET, shortlist_size=CONTEXT_SHORTLIST_SIZE
+        )
+        self.prompt_builder = PromptBuilder(
+            context_lines=PROMPT_CONTEXT_LINES,
+            overview_tokens=PROJECT_OVERVIEW_TOKENS,
+        )
+        self.model_pool = ModelPool(
+            endpoints=settings.OLLAMA_ENDPOINTS,
+            timeout=OLLAMA_TIMEOUT,
+            health_interval=settings.OLLAMA_HEALTH_INTERVAL,
+        )
+        self.model_rules: List[ModelRule] = [
+            ModelRule.from_config(rule) for rule in settings.OLLAMA_MODEL_RULES
+        ]
+        self.ollama = self.model_pool.endpoints[0].client
+        self.model_executor = ThreadPoolExecutor(
+            max_workers=self.model_pool.capacity, thread_name_prefix="model"
+        )
+        self.embedder = OllamaEmbedder(
+            model=EMBEDDING_MODEL, executor=self.executor, client=self.ollama
+        )
+        self.mirrors: Dict[int, GitMirror] = {}
+        self._mirrors_lock = Lock()
+        self._contents: LruCache[Mapping[str, str]] = LruCache(REPO_CONTENTS_CACHE_SIZE)
+        self._dependency_indexes: LruCache[DependencyIndex] = LruCache(
+            REPO_CONTENTS_CACHE_SIZE
+        )
+        self._embedding_indexes: LruCache[EmbeddingIndex] = LruCache(
+            REPO_CONTENTS_CACHE_SIZE
+        )
 
-    def read_blob(self, path, project: Project, default_branch: str) -> str:
-        file = project.files.get(file_path=path, ref=default_branch)
-        file_contents = base64.b64decode(file.content).decode("utf-8")
+    def authenticate(self) -> bool:
+        try:
+            self.gl.auth()
+        except (GitlabError, requests.RequestException) as error:
+            LOGGER.error(f"Could not authenticate with GitLab at {GITLAB_URL}: {error}")
+            return False
 
-        return file_contents.replace("\\n", "\n")
+        LOGGER.info(f"Authenticated with GitLab at {GITLAB_URL}")
+        return True
 
-    def set_file_path(self, file_path, project, default_branch, repo_files_content):
-        content: str = self.read_blob(file_path, project, default_branch)
-        repo_files_content[file_path] = content
+    def read_tree(self, project: Project, ref: str) -> Dict[str, str]:
+        # A single recursive listing already walks every subdirectory
+        paths: List[str] = [
+            item["path"]
+            for item in project.repository_tree(recursive=True, ref=ref, all=True)
+            if item["type"] == "blob"
+        ]
 
-    def work_on_item(
-        self,
-        item: Dict[str, Any],
-        repo_files_content: Dict[str, str],
-        project: Project,
-        default_branch: str,
-    ) -> None:
-        if item["type"] == "blob" and item["path"]:
-            self.executor.submit(
-                self.set_file_path,
-                item["path"],
-                project,
-                default_branch,
-                repo_files_content,
+        return self.blobs.read_files(project, ref, paths)
+
+    def get_repo_context(self, project: Project, default_branch: str) -> Dict[str, Any]:
+        return self.read_tree(project=project, ref=default_branch)
+
+    def map_changes_to_file_path(
+        self, project: Project, changes: Iterable, ref: str
+    ) -> Dict[str, str]:
+        return self.blobs.read_files(
+            project=project,
+            ref=ref,
+            paths=(change["new_path"] for change in changes),
+        )
+
+    def fetch_merge_request(
+        self, project: Project, mr_id: int
+    ) -> Tuple[ProjectMergeRequest, Dict[str, Any], ProjectMergeRequestApproval]:
+        """
+        Fetches the changes, commits and approvals of an MR concurrently.
+
+        Explanation:
+        - The changes endpoint already returns every MR attribute, so the MR
+            itself is not fetched separately.
+        - The commits are stored under `commits` in the returned changes.
+
+        Args:
+        - `project`: Project object representing the project.
+        - `mr_id`: Integer representing the merge request ID.
+
+        Returns:
+        - The merge request, its changes and its approvals.
+        """
+        mr: ProjectMergeRequest = project.mergerequests.get(id=mr_id, lazy=True)
+
+        with span("mr_fetch") as current:
+            changes: Future = self.executor.submit(mr.changes)
+            commits: Future = self.executor.submit(mr.commits, all=True)
+            approvals: Future = self.executor.submit(mr.approvals.get)
+
+            mr_changes: Dict[str, Any] = changes.result()
+            mr_changes["commits"] = [commit.attributes for commit in commits.result()]
+            current.record(
+                files=len(mr_changes["changes"]),
+                bytes=sum(len(c.get("diff", "")) for c in mr_changes["changes"]),
             )
 
-        elif item["type"] == "tree":
-            self.read_tree(
-                project=project,
-                default_branch=default_branch,
-                file_path=item["path"],
-                repo_files_content=repo_files_content,
+            return mr, mr_changes, approvals.result()
+
+    def map_changes_to_file_paths(self, project: Project, mr_changes) -> Dict[str, str]:
+        """
+        Reads the changed files as they are in the MR, at its head commit.
+
+        Deleted files are left out. Until GitLab has computed the diff refs of
+        a new MR, the files are read from the source branch.
+        """
+        diff_refs: Dict[str, str] = mr_changes.get("diff_refs") or {}
+        ref: str = diff_refs.get("head_sha") or mr_changes["source_branch"]
+        changes: List[Dict[str, Any]] = [
+            change for change in mr_changes["changes"] if not change.get("deleted_file")
+        ]
+
+        if REPO_SOURCE == "mirror":
+            return self.get_mirror(project).read_files(
+                sha=ref, paths=(change["new_path"] for change in changes)
             )
 
-    def read_tree(
-        self,
-        project: Project,
-        default_branch: str,
-        file_path: str = "",
-        repo_files_content=None,
-    ) -> Dict[str, str]:
-        repo_files_content: Dict[str, Any] = repo_files_content or {}
+        return self.map_changes_to_file_path(project=project, changes=changes, ref=ref)
 
-        options: Dict[str, Any] = {
-            "recursive": True,
-            "ref": default_branch,
-            "all": True,
-        }
+    def get_context_sha(self, project: Project, mr_changes) -> str:
+        diff_refs: Dict[str, str] = mr_changes.get("diff_refs") or {}
 
-        if file_path is not None:
-            options["path"] = file_path
+        if diff_refs.get("start_sha"):
+            return diff_refs["start_sha"]
 
-        for item in project.repository_tree(**options):
-            self.work_on_item(item, repo_files_content, project, default_branch)
+        # GitLab has not computed the diff yet, fall back to the target branch head
+        branch = project.branches.get(mr_changes["target_branch"])
+        return branch.commit["id"]
 
-        return repo_files_content
+    def get_mirror(self, project: Project) -> GitMirror:
+        with self._mirrors_lock:
+            if project.id not in self.mirrors:
+                self.mirrors[project.id] = GitMirror(
+                    path=Path(REPO_INSTALL_PATH) / "mirrors" / f"{project.id}.git",
+                    url=project.http_url_to_repo,
+                    token=GITLAB_TOKEN,
+                )
 
-    def get_repo_context(self, project: Project, default_branch: str) -> Dict[str, Any]:
-        repo_files_content: Dict[str, str] = {}
+            return self.mirrors[project.id]
 
-        return self.read_tree(
-            project=project,
-            default_branch=default_branch,
-            repo_files_content=repo_files_content,
+    def sync_mirror(self, project: Project, mr_changes, context_sha: str) -> None:
+        """
+        Incrementally fetches the MR source and target refs into the mirror.
+
+        Args:
+        - `project`: Project object representing the project.
+        - `mr_changes`: Dictionary containing the changes in the merge request.
+        - `context_sha`: Commit SHA used for the repository context.
+
+        Returns:
+        - None
+        """
+        diff_refs: Dict[str, str] = mr_changes.get("diff_refs") or {}
+        self.get_mirror(project).fetch(
+            refs=(
+                f"refs/heads/{mr_changes['target_branch']}",
+                f"refs/merge-requests/{mr_changes['iid']}/head",
+            ),
+            wanted=(context_sha, diff_refs.get("head_sha")),
         )
 
-    def setup_commit_info(self, commits: RESTObjectList):
-        for msg in commits:
-            yield {"Commit title": msg.title, "Commit description": msg.message}
+    def download_archive(self, project: Project, sha: str) -> bytes:
+        with span("archive_download", sha=sha) as current:
+            archive: bytes = project.repository_archive(sha=sha, format="zip")
+            current.record(bytes=len(archive))
 
-    def map_changes_to_file_path(
-        self, project: Project, changes: Iterable, default_branch: str
-    ) -> Dict[str, str]:
-        file_paths_context: Dict[str, str] = {}
+        return archive
 
-        threads = (
-            self.executor.submit(
-                self.set_file_path,
-                change["new_path"],
-                project,
-                default_branch,
-                file_paths_context,
-            )
-            for change in changes
+    def get_repository_contents(self, project: Project, sha: str) -> Mapping[str, str]:
+        """
+        Returns the files of a project at `sha`, shared by the reviews of the
+        same snapshot while it is among the `REPO_CONTENTS_CACHE_SIZE` most
+        recently used.
+        """
+        contents: Mapping[str, str] = self._contents.get(
+            (project.id, sha), lambda: self.load_repository_contents(project, sha)
         )
 
-        for t in as_completed(threads):
-            t.exception()
+        if REPO_SOURCE != "mirror":
+            # Snapshots read from memory stay the most recently used on disk
+            self.snapshots.touch(project.id, sha)
 
-        return file_paths_context
+        return contents
 
-    def map_changes_to_file_paths(self, project: Project, mr_changes) -> Dict[str, str]:
-        return self.map_changes_to_file_path(
-            project=project,
-            changes=mr_changes["changes"],
-            default_branch=project.default_branch,
+    def load_repository_contents(self, project: Project, sha: str) -> Mapping[str, str]:
+        if REPO_SOURCE == "mirror":
+            with span("ingest", source=REPO_SOURCE) as current:
+                contents: Mapping[str, str] = self.get_mirror(project).read_tree(
+                    sha, self.ingest_filter
+                )
+                current.record(files=len(contents))
+
+            return contents
+
+        archive_path: Path = self.snapshots.get(
+            project_id=project.id,
+            sha=sha,
+            download=lambda: self.download_archive(project, sha),
         )
 
-    def get_repository_contents(self, project: Project) -> Dict[str, str]:
-        zipped_archive = project.repository_archive(format="zip")
-        return download_and_read_repo_files_from_path(
-            name=project.name,
-            zipped_archive=zipped_archive,
-            base_path=REPO_INSTALL_PATH,
+        with span("ingest", source=REPO_SOURCE) as current:
+            contents = ArchiveContents(archive_path, self.ingest_filter)
+            current.record(files=len(contents), bytes=archive_path.stat().st_size)
+
+        return contents
+
+    def get_dependency_index(
+        self, project: Project, sha: str, repo_contents: Dict[str, str]
+    ) -> DependencyIndex:
+        """
+        Returns the dependency index of a snapshot, built once by the first
+        review that needs it and shared while the snapshot is among the
+        `REPO_CONTENTS_CACHE_SIZE` most recently used.
+        """
+        return self._dependency_indexes.get(
+            (project.id, sha),
+            lambda: self.load_dependency_index(project, sha, repo_contents),
+        )
+
+    def load_dependency_index(
+        self, project: Project, sha: str, repo_contents: Mapping[str, str]
+    ) -> DependencyIndex:
+        path: Path = self.snapshots.path_for(project.id, sha) / INDEX_FILENAME
+
+        # The files at a SHA never change, an index saved for it is complete
+        if path.exists():
+            index: DependencyIndex = DependencyIndex.load(path)
+
+            if index.files:
+                return index
+
+        index = DependencyIndex.load(
+            path=path,
+            seed=self.snapshots.latest_sibling(project.id, sha, INDEX_FILENAME),
+        )
+        index.update(repo_contents)
+        return index
+
+    def get_embedding_index(
+        self, project: Project, sha: str, repo_contents: Dict[str, str]
+    ) -> EmbeddingIndex:
+        return self._embedding_indexes.get(
+            (project.id, sha),
+            lambda: self.load_embedding_index(project, sha, repo_contents),
+        )
+
+    def load_embedding_index(
+        self, project: Project, sha: str, repo_contents: Mapping[str, str]
+    ) -> EmbeddingIndex:
+        path: Path = self.snapshots.path_for(project.id, sha) / INDEX_DIRNAME
+        index: EmbeddingIndex | None = EmbeddingIndex.load(path, EMBEDDING_MODEL)
+
+        if index is None:
+            seed: Path | None = self.snapshots.latest_sibling(
+                project.id, sha, INDEX_DIRNAME
+            )
+            index = EmbeddingIndex.build(
+                path=path,
+                repo_contents=repo_contents,
+                embed=self.embedder,
+                model=EMBEDDING_MODEL,
+                seed=EmbeddingIndex.load(seed, EMBEDDING_MODEL),
+            )
+
+        return index
+
+    def should_prewarm(self, project: Project, branch: str) -> bool:
+        if branch == project.default_branch:
+            return True
+
+        if any(fnmatch.fnmatchcase(branch, pattern) for pattern in PREWARM_BRANCHES):
+            return True
+
+        return bool(project.branches.get(branch).protected)
+
+    def prewarm(self, project_id: int, branch: str, sha: str) -> bool:
+        """
+        Builds the repository context of `branch` at `sha` ahead of the reviews
+        of MRs targeting it.
+
+        Explanation:
+        - Only the default branch, protected branches and those matching
+            `PREWARM_BRANCHES` are prewarmed, since MRs target those.
+        - The snapshot is downloaded and ingested, which keeps it among the
+            snapshots open in memory, and the dependency index, or the
+            embedding index with retrieval enabled, is built.
+        - An MR opened against `branch` while `sha` is its head diffs
+            against it, so its review reuses all of this.
+
+        Args:
+        - `project_id`: Integer representing the project ID.
+        - `branch`: Name of the pushed branch.
+        - `sha`: Commit SHA the branch was pushed to.
+
+        Returns:
+        - Whether the branch was one to prewarm.
+        """
+        project: Project = self.gl.projects.get(project_id)
+
+        if not self.should_prewarm(project, branch):
+            LOGGER.debug(f"Not prewarming {project_id}@{branch}, MRs do not target it")
+            return False
+
+        # Armed profiles are meant for reviews, leave them to the next ones
+        with trace(f"{project_id}@{branch}", profile=False), span("prewarm", sha=sha):
+            if REPO_SOURCE == "mirror":
+                self.get_mirror(project).fetch(
+                    refs=(f"refs/heads/{branch}",), wanted=(sha,)
+                )
+
+            repo_contents: Mapping[str, str] = self.get_repository_contents(
+                project, sha
+            )
+
+            if RETRIEVAL_ENABLED:
+                self.get_embedding_index(project, sha, repo_contents)
+            else:
+                self.get_dependency_index(project, sha, repo_contents)
+
+        return True
+
+    def context_hints(
+        self, project: Project, sha: str, repo_contents: Dict[str, str], mr_changes
+    ) -> ContextHints:
+        if RETRIEVAL_ENABLED:
+            return ContextHints(
+                embeddings=self.get_embedding_index(project, sha, repo_contents)
+            )
+
+        dependency_index: DependencyIndex = self.get_dependency_index(
+            project, sha, repo_contents
         )
+        changes: List[Dict[str, Any]] = mr_changes["changes"]
+        diff_text: str = "\n".join(changed_lines(c.get("diff", "")) for c in changes)
+
+        return ContextHints(
+            related=dependency_index.related(change["new_path"] for change in changes),
+            mentions=dependency_index.defining(identifiers(diff_text)),
+        )
+
+    def select_context(
+        self,
+        project: Project,
+        sha: str,
+        repo_contents: Dict[str, str],
+        mr_changes,
+        hints: ContextHints | None = None,
+    ) -> Dict[str, str]:
+        """
+        Picks the parts of the repository to send along with the MR.
+
+        Explanation:
+        - With retrieval enabled, returns the chunks closest to the diff hunks.
+        - Otherwise ranks files with the dependency index and context planner.
+
+        Args:
+        - `project`: Project object representing the project.
+        - `sha`: Commit SHA of the repository snapshot.
+        - `repo_contents`: Mapping of repository paths to file contents.
+        - `mr_changes`: Dictionary containing the changes in the merge request.
+        - `hints`: Hints already worked out for the review, when reviewing one
+            part of it.
+
+        Returns:
+        - Mapping of paths, or path and line ranges, to the selected content.
+        """
+        if hints is None:
+            hints = self.context_hints(project, sha, repo_contents, mr_changes)
+
+        if hints.embeddings is not None:
+            return retrieve_context(
+                index=hints.embeddings,
+                repo_contents=repo_contents,
+                changes=mr_changes["changes"],
+                embed=self.embedder,
+                k=RETRIEVAL_TOP_K,
+            )
+
+        context_plan: ContextPlan = self.context_planner.plan(
+            repo_contents, mr_changes, hints.related, hints.mentions
+        )
+        return context_plan.files
+
+    def project_overview(
+        self, project: Project, sha: str, repo_contents: Mapping[str, str]
+    ) -> Dict[str, Any]:
+        # Snapshots fix their paths at ingest, so the overview that starts every
+        # prompt renders identically for every review at `sha`
+        return {
+            "project": project.path_with_namespace,
+            "project_sha": sha,
+            "project_files": list(repo_contents),
+        }
 
     def construct_prompt(
         self,
@@ -145,55 +558,234 @@ class IAMKSM:
         repo_contents: Dict[str, str],
         file_paths_context: Dict[str, str],
         mr_changes,
+        overview: Dict[str, Any],
     ) -> str:
-        mr_title = mr_changes["title"]
-        mr_desc = mr_changes["description"]
-        commits = tuple(self.setup_commit_info(commits=mr.commits()))
-        changes = mr_changes["changes"]
+        sections: Dict[str, str] = self.prompt_builder.sections(
+            **overview,
+            repo=repo_contents,
+            mr_title=mr_changes["title"],
+            mr_desc=mr_changes["description"],
+            commits=mr_changes["commits"],
+            changes=mr_changes["changes"],
+            file_paths_context=file_paths_context,
+        )
+        return self.prompt_builder.render(PROMPT_TEMPLATE, sections).text
 
-        return PROMPT_TEMPLATE.format(
+    def construct_followup_prompt(
+        self,
+        previous: ReviewState,
+        repo_contents: Dict[str, str],
+        file_paths_context: Dict[str, str],
+        review_changes,
+        overview: Dict[str, Any],
+    ) -> str:
+        sections: Dict[str, str] = self.prompt_builder.sections(
+            **overview,
+            previous_review=previous.summary,
             repo=repo_contents,
-            mr_title=mr_title,
-            mr_desc=mr_desc,
-            commits=commits,
-            changes=changes,
+            mr_title=review_changes["title"],
+            mr_desc=review_changes["description"],
+            commits=review_changes["commits"],
+            changes=review_changes["changes"],
             file_paths_context=file_paths_context,
-            all_changes=mr_changes,
         )
+        return self.prompt_builder.render(FOLLOWUP_TEMPLATE, sections).text
 
     def define_system_persona(self) -> str:
         return SYSTEM_PERSONA
 
-    def generate_response(self, prompt: str) -> str:
-        response = ollama.generate(
-            model=OLLAMA_MODEL,
+    def select_model(self, mr_changes) -> str:
+        model: str = select_model(
+            self.model_rules,
+            default=OLLAMA_MODEL,
+            tokens=diff_tokens(mr_changes["changes"]),
+            labels=mr_changes.get("labels") or (),
+        )
+        LOGGER.info(f"Reviewing {mr_changes['title']} with {model}")
+
+        return model
+
+    def generate_response(
+        self, prompt: str, cancel: Event = None, model: str = OLLAMA_MODEL
+    ) -> str:
+        response, _ = self.model_pool.generate(
+            model=model,
             prompt=prompt,
             system=SYSTEM_PERSONA,
             options=OLLAMA_OPTIONS,
-            stream=False,
+            timeout=OLLAMA_TIMEOUT,
+            max_tokens=OLLAMA_MAX_TOKENS,
+            cancel=cancel,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+
+        return response
+
+    def should_map_reduce(self, mr_changes) -> bool:
+        changes: List[Dict[str, Any]] = mr_changes["changes"]
+
+        return (
+            len(changes) >= MAP_REDUCE_MIN_FILES
+            or diff_tokens(changes) >= MAP_REDUCE_MIN_DIFF_TOKENS
         )
-        return response["response"]
+
+    def unit_prompt(
+        self,
+        project: Project,
+        sha: str,
+        repo_contents: Dict[str, str],
+        file_paths_context: Dict[str, str],
+        mr_changes,
+        unit: List[Dict[str, Any]],
+        hints: ContextHints,
+    ) -> str:
+        unit_changes: Dict[str, Any] = dict(mr_changes, changes=unit)
+        unit_paths: Set[str] = {change["new_path"] for change in unit}
+
+        sections: Dict[str, str] = self.prompt_builder.sections(
+            **self.project_overview(project, sha, repo_contents),
+            repo=self.select_context(project, sha, repo_contents, unit_changes, hints),
+            mr_title=mr_changes["title"],
+            mr_desc=mr_changes["description"],
+            changes=unit,
+            file_paths_context={
+                path: content
+                for path, content in file_paths_context.items()
+                if path in unit_paths
+            },
+        )
+        return self.prompt_builder.render(UNIT_REVIEW_TEMPLATE, sections).text
+
+    def reduce_prompt(
+        self, mr_changes, units: List[List[Dict[str, Any]]], findings: List[str]
+    ) -> str:
+        sections: Dict[str, str] = self.prompt_builder.sections(
+            mr_title=mr_changes["title"],
+            mr_desc=mr_changes["description"],
+            commits=mr_changes["commits"],
+            findings="\n\n".join(
+                f"Part {number} ({', '.join(c['new_path'] for c in unit)}):\n{text}"
+                for number, (unit, text) in enumerate(zip(units, findings), start=1)
+            ),
+        )
+        return self.prompt_builder.render(REDUCE_TEMPLATE, sections).text
+
+    def review_unit(
+        self,
+        project: Project,
+        sha: str,
+        repo_contents: Dict[str, str],
+        file_paths_context: Dict[str, str],
+        mr_changes,
+        unit: List[Dict[str, Any]],
+        hints: ContextHints,
+        cancel: Event = None,
+        model: str = OLLAMA_MODEL,
+    ) -> str:
+        prompt: str = self.unit_prompt(
+            project, sha, repo_contents, file_paths_context, mr_changes, unit, hints
+        )
+        return self.generate_response(prompt, cancel, model)
+
+    def map_reduce_review(
+        self,
+        project: Project,
+        sha: str,
+        mr: ProjectMergeRequest,
+        repo_contents: Dict[str, str],
+        file_paths_context: Dict[str, str],
+        mr_changes,
+        cancel: Event = None,
+        model: str = OLLAMA_MODEL,
+    ) -> str:
+        """
+        Reviews a large MR in parts and merges the findings into one review.
+
+        Explanation:
+        - Splits the changes into units of about `MAP_REDUCE_UNIT_TOKENS`.
+        - Reads the snapshot's index once, every unit then only ranks the
+            repository against its own changes.
+        - Reviews the units in parallel, bounded by the slots of the model pool.
+        - Merges the findings with a short reduce prompt that produces the
+            usual review format and a single decision.
+
+        Args:
+        - `project`: Project object representing the project.
+        - `sha`: Commit SHA of the repository snapshot.
+        - `mr`: ProjectMergeRequest object representing the merge request.
+        - `repo_contents`: Mapping of repository paths to file contents.
+        - `file_paths_context`: Mapping of changed paths to their contents.
+        - `mr_changes`: Dictionary containing the changes in the merge request.
+        - `cancel`: Event set when a newer push supersedes this review.
+        - `model`: Ollama model reviewing the parts and merging the findings.
+
+        Returns:
+        - The merged review.
+        """
+        units: List[List[Dict[str, Any]]] = split_review_units(
+            mr_changes["changes"], MAP_REDUCE_UNIT_TOKENS
+        )
+        LOGGER.info(f"Reviewing {len(units)} parts of {mr_changes['title']}")
+        hints: ContextHints = self.context_hints(
+            project, sha, repo_contents, mr_changes
+        )
+
+        futures = [
+            self.model_executor.submit(
+                contextvars.copy_context().run,
+                self.review_unit,
+                project,
+                sha,
+                repo_contents,
+                file_paths_context,
+                mr_changes,
+                unit,
+                hints,
+                cancel,
+                model,
+            )
+            for unit in units
+        ]
+
+        try:
+            findings: List[str] = [future.result() for future in futures]
+        finally:
+            for future in futures:
+                future.cancel()
+
+        prompt: str = self.reduce_prompt(mr_changes, units, findings)
+        return self.generate_response(prompt, cancel, model)
 
     def process_response(
-        self, mr: ProjectMergeRequest, response: str, mr_changes
-    ) -> None:
+        self,
+        mr: ProjectMergeRequest,
+        response: str,
+        mr_changes,
+        approvals: ProjectMergeRequestApproval = None,
+        discussion_id: str | None = None,
+    ) -> str | None:
         """
         Processes the response of an MR review and takes actions based on the response.
 
         Explanation:
         - Checks if the response indicates approval or disapproval.
         - Creates notes or discussions accordingly and updates the approval status.
+        - A follow-up review that still does not approve replies in the discussion
+            of the previous verdict, `discussion_id`, instead of opening another
+            one, and one that approves resolves it.
         - Logs the outcome of the approval process.
 
         Args:
         - `mr`: ProjectMergeRequest object representing the merge request.
         - `response`: String containing the response of the review.
         - `mr_changes`: Dictionary containing the changes in the merge request.
+        - `approvals`: Approvals of the merge request, fetched when omitted.
+        - `discussion_id`: The discussion holding the previous verdict, if any.
 
         Returns:
-        - None
+        - The id of the discussion holding the verdict, None once approved.
         """
-        approvals: ProjectMergeRequestApproval = mr.approvals.get()
+        approvals = approvals or mr.approvals.get()
         approved_by: List[Dict[str, Dict[str, Any]]] = getattr(
             approvals, "approved_by", []
         )
@@ -206,48 +798,327 @@ class IAMKSM:
                 mr.notes.create({"body": response})
                 mr.approve()
 
+            if discussion_id is not None:
+                self.resolve_discussion(mr, discussion_id)
+
             LOGGER.info(f"APPROVED: {mr_changes['title']}")
-        else:
-            mr.discussions.create({"body": response})
+            return None
 
-            if bot_already_approved:
-                mr.unapprove()
+        discussion_id = self.reply_to_discussion(mr, discussion_id, response)
 
-            LOGGER.info(f"NOT APPROVED: {mr_changes['title']}")
+        if discussion_id is None:
+            discussion_id = str(mr.discussions.create({"body": response}).id)
 
-    @timer
-    def review_project_open_merge_request(self, project: Project, mr_id: int) -> None:
+        if bot_already_approved:
+            mr.unapprove()
+
+        LOGGER.info(f"NOT APPROVED: {mr_changes['title']}")
+        return discussion_id
+
+    def reply_to_discussion(
+        self, mr: ProjectMergeRequest, discussion_id: str | None, response: str
+    ) -> str | None:
+        if discussion_id is None:
+            return None
+
+        try:
+            discussion = mr.discussions.get(discussion_id, lazy=True)
+            discussion.notes.create({"body": response})
+        except GitlabError as error:
+            # Deleted since, most likely, so the verdict opens a new one
+            LOGGER.warning(f"Could not reply in discussion {discussion_id}: {error}")
+            return None
+
+        return discussion_id
+
+    def resolve_discussion(self, mr: ProjectMergeRequest, discussion_id: str) -> None:
+        try:
+            mr.discussions.update(discussion_id, {"resolved": True})
+        except GitlabError as error:
+            LOGGER.warning(f"Could not resolve discussion {discussion_id}: {error}")
+
+    def review_merge_request(
+        self, project_id: int, mr_id: int, cancel: Event = None
+    ) -> None:
+        with trace(f"{project_id}!{mr_id}"):
+            project: Project = self.gl.projects.get(project_id)
+            self.review_project_open_merge_request(project, mr_id, cancel)
+
+    def response_cache_key(
+        self,
+        repo_context: Dict[str, str],
+        file_paths_context: Dict[str, str],
+        mr_changes,
+        previous: ReviewState = None,
+        model: str = OLLAMA_MODEL,
+    ) -> str:
+        return cache_key(
+            diff=normalize_diff(mr_changes["changes"]),
+            repo_context=repo_context,
+            file_paths_context=file_paths_context,
+            model=model,
+            options=OLLAMA_OPTIONS,
+            template_version=TEMPLATE_VERSION,
+            map_reduce=self.should_map_reduce(mr_changes),
+            previous_review=previous and previous.summary,
+        )
+
+    def get_previous_review(
+        self, project: Project, mr_id: int, mr_changes
+    ) -> ReviewState | None:
         """
-        Performs a series of actions to review an open merge request in a project.
+        Returns the last review of this MR if the new head builds on it.
 
         Explanation:
-        - Retrieves the merge request and its changes.
-        - Maps changes to file paths and fetches repository contents.
-        - Constructs a prompt for review and generates a response.
-        - Processes the response and logs relevant information.
+        - Returns None when incremental reviews are disabled, the MR was never
+            reviewed, or the branch was rewritten so the reviewed SHA is no
+            longer an ancestor of the new head.
 
         Args:
         - `project`: Project object representing the project.
         - `mr_id`: Integer representing the merge request ID.
+        - `mr_changes`: Dictionary containing the changes in the merge request.
 
         Returns:
-        - None
+        - The stored review state, or None for a full review.
         """
-        mr: ProjectMergeRequest = project.mergerequests.get(id=mr_id)
-        mr_changes: Dict[str, Any] | Response = mr.changes()
+        if not INCREMENTAL_REVIEW:
+            return None
+
+        previous: ReviewState | None = self.review_state.get(project.id, mr_id)
+        head_sha: str | None = (mr_changes.get("diff_refs") or {}).get("head_sha")
+
+        if previous is None or head_sha is None or previous.head_sha == head_sha:
+            return previous
+
+        merge_base = project.repository_merge_base([previous.head_sha, head_sha])
 
-        file_paths_context: Dict[str, str] = self.map_changes_to_file_paths(
-            project, mr_changes
+        if merge_base["id"] != previous.head_sha:
+            LOGGER.info(f"{previous.head_sha} was rewritten, reviewing the whole MR")
+            return None
+
+        return previous
+
+    def get_incremental_changes(
+        self, project: Project, previous: ReviewState, mr_changes
+    ) -> Dict[str, Any]:
+        head_sha: str = mr_changes["diff_refs"]["head_sha"]
+        compare: Dict[str, Any] = project.repository_compare(
+            previous.head_sha, head_sha
         )
-        repo_contents: Dict[str, str] = self.get_repository_contents(project)
-        LOGGER.info("Done getting MR and Repository context")
+        LOGGER.info(
+            f"Reviewing {len(compare['diffs'])} files changed since {previous.head_sha}"
+        )
+        return dict(mr_changes, changes=compare["diffs"], commits=compare["commits"])
+
+    def get_cached_response(self, key: str) -> Dict[str, Any] | None:
+        if not RESPONSE_CACHE_ENABLED:
+            return None
+
+        cached: Dict[str, Any] | None = self.response_cache.get(key)
+
+        if cached is not None:
+            LOGGER.info(f"Response cache hit for {key}")
+
+        return cached
+
+    def put_cached_response(self, key: str, response: str, reviewed: List[str]):
+        if RESPONSE_CACHE_ENABLED:
+            self.response_cache.put(key, response, reviewed)
+
+    def review_prompt(self, plan: ReviewPlan) -> str:
+        overview: Dict[str, Any] = self.project_overview(
+            plan.project, plan.context_sha, plan.repo_contents
+        )
+
+        if plan.previous is not None:
+            return self.construct_followup_prompt(
+                plan.previous,
+                plan.repo_context,
+                plan.file_paths_context,
+                plan.review_changes,
+                overview,
+            )
 
-        prompt: str = self.construct_prompt(
-            mr, repo_contents, file_paths_context, mr_changes
+        return self.construct_prompt(
+            plan.mr,
+            plan.repo_context,
+            plan.file_paths_context,
+            plan.review_changes,
+            overview,
         )
+
+    def generate_review(self, plan: ReviewPlan, cancel: Event = None) -> str:
+        if self.should_map_reduce(plan.review_changes):
+            return self.map_reduce_review(
+                plan.project,
+                plan.context_sha,
+                plan.mr,
+                plan.repo_contents,
+                plan.file_paths_context,
+                plan.review_changes,
+                cancel,
+                plan.model,
+            )
+
+        prompt: str = self.review_prompt(plan)
         LOGGER.info("Prompt is now ready to be processed")
 
-        model_resp: str = self.generate_response(prompt)
+        return self.generate_response(prompt, cancel, plan.model)
+
+    def plan_review(
+        self,
+        project: Project,
+        mr: ProjectMergeRequest,
+        mr_changes: Dict[str, Any],
+        approvals: ProjectMergeRequestApproval,
+        cancel: Event = None,
+    ) -> ReviewPlan | None:
+        """
+        Gathers the changes and context of a review before the model is called.
+
+        Explanation:
+        - When the MR was reviewed before, narrows the changes to the commits
+            pushed since the last reviewed SHA.
+        - Maps changes to file paths and fetches repository contents.
+        - Selects the repository context and looks up a cached response.
+
+        Args:
+        - `project`: Project object representing the project.
+        - `mr`: ProjectMergeRequest object representing the merge request.
+        - `mr_changes`: Dictionary containing the changes in the merge request.
+        - `approvals`: Approvals of the merge request.
+        - `cancel`: Event set when a newer push supersedes this review.
+
+        Returns:
+        - The review plan, or None when the MR does not need a new review.
+        """
+        head_sha: str | None = (mr_changes.get("diff_refs") or {}).get("head_sha")
+        previous: ReviewState | None = self.get_previous_review(
+            project, mr.iid, mr_changes
+        )
+
+        if previous is not None and previous.head_sha == head_sha:
+            LOGGER.info(f"Skipping {mr_changes['title']}, {head_sha} was reviewed")
+            return None
+
+        context_sha: str = self.get_context_sha(project, mr_changes)
+
+        if REPO_SOURCE == "mirror":
+            self.sync_mirror(project, mr_changes, context_sha)
+
+        with span("changes", incremental=previous is not None) as current:
+            review_changes: Dict[str, Any] = (
+                mr_changes
+                if previous is None
+                else self.get_incremental_changes(project, previous, mr_changes)
+            )
+            file_paths_context: Dict[str, str] = self.map_changes_to_file_paths(
+                project, review_changes
+            )
+            current.record(files=len(review_changes["changes"]))
+
+        repo_contents: Dict[str, str] = self.get_repository_contents(
+            project, context_sha
+        )
+        LOGGER.info("Done getting MR and Repository context")
+        raise_if_cancelled(cancel)
+
+        with span("context") as current:
+            repo_context: Dict[str, str] = self.select_context(
+                project, context_sha, repo_contents, review_changes
+            )
+            current.record(files=len(repo_context))
+
+        model: str = self.select_model(review_changes)
+        response_key: str = self.response_cache_key(
+            repo_context, file_paths_context, review_changes, previous, model
+        )
+        cached: Dict[str, Any] = self.get_cached_response(response_key) or {}
+        plan = ReviewPlan(
+            project=project,
+            mr=mr,
+            mr_changes=mr_changes,
+            approvals=approvals,
+            review_changes=review_changes,
+            previous=previous,
+            context_sha=context_sha,
+            file_paths_context=file_paths_context,
+            repo_contents=repo_contents,
+            repo_context=repo_context,
+            response_key=response_key,
+            model=model,
+            reviewed=cached.get("reviewed", []),
+            response=cached.get("response"),
+        )
+
+        if plan.mr_ref in plan.reviewed and RESPONSE_CACHE_HIT_ACTION == "skip":
+            LOGGER.info(f"Skipping {mr_changes['title']}, it was already reviewed")
+            return None
+
+        return plan
+
+    def finish_review(self, plan: ReviewPlan, cancel: Event = None) -> None:
+        if plan.mr_ref not in plan.reviewed:
+            self.put_cached_response(
+                plan.response_key, plan.response, plan.reviewed + [plan.mr_ref]
+            )
+
         LOGGER.info("Model Response ready. Commenting on the MR")
+        raise_if_cancelled(cancel)
+
+        # Stored even when incremental reviews are off, so verdicts share a thread
+        stored: ReviewState | None = self.review_state.get(plan.project.id, plan.mr.iid)
+
+        with span("post"):
+            discussion_id: str | None = self.process_response(
+                plan.mr,
+                plan.response,
+                plan.mr_changes,
+                plan.approvals,
+                stored and stored.discussion_id,
+            )
+
+        if plan.head_sha is not None:
+            summary: str = summarize_review(plan.response, REVIEW_SUMMARY_CHARS)
+            self.review_state.save(
+                plan.project.id, plan.mr.iid, plan.head_sha, summary, discussion_id
+            )
+
+    @timer
+    def review_project_open_merge_request(
+        self, project: Project, mr_id: int, cancel: Event = None
+    ) -> bool:
+        """
+        Performs a series of actions to review an open merge request in a project.
+
+        Explanation:
+        - Retrieves the merge request and its changes.
+        - Gathers the changes and context to review with `plan_review`.
+        - Constructs a prompt for review and generates a response.
+        - Processes the response and remembers the reviewed SHA.
+
+        Args:
+        - `project`: Project object representing the project.
+        - `mr_id`: Integer representing the merge request ID.
+        - `cancel`: Event set when a newer push supersedes this review.
+
+        Returns:
+        - Whether a review was posted, False when the MR needed none.
+
+        Raises:
+        - `ReviewCancelled`: If `cancel` is set between stages.
+        """
+        mr, mr_changes, approvals = self.fetch_merge_request(project, mr_id)
+        plan: ReviewPlan | None = self.plan_review(
+            project, mr, mr_changes, approvals, cancel
+        )
+
+        if plan is None:
+            return False
+
+        if plan.response is None:
+            plan.response = self.generate_review(plan, cancel)
 
-        self.process_response(mr, model_resp, mr_changes)
+        self.finish_review(plan, cancel)
+        return True
@@ -0,0 +1,291 @@
+import asyncio
+import json
+import logging
+from threading import Event
+from typing import TYPE_CHECKING, Any, Awaitable, Callable, Dict, Iterable, Tuple
+
+from iamksm_bot.app.events import (
+    can_review_event,
+    event_head_sha,
+    is_merge_request_body,
+    is_push_event,
+    push_event_target,
+    review_priority,
+)
+from iamksm_bot.app.fairqueue import RETRY_AFTER_SECONDS, BacklogFull, SchedulingPolicy
+from iamksm_bot.app.jobqueue import JobQueue
+from iamksm_bot.app.metrics import (
+    CONTENT_TYPE,
+    QUEUE_DEPTH,
+    REGISTRY,
+    REVIEWS_IN_FLIGHT,
+)
+from iamksm_bot.app.prewarm import Prewarmer
+from iamksm_bot.app.profiling import profile_command
+from iamksm_bot.app.scheduler import AsyncReviewScheduler
+from iamksm_bot.app.utils import Lazy
+from iamksm_bot.config.settings import settings
+
+if TYPE_CHECKING:
+    from iamksm_bot.app.pipeline import AsyncReviewPipeline
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+App = Callable[[Dict[str, Any], Receive, Send], Awaitable[None]]
+PROFILE_METHODS = ("GET", "POST", "DELETE")
+
+
+def build_pipeline() -> "AsyncReviewPipeline":
+    # Imported here so the server starts without loading the review stack
+    from iamksm_bot.app.ai import IAMKSM
+    from iamksm_bot.app.gitlab_client import AsyncGitLab
+    from iamksm_bot.app.pipeline import AsyncReviewPipeline
+
+    return AsyncReviewPipeline(
+        air=IAMKSM(),
+        gitlab=AsyncGitLab(
+            url=settings.GITLAB_URL,
+            private_token=settings.GITLAB_TOKEN,
+            max_connections=settings.GITLAB_MAX_CONNECTIONS,
+        ),
+    )
+
+
+PIPELINE: Lazy["AsyncReviewPipeline"] = Lazy(build_pipeline)
+
+
+async def review_merge_request(project_id: int, mr_id: int, cancel: Event) -> None:
+    if not PIPELINE.built:
+        await asyncio.to_thread(PIPELINE.get)
+
+    await PIPELINE.get().review_merge_request(project_id, mr_id, cancel)
+
+
+def prewarm_branch(project_id: int, branch: str, sha: str) -> bool:
+    # Called from the prewarm thread, the review stages themselves are sync
+    return PIPELINE.get().air.prewarm(project_id, branch, sha)
+
+
+def create_queue() -> AsyncReviewScheduler | JobQueue:
+    policy = SchedulingPolicy.from_settings(settings)
+
+    if settings.REVIEW_QUEUE == "sqlite":
+        queue = JobQueue(
+            path=settings.REVIEW_QUEUE_PATH,
+            visibility_timeout=settings.REVIEW_VISIBILITY_TIMEOUT,
+            max_attempts=settings.REVIEW_MAX_ATTEMPTS,
+            policy=policy,
+        )
+    else:
+        queue = AsyncReviewScheduler(
+            review=review_merge_request,
+            debounce_seconds=settings.REVIEW_DEBOUNCE_SECONDS,
+            max_concurrent=settings.REVIEW_CONCURRENCY,
+            policy=policy,
+        )
+
+    QUEUE_DEPTH.set_function(queue.depth)
+    REVIEWS_IN_FLIGHT.set_function(queue.in_flight)
+    return queue
+
+
+async def respond(
+    send: Send,
+    status: int,
+    body: str,
+    content_type: str = "text/plain; charset=utf-8",
+    headers: Iterable[Tuple[bytes, bytes]] = (),
+) -> None:
+    await send(
+        {
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", content_type.encode()), *headers],
+        }
+    )
+    await send({"type": "http.response.body", "body": body.encode()})
+
+
+async def read_body(receive: Receive) -> bytes:
+    body: bytes = b""
+    more_body: bool = True
+
+    while more_body:
+        message: Dict[str, Any] = await receive()
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+
+    return body
+
+
+async def read_json(receive: Receive, default: bytes = b"") -> Dict | None:
+    """
+    Reads a JSON object body, returning None when the body is not one.
+    """
+    try:
+        data: Any = json.loads(await read_body(receive) or default)
+    except json.JSONDecodeError:
+        return None
+
+    return data if isinstance(data, dict) else None
+
+
+async def lifespan(
+    queue: AsyncReviewScheduler | JobQueue, receive: Receive, send: Send
+) -> None:
+    warmup: asyncio.Task | None = None
+
+    while True:
+        message: Dict[str, Any] = await receive()
+
+        if message["type"] == "lifespan.startup":
+            # Build the pipeline in the background, startup does not wait for it
+            if isinstance(queue, AsyncReviewScheduler):
+                warmup = asyncio.create_task(asyncio.to_thread(PIPELINE.get))
+
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            if warmup is not None:
+                await asyncio.gather(warmup, return_exceptions=True)
+
+            if PIPELINE.built:
+                await PIPELINE.get().gitlab.aclose()
+
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def mr_review_webhook(
+    queue: AsyncReviewScheduler | JobQueue,
+    prewarmer: Prewarmer | None,
+    scope: Dict[str, Any],
+    receive: Receive,
+    send: Send,
+):
+    headers: Dict[bytes, bytes] = dict(scope["headers"])
+    X_GITLAB_TOKEN = headers.get(b"x-gitlab-token", b"").decode()
+
+    if X_GITLAB_TOKEN != settings.GITLAB_HEADER_TOKEN:
+        LOGGER.error(f"UNAUTHORIZED: {X_GITLAB_TOKEN = } is incorrect")
+        return await respond(send, 401, "UNAUTHORIZED")
+
+    data: Dict | None = await read_json(receive)
+
+    if data is None:
+        LOGGER.error("BAD REQUEST: the webhook body is not a JSON object")
+        return await respond(send, 400, "BAD REQUEST")
+
+    if is_push_event(data):
+        target = push_event_target(data)
+
+        if target is None or prewarmer is None:
+            return await respond(send, 200, "IGNORED")
+
+        prewarmer.submit(*target)
+        return await respond(send, 200, "OK")
+
+    if not is_merge_request_body(data):
+        LOGGER.error("BAD REQUEST: the webhook body is not a merge request event")
+        return await respond(send, 400, "BAD REQUEST")
+
+    project = data["project"]
+    mr_id = data["object_attributes"]["iid"]
+
+    if not can_review_event(data):
+        return await respond(send, 403, "FORBIDDEN")
+
+    head_sha: str | None = event_head_sha(data)
+    priority: int = review_priority(
+        data,
+        labels=settings.REVIEW_PRIORITY_LABELS,
+        followups=settings.REVIEW_PRIORITY_FOLLOWUPS and settings.INCREMENTAL_REVIEW,
+    )
+
+    try:
+        if isinstance(queue, JobQueue):
+            await asyncio.to_thread(
+                queue.enqueue,
+                project_id=project["id"],
+                mr_iid=mr_id,
+                sha=head_sha,
+                delay=settings.REVIEW_DEBOUNCE_SECONDS,
+                priority=priority,
+            )
+        else:
+            queue.submit(
+                project_id=project["id"], mr_iid=mr_id, sha=head_sha, priority=priority
+            )
+    except BacklogFull as error:
+        LOGGER.warning(f"Not queueing review of {project['id']}!{mr_id}: {error}")
+        retry_after: Tuple[bytes, bytes] = (b"retry-after", b"%d" % RETRY_AFTER_SECONDS)
+        return await respond(send, error.status, "BUSY", headers=[retry_after])
+
+    return await respond(send, 200, "OK")
+
+
+async def profile_admin(scope: Dict[str, Any], receive: Receive, send: Send):
+    headers: Dict[bytes, bytes] = dict(scope["headers"])
+    admin_token: str = settings.PROFILE_ADMIN_TOKEN
+
+    if not admin_token or headers.get(b"x-admin-token", b"").decode() != admin_token:
+        LOGGER.error("UNAUTHORIZED: admin token is missing or incorrect")
+        return await respond(send, 401, "UNAUTHORIZED")
+
+    try:
+        body: Dict | None = await read_json(receive, default=b"{}")
+
+        if body is None:
+            raise ValueError("The request body must be a JSON object")
+
+        result: Dict[str, Any] = await asyncio.to_thread(
+            profile_command, scope["method"], body
+        )
+    except (TypeError, ValueError) as error:
+        return await respond(send, 400, str(error))
+
+    await respond(send, 200, json.dumps(result), "application/json")
+
+
+def create_app() -> App:
+    """
+    Creates the ASGI counterpart of the Flask webhook, serving
+    `POST /review-mr`, `GET /metrics` and `/admin/profile`.
+
+    Reviews run as tasks of the async review pipeline on the server's event
+    loop, or are queued for `iamksm-bot worker` with `REVIEW_QUEUE: sqlite`.
+    The pipeline, with its GitLab and Ollama clients, is built in a thread
+    after startup, so the server accepts events right away even with GitLab
+    slow or unreachable. Push events to the branches MRs target have their
+    repository context built in a background thread while a review slot is
+    free, unless reviews are queued with `REVIEW_QUEUE: sqlite`.
+    """
+    queue: AsyncReviewScheduler | JobQueue = create_queue()
+    prewarmer: Prewarmer | None = None
+
+    if isinstance(queue, AsyncReviewScheduler) and settings.PREWARM_ENABLED:
+        prewarmer = Prewarmer(
+            prewarm=prewarm_branch,
+            busy=lambda: queue.in_flight() >= settings.REVIEW_CONCURRENCY,
+            max_pending=settings.PREWARM_MAX_PENDING,
+        )
+
+    async def app(scope: Dict[str, Any], receive: Receive, send: Send) -> None:
+        if scope["type"] == "lifespan":
+            return await lifespan(queue, receive, send)
+
+        if scope["path"] == "/metrics" and scope["method"] == "GET":
+            # Gauges read from the job queue hit SQLite, keep them off the loop
+            body: str = await asyncio.to_thread(REGISTRY.render)
+            return await respond(send, 200, body, CONTENT_TYPE)
+
+        if scope["path"] == "/admin/profile" and scope["method"] in PROFILE_METHODS:
+            return await profile_admin(scope, receive, send)
+
+        if scope["path"] != "/review-mr" or scope["method"] != "POST":
+            return await respond(send, 404, "NOT FOUND")
+
+        await mr_review_webhook(queue, prewarmer, scope, receive, send)
+
+    return app
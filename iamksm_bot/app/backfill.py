@@ -0,0 +1,235 @@
+import json
+import logging
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from pathlib import Path
+from threading import Event, Lock
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+from gitlab.v4.objects.projects import Project
+
+from iamksm_bot.app.ai import IAMKSM
+from iamksm_bot.app.events import can_review_event, merge_request_event
+from iamksm_bot.app.scheduler import ReviewCancelled
+from iamksm_bot.app.tracing import trace
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# Seconds between progress reports
+REPORT_INTERVAL = 60
+REVIEWED = "reviewed"
+SKIPPED = "skipped"
+FAILED = "failed"
+
+CheckpointKey = Tuple[int, int, str | None]
+
+
+@dataclass
+class BackfillItem:
+    project_id: int
+    mr_iid: int
+    sha: str | None
+    title: str
+
+    @property
+    def key(self) -> CheckpointKey:
+        return (self.project_id, self.mr_iid, self.sha)
+
+    @property
+    def ref(self) -> str:
+        return f"{self.project_id}!{self.mr_iid}"
+
+
+class Checkpoint:
+    """
+    Append-only JSON lines log of the MRs a backfill finished, so an
+    interrupted backfill resumes where it stopped.
+
+    An MR counts as finished at the head SHA it was reviewed or skipped at.
+    MRs pushed to since, and failed reviews, are picked up again.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.finished: Set[CheckpointKey] = set()
+        self._lock = Lock()
+
+        if path.exists():
+            for line in path.read_text().splitlines():
+                record: Dict[str, Any] = json.loads(line)
+
+                if record["outcome"] != FAILED:
+                    self.finished.add(
+                        (record["project_id"], record["mr_iid"], record["sha"])
+                    )
+
+    def __contains__(self, item: BackfillItem) -> bool:
+        return item.key in self.finished
+
+    def record(self, item: BackfillItem, outcome: str) -> None:
+        record: Dict[str, Any] = {
+            "project_id": item.project_id,
+            "mr_iid": item.mr_iid,
+            "sha": item.sha,
+            "outcome": outcome,
+            "at": time.time(),
+        }
+
+        with self._lock:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+
+            with self.path.open("a") as file:
+                file.write(json.dumps(record) + "\n")
+
+            if outcome != FAILED:
+                self.finished.add(item.key)
+
+
+@dataclass
+class BackfillStats:
+    total: int
+    started_at: float = field(default_factory=time.monotonic)
+    outcomes: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def done(self) -> int:
+        return sum(self.outcomes.values())
+
+    @property
+    def reviews_per_hour(self) -> float:
+        elapsed: float = max(time.monotonic() - self.started_at, 1e-9)
+        return self.outcomes.get(REVIEWED, 0) / elapsed * 3600
+
+    def add(self, outcome: str) -> None:
+        self.outcomes[outcome] = self.outcomes.get(outcome, 0) + 1
+
+    def report(self) -> str:
+        counts: str = ", ".join(
+            f"{self.outcomes.get(outcome, 0)} {outcome}"
+            for outcome in (REVIEWED, SKIPPED, FAILED)
+        )
+        elapsed: float = time.monotonic() - self.started_at
+        return (
+            f"{self.done}/{self.total} MRs ({counts}) in {elapsed / 60:.1f} minutes, "
+            f"{self.reviews_per_hour:.1f} reviews/hour"
+        )
+
+
+class Backfill:
+    """
+    Reviews every eligible open MR of some groups and projects, as fast as
+    the model pool allows.
+
+    Explanation:
+    - Open MRs are listed per group, including subgroups, or per project
+        and filtered with the webhook's `can_review_event` rules. MRs in the
+        checkpoint at their current head SHA are left out.
+    - The projects are fetched once each, concurrently, and their MRs are
+        reviewed project by project, so reviews running together mostly
+        share a repository snapshot, kept open in memory by IAMKSM.
+    - `concurrency` reviews run at once, by default twice the capacity of
+        the model pool, so while some wait on the model others fetch their
+        MR and context and the pool never idles.
+    """
+
+    def __init__(self, air: IAMKSM, checkpoint: Checkpoint, concurrency: int = 0):
+        self.air = air
+        self.checkpoint = checkpoint
+        self.concurrency = concurrency or 2 * air.model_pool.capacity
+        self.cancel = Event()
+
+    def list_merge_requests(
+        self, groups: Iterable[str], projects: Iterable[str]
+    ) -> List[Dict[str, Any]]:
+        listings: List[Iterable] = [
+            self.air.gl.groups.get(group, lazy=True).mergerequests.list(
+                state="opened", iterator=True
+            )
+            for group in groups
+        ] + [
+            self.air.gl.projects.get(project, lazy=True).mergerequests.list(
+                state="opened", iterator=True
+            )
+            for project in projects
+        ]
+        merge_requests: Dict[Tuple[int, int], Dict[str, Any]] = {}
+
+        for listing in listings:
+            for mr in listing:
+                merge_requests[(mr.project_id, mr.iid)] = mr.attributes
+
+        return list(merge_requests.values())
+
+    def eligible(
+        self, groups: Iterable[str], projects: Iterable[str]
+    ) -> List[BackfillItem]:
+        items: List[BackfillItem] = [
+            BackfillItem(
+                project_id=mr["project_id"],
+                mr_iid=mr["iid"],
+                sha=mr.get("sha"),
+                title=mr["title"],
+            )
+            for mr in self.list_merge_requests(groups, projects)
+            if can_review_event(merge_request_event(mr))
+        ]
+        pending: List[BackfillItem] = [
+            item for item in items if item not in self.checkpoint
+        ]
+        LOGGER.info(
+            f"{len(items)} open MRs can be reviewed, "
+            f"{len(items) - len(pending)} of them were already backfilled"
+        )
+        return sorted(pending, key=lambda item: (item.project_id, item.mr_iid))
+
+    def review(self, project: Project, item: BackfillItem) -> str:
+        with trace(item.ref):
+            reviewed: bool = self.air.review_project_open_merge_request(
+                project, item.mr_iid, self.cancel
+            )
+
+        return REVIEWED if reviewed else SKIPPED
+
+    def run(self, items: List[BackfillItem]) -> BackfillStats:
+        stats = BackfillStats(total=len(items))
+        executor = ThreadPoolExecutor(
+            max_workers=self.concurrency, thread_name_prefix="backfill"
+        )
+        project_ids: List[int] = sorted({item.project_id for item in items})
+        fetched: Dict[int, Project] = dict(
+            zip(project_ids, executor.map(self.air.gl.projects.get, project_ids))
+        )
+        futures: Dict[Future, BackfillItem] = {
+            executor.submit(self.review, fetched[item.project_id], item): item
+            for item in items
+        }
+        reported_at: float = time.monotonic()
+
+        try:
+            for future in as_completed(futures):
+                outcome: str = self.outcome(futures[future], future)
+                self.checkpoint.record(futures[future], outcome)
+                stats.add(outcome)
+
+                if time.monotonic() - reported_at > REPORT_INTERVAL:
+                    LOGGER.info(f"Backfill progress: {stats.report()}")
+                    reported_at = time.monotonic()
+        except KeyboardInterrupt:
+            LOGGER.info("Stopping backfill, progress is kept in the checkpoint")
+            self.cancel.set()
+            raise
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+        LOGGER.info(f"Backfill finished: {stats.report()}")
+        return stats
+
+    def outcome(self, item: BackfillItem, future: Future) -> str:
+        try:
+            return future.result()
+        except ReviewCancelled:
+            return FAILED
+        except Exception:
+            LOGGER.exception(f"Backfill review of {item.ref} ({item.title}) failed")
+            return FAILED
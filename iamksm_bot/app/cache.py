@@ -0,0 +1,258 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock, get_ident
+from typing import Any, Dict, List, Optional, Tuple
+
+from iamksm_bot.app.metrics import BLOB_CACHE_LOOKUPS
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+HUNK_HEADER = re.compile(r"^@@ -\d+(?:,\d+)? \+\d+(?:,\d+)? @@", re.MULTILINE)
+# Seconds between two walks of the response cache to evict entries
+EVICT_INTERVAL = 60
+
+
+def normalize_diff(changes: List[Dict[str, Any]]) -> str:
+    """
+    Renders MR changes so that rebases which only move lines around produce
+    the same text: hunk line numbers and trailing whitespace are dropped and
+    files are sorted by path.
+    """
+    rendered: List[str] = []
+
+    for change in sorted(changes, key=lambda c: (c["new_path"], c["old_path"])):
+        flags: str = "".join(
+            flag[0]
+            for flag in ("new_file", "renamed_file", "deleted_file")
+            if change.get(flag)
+        )
+        diff: str = HUNK_HEADER.sub("@@", change.get("diff", ""))
+        lines: str = "\n".join(line.rstrip() for line in diff.splitlines())
+        rendered.append(f"{change['old_path']} {change['new_path']} {flags}\n{lines}")
+
+    return "\n".join(rendered)
+
+
+def cache_key(**parts: Any) -> str:
+    payload: str = json.dumps(parts, sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class ResponseCache:
+    """
+    On-disk cache of model responses keyed by a content hash of the request.
+
+    Entries older than `ttl_seconds` are ignored, and the least recently used
+    entries are evicted once the cache grows past `max_bytes`. Writes check
+    the size of the cache at most once every `EVICT_INTERVAL` seconds, so it
+    may briefly grow past `max_bytes`.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float, max_bytes: int):
+        self.root = Path(path)
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = Lock()
+        self._evicted_at: float = float("-inf")
+
+    def _path_for(self, key: str) -> Path:
+        return self.root / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Returns the cached `response` and the MRs it was `reviewed` on.
+        """
+        path: Path = self._path_for(key)
+
+        try:
+            entry: Dict[str, Any] = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+
+        if time.time() - entry["created_at"] > self.ttl_seconds:
+            path.unlink(missing_ok=True)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            # Evicted since it was read, the entry is still good to use
+            pass
+
+        return entry
+
+    def put(self, key: str, response: str, reviewed: List[str]) -> None:
+        path: Path = self._path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry: Dict[str, Any] = {
+            "created_at": time.time(),
+            "response": response,
+            "reviewed": reviewed,
+        }
+        staging: Path = path.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+        staging.write_text(json.dumps(entry))
+        os.replace(staging, path)
+
+        if self._eviction_due():
+            self.evict()
+
+    def _eviction_due(self) -> bool:
+        with self._lock:
+            now: float = time.monotonic()
+
+            if now - self._evicted_at < EVICT_INTERVAL:
+                return False
+
+            self._evicted_at = now
+            return True
+
+    def evict(self) -> None:
+        with self._lock:
+            entries: List[Tuple[float, int, Path]] = []
+
+            for path in self.root.glob("*/*.json"):
+                try:
+                    stat = path.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+            total: int = sum(size for _, size, _ in entries)
+            now: float = time.time()
+
+            for last_used, size, path in sorted(entries):
+                expired: bool = now - last_used > self.ttl_seconds
+
+                if total <= self.max_bytes and not expired:
+                    break
+
+                path.unlink(missing_ok=True)
+                total -= size
+
+
+def blob_id(content: bytes) -> str:
+    """
+    Returns the git object id of a blob, the `oid` GitLab reports for it.
+    """
+    header: bytes = f"blob {len(content)}\0".encode()
+    return hashlib.sha1(header + content).hexdigest()
+
+
+class BlobCache:
+    """
+    Cache of file contents keyed by git blob id, shared by every project.
+
+    Explanation:
+    - A blob id only ever names one content, so entries never go stale and
+        a file unchanged between commits, MRs or forks is downloaded once.
+    - The most recently used blobs, up to `memory_bytes`, are kept in
+        memory in front of an on-disk store under `path`, whose least
+        recently used entries are evicted once it grows past `max_bytes`.
+    - Entries are stored under the id computed from their content, never
+        the one a caller expects, so a wrong id only causes a miss.
+    """
+
+    def __init__(self, path: str, memory_bytes: int, max_bytes: int):
+        self.root = Path(path)
+        self.memory_bytes = memory_bytes
+        self.max_bytes = max_bytes
+        self._memory: OrderedDict[str, str] = OrderedDict()
+        self._memory_size: int = 0
+        self._written: int = 0
+        self._lock = Lock()
+
+    def _path_for(self, oid: str) -> Path:
+        return self.root / oid[:2] / oid
+
+    def get(self, oid: str) -> Optional[str]:
+        with self._lock:
+            content: Optional[str] = self._memory.get(oid)
+
+            if content is not None:
+                self._memory.move_to_end(oid)
+                BLOB_CACHE_LOOKUPS.inc(result="memory")
+                return content
+
+        path: Path = self._path_for(oid)
+
+        try:
+            content = path.read_bytes().decode("utf-8")
+        except (OSError, UnicodeDecodeError):
+            BLOB_CACHE_LOOKUPS.inc(result="miss")
+            return None
+
+        os.utime(path)
+        self._remember(oid, content)
+        BLOB_CACHE_LOOKUPS.inc(result="disk")
+        return content
+
+    def put(self, content: str) -> str:
+        """
+        Stores `content` and returns its blob id.
+        """
+        data: bytes = content.encode("utf-8")
+        oid: str = blob_id(data)
+        self._remember(oid, content)
+        path: Path = self._path_for(oid)
+
+        if path.exists():
+            return oid
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        staging: Path = path.with_name(f"{oid}.{os.getpid()}.{get_ident()}.tmp")
+        staging.write_bytes(data)
+        os.replace(staging, path)
+
+        with self._lock:
+            self._written += len(data)
+            # Walking the store is costly, only do it every tenth of the quota
+            due: bool = self._written > self.max_bytes // 10
+
+            if due:
+                self._written = 0
+
+        if due:
+            self.evict()
+
+        return oid
+
+    def _remember(self, oid: str, content: str) -> None:
+        with self._lock:
+            if oid in self._memory:
+                self._memory.move_to_end(oid)
+                return
+
+            self._memory[oid] = content
+            self._memory_size += len(content)
+
+            while self._memory_size > self.memory_bytes and self._memory:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_size -= len(evicted)
+
+    def evict(self) -> None:
+        entries: List[Tuple[float, int, Path]] = []
+
+        for path in self.root.glob("*/*"):
+            if path.suffix == ".tmp":
+                continue
+
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total: int = sum(size for _, size, _ in entries)
+
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+
+            path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,319 @@
+import keyword
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# Rough average for source code, good enough to keep prompts within budget
+CHARS_PER_TOKEN = 4
+IDENTIFIER_PATTERN = re.compile(r"[A-Za-z_][A-Za-z0-9_]{3,}")
+IMPORT_PATTERN = re.compile(
+    r"^\s*(?:from\s+([\w.]+)\s+import|import\s+([\w., ]+)|"
+    r".*\brequire\(\s*['\"]([^'\"]+)['\"]|.*\bfrom\s+['\"]([^'\"]+)['\"])",
+    re.MULTILINE,
+)
+COMMON_IDENTIFIERS: Set[str] = set(keyword.kwlist) | {
+    "self",
+    "args",
+    "kwargs",
+    "return",
+    "none",
+    "true",
+    "false",
+    "this",
+    "const",
+    "function",
+    "string",
+}
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def module_names(path: str) -> Set[str]:
+    """
+    Returns the names a file is likely to be imported by, e.g. `a/b.py` gives
+    `a.b`, `b` and `a/b`.
+    """
+    stem, _ = os.path.splitext(path)
+    parts: List[str] = [part for part in stem.split("/") if part]
+
+    if parts and parts[-1] in ("__init__", "index"):
+        parts = parts[:-1]
+
+    if not parts:
+        return set()
+
+    return {".".join(parts), parts[-1], "/".join(parts)}
+
+
+def imported_names(text: str) -> Set[str]:
+    names: Set[str] = set()
+
+    for match in IMPORT_PATTERN.finditer(text):
+        for group in match.groups():
+            if not group:
+                continue
+
+            for name in group.split(","):
+                name = name.strip().split(" ")[0].lstrip("./")
+                if name:
+                    names |= {name, name.split(".")[-1], name.split("/")[-1]}
+
+    return names
+
+
+def identifiers(text: str) -> Set[str]:
+    return {
+        word
+        for word in IDENTIFIER_PATTERN.findall(text)
+        if word.lower() not in COMMON_IDENTIFIERS
+    }
+
+
+def changed_lines(diff: str) -> str:
+    return "\n".join(
+        line[1:]
+        for line in diff.splitlines()
+        if line[:1] in ("+", "-") and not line.startswith(("+++", "---"))
+    )
+
+
+def path_proximity(path: str, changed_paths: Iterable[str]) -> float:
+    folders: List[str] = path.split("/")[:-1]
+    best: float = 0.0
+
+    for changed_path in changed_paths:
+        changed_folders: List[str] = changed_path.split("/")[:-1]
+        shared: int = 0
+
+        for a, b in zip(folders, changed_folders):
+            if a != b:
+                break
+            shared += 1
+
+        depth: int = max(len(folders), len(changed_folders))
+        best = max(best, 1.0 if depth == 0 else shared / depth)
+
+    return best
+
+
+@dataclass
+class ContextPlan:
+    """
+    The repository context selected for a review.
+
+    `files` maps paths to their full contents or an excerpt, `dropped` lists
+    the candidate paths that did not fit in the token budget.
+    """
+
+    files: Dict[str, str] = field(default_factory=dict)
+    dropped: List[str] = field(default_factory=list)
+    excerpted: List[str] = field(default_factory=list)
+    tokens: int = 0
+
+
+class ContextPlanner:
+    """
+    Ranks repository files by relevance to an MR diff and packs the most
+    relevant ones, or excerpts of them, into a token budget.
+
+    Files are first shortlisted by what their paths and the dependency index
+    tell about them, and only the `shortlist_size` best are read and scored
+    on their content.
+    """
+
+    PROXIMITY_WEIGHT = 2.0
+    IMPORT_WEIGHT = 4.0
+    IDENTIFIER_WEIGHT = 3.0
+    RELATED_WEIGHT = 6.0
+
+    def __init__(
+        self, token_budget: int, excerpt_radius: int = 8, shortlist_size: int = 200
+    ):
+        self.token_budget = token_budget
+        self.excerpt_radius = excerpt_radius
+        self.shortlist_size = shortlist_size
+
+    def prescore(
+        self,
+        path: str,
+        changed_paths: List[str],
+        diff_imports: Set[str],
+        related: Set[str],
+        mentions: Set[str],
+    ) -> float:
+        score: float = self.PROXIMITY_WEIGHT * path_proximity(path, changed_paths)
+
+        if module_names(path) & diff_imports:
+            score += self.IMPORT_WEIGHT
+
+        if path in mentions:
+            score += self.IDENTIFIER_WEIGHT
+
+        return score + self.RELATED_WEIGHT * (path in related)
+
+    def shortlist(
+        self,
+        paths: Iterable[str],
+        changed_paths: List[str],
+        diff_imports: Set[str],
+        related: Set[str],
+        mentions: Set[str],
+    ) -> List[str]:
+        prescores: List[Tuple[float, str]] = [
+            (self.prescore(path, changed_paths, diff_imports, related, mentions), path)
+            for path in paths
+            if path not in changed_paths
+        ]
+        prescores.sort(key=lambda item: (-item[0], item[1]))
+
+        return [path for _, path in prescores[: self.shortlist_size]]
+
+    def score(
+        self,
+        path: str,
+        content: str,
+        changed_paths: List[str],
+        diff_imports: Set[str],
+        changed_modules: Set[str],
+        diff_identifiers: Set[str],
+    ) -> float:
+        score: float = self.PROXIMITY_WEIGHT * path_proximity(path, changed_paths)
+
+        # The diff imports this file, or this file imports a changed file
+        is_imported: bool = bool(module_names(path) & diff_imports)
+        imports_changes: bool = bool(imported_names(content) & changed_modules)
+
+        if is_imported or imports_changes:
+            score += self.IMPORT_WEIGHT
+
+        if diff_identifiers:
+            shared: Set[str] = identifiers(content) & diff_identifiers
+            score += self.IDENTIFIER_WEIGHT * len(shared) / len(diff_identifiers)
+
+        return score
+
+    def rank(
+        self,
+        repo_contents: Dict[str, str],
+        changes: List[Dict[str, Any]],
+        related: Set[str] = frozenset(),
+        mentions: Set[str] = frozenset(),
+    ) -> List[Tuple[float, str]]:
+        changed_paths: List[str] = [change["new_path"] for change in changes]
+        diff_text: str = "\n".join(changed_lines(c.get("diff", "")) for c in changes)
+        changed_modules: Set[str] = set().union(*map(module_names, changed_paths))
+        diff_imports: Set[str] = imported_names(diff_text)
+        diff_identifiers: Set[str] = identifiers(diff_text)
+
+        shortlist: List[str] = self.shortlist(
+            repo_contents, changed_paths, diff_imports, related, mentions
+        )
+        ranking: List[Tuple[float, str]] = [
+            (
+                self.score(
+                    path,
+                    repo_contents[path],
+                    changed_paths,
+                    diff_imports,
+                    changed_modules,
+                    diff_identifiers,
+                )
+                + self.RELATED_WEIGHT * (path in related),
+                path,
+            )
+            for path in shortlist
+        ]
+
+        return sorted(ranking, key=lambda item: (-item[0], item[1]))
+
+    def excerpt(self, content: str, wanted: Set[str], budget: int) -> str:
+        """
+        Returns the lines around mentions of `wanted` identifiers, falling
+        back to the top of the file, trimmed to `budget` tokens.
+        """
+        lines: List[str] = content.splitlines()
+        keep: Set[int] = set()
+
+        for number, line in enumerate(lines):
+            if wanted & identifiers(line):
+                start: int = max(0, number - self.excerpt_radius)
+                keep |= set(range(start, number + self.excerpt_radius + 1))
+
+        if not keep:
+            keep = set(range(2 * self.excerpt_radius))
+
+        excerpt: List[str] = []
+        previous: int = -1
+        used: int = 0
+
+        for number in sorted(n for n in keep if n < len(lines)):
+            line: str = lines[number]
+
+            if excerpt and number != previous + 1:
+                line = f"...\n{line}"
+
+            cost: int = estimate_tokens(line)
+
+            if used + cost > budget:
+                break
+
+            excerpt.append(line)
+            used += cost
+            previous = number
+
+        return "\n".join(excerpt)
+
+    def plan(
+        self,
+        repo_contents: Dict[str, str],
+        mr_changes,
+        related: Set[str] = frozenset(),
+        mentions: Set[str] = frozenset(),
+    ) -> ContextPlan:
+        """
+        Selects the repository context to send along with an MR.
+
+        Args:
+        - `repo_contents`: Mapping of repository paths to file contents.
+        - `mr_changes`: Dictionary containing the changes in the merge request.
+        - `related`: Paths known to call or be called by the changed files.
+        - `mentions`: Paths defining identifiers the diff uses.
+
+        Returns:
+        - The selected files and the paths that were left out.
+        """
+        changes: List[Dict[str, Any]] = mr_changes["changes"]
+        diff_identifiers: Set[str] = identifiers(
+            "\n".join(changed_lines(c.get("diff", "")) for c in changes)
+        )
+        plan = ContextPlan()
+        # Excerpts shorter than this are not worth the surrounding noise
+        min_excerpt_tokens: int = 4 * self.excerpt_radius
+
+        for score, path in self.rank(repo_contents, changes, related, mentions):
+            content: str = repo_contents[path]
+            remaining: int = self.token_budget - plan.tokens
+            cost: int = estimate_tokens(content)
+
+            if cost <= remaining:
+                plan.files[path] = content
+                plan.tokens += cost
+            elif score > 0 and remaining >= min_excerpt_tokens:
+                excerpt: str = self.excerpt(content, diff_identifiers, remaining)
+                plan.files[path] = excerpt
+                plan.tokens += estimate_tokens(excerpt)
+                plan.excerpted.append(path)
+            else:
+                plan.dropped.append(path)
+
+        LOGGER.info(
+            f"Selected {len(plan.files)} files ({len(plan.excerpted)} excerpted, "
+            f"{plan.tokens} tokens) as context, dropped {len(plan.dropped)}"
+        )
+        return plan
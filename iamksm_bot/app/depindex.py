@@ -0,0 +1,285 @@
+import ast
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+INDEX_FILENAME = "deps.json"
+INDEX_VERSION = 1
+
+
+class LanguageIndexer:
+    """
+    Extracts imports, definitions and references from files of one language.
+
+    Subclasses declare the file `extensions` they handle and implement
+    `module_name` and `parse`, then get registered with `register_indexer`.
+    """
+
+    extensions: tuple = ()
+
+    def module_name(self, path: str) -> str:
+        raise NotImplementedError
+
+    def parse(self, path: str, content: str) -> Dict[str, List[str]]:
+        """
+        Returns the `imports`, `defines` and `references` found in a file.
+        Imports are module names as returned by `module_name`.
+        """
+        raise NotImplementedError
+
+
+class PythonIndexer(LanguageIndexer):
+    extensions = (".py",)
+
+    def module_name(self, path: str) -> str:
+        module: str = os.path.splitext(path)[0].replace("/", ".")
+        return module.removesuffix(".__init__")
+
+    def resolve_relative(self, path: str, module: Optional[str], level: int) -> str:
+        package: List[str] = self.module_name(path).split(".")
+
+        if not path.endswith("__init__.py"):
+            package = package[:-1]
+
+        base: List[str] = package[: len(package) - level + 1] if level > 1 else package
+        return ".".join(base + ([module] if module else []))
+
+    def parse(self, path: str, content: str) -> Dict[str, List[str]]:
+        tree = ast.parse(content)
+        imports: Set[str] = set()
+        defines: Set[str] = set()
+        references: Set[str] = set()
+
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                imports |= {alias.name for alias in node.names}
+
+            elif isinstance(node, ast.ImportFrom):
+                module: str = node.module or ""
+
+                if node.level:
+                    module = self.resolve_relative(path, node.module, node.level)
+
+                imports.add(module)
+                # `from pkg import module` imports a module, not a symbol
+                imports |= {f"{module}.{alias.name}" for alias in node.names}
+                references |= {alias.name for alias in node.names}
+
+            elif isinstance(
+                node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)
+            ):
+                defines.add(node.name)
+
+            elif isinstance(node, ast.Name):
+                references.add(node.id)
+
+            elif isinstance(node, ast.Attribute):
+                references.add(node.attr)
+
+        return {
+            "imports": sorted(imports),
+            "defines": sorted(defines),
+            "references": sorted(references - defines),
+        }
+
+
+INDEXERS: List[LanguageIndexer] = [PythonIndexer()]
+
+
+def register_indexer(indexer: LanguageIndexer) -> None:
+    INDEXERS.append(indexer)
+
+
+def indexer_for(path: str) -> Optional[LanguageIndexer]:
+    for indexer in INDEXERS:
+        if path.endswith(indexer.extensions):
+            return indexer
+
+    return None
+
+
+class DependencyIndex:
+    """
+    Maps modules to the modules they import, and symbols to the files that
+    define and reference them, for one repository snapshot.
+
+    The index is stored as JSON next to the snapshot. Each entry keeps the
+    hash of the content it was built from so `update` only re-parses files
+    that changed, including when seeded from another snapshot's index.
+    """
+
+    # Symbols defined in more files than this are too generic to follow
+    MAX_SYMBOL_FANOUT = 3
+
+    def __init__(self, path: Path, files: Dict[str, Dict[str, Any]] = None):
+        self.path = path
+        self.files: Dict[str, Dict[str, Any]] = files or {}
+        self._build_lookups()
+
+    @classmethod
+    def load(cls, path: Path, seed: Optional[Path] = None) -> "DependencyIndex":
+        """
+        Loads the index at `path`, starting from `seed` when it does not exist.
+        """
+        for candidate in (path, seed):
+            if candidate is None or not candidate.exists():
+                continue
+
+            try:
+                data: Dict[str, Any] = json.loads(candidate.read_text())
+            except (OSError, ValueError):
+                LOGGER.warning(f"Ignoring unreadable dependency index {candidate}")
+                continue
+
+            if data.get("version") == INDEX_VERSION:
+                return cls(path, data["files"])
+
+        return cls(path)
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # A staging file of its own, other threads may save the same index
+        fd, staging = tempfile.mkstemp(dir=self.path.parent, suffix=".tmp")
+
+        with os.fdopen(fd, "w") as file:
+            json.dump({"version": INDEX_VERSION, "files": self.files}, file)
+
+        os.replace(staging, self.path)
+
+    def update(self, repo_contents: Mapping[str, str]) -> int:
+        """
+        Re-indexes files whose content changed and forgets deleted files.
+
+        Returns:
+        - Number of files that were (re-)parsed.
+        """
+        parsed: int = 0
+        indexed: Set[str] = set()
+
+        # Only read the files an indexer parses, the others stay compressed
+        for path in list(repo_contents):
+            indexer: Optional[LanguageIndexer] = indexer_for(path)
+
+            if indexer is None:
+                continue
+
+            content: str = repo_contents[path]
+            indexed.add(path)
+            digest: str = hashlib.sha1(content.encode()).hexdigest()
+
+            if self.files.get(path, {}).get("hash") == digest:
+                continue
+
+            try:
+                entry: Dict[str, Any] = indexer.parse(path, content)
+            except (SyntaxError, ValueError):
+                entry = {"imports": [], "defines": [], "references": []}
+
+            entry.update(hash=digest, module=indexer.module_name(path))
+            self.files[path] = entry
+            parsed += 1
+
+        removed: Set[str] = set(self.files) - indexed
+
+        for path in removed:
+            del self.files[path]
+
+        if parsed or removed or not self.path.exists():
+            self._build_lookups()
+            self.save()
+
+        LOGGER.info(
+            f"Dependency index updated: {parsed} parsed, {len(removed)} removed"
+        )
+        return parsed
+
+    def _build_lookups(self) -> None:
+        self.modules: Dict[str, str] = {}
+        self.definitions: Dict[str, Set[str]] = defaultdict(set)
+        self.references: Dict[str, Set[str]] = defaultdict(set)
+
+        for path, entry in self.files.items():
+            self.modules[entry["module"]] = path
+
+        for path, entry in self.files.items():
+            parts: List[str] = entry["module"].split(".")
+
+            # Register every suffix so `src/pkg/mod.py` resolves `pkg.mod` too
+            for start in range(1, len(parts)):
+                self.modules.setdefault(".".join(parts[start:]), path)
+
+            for symbol in entry["defines"]:
+                self.definitions[symbol].add(path)
+
+            for symbol in entry["references"]:
+                self.references[symbol].add(path)
+
+        self.importers: Dict[str, Set[str]] = defaultdict(set)
+
+        for path in self.files:
+            for imported in self.imports_of(path):
+                self.importers[imported].add(path)
+
+    def imports_of(self, path: str) -> Set[str]:
+        entry: Dict[str, Any] = self.files.get(path, {})
+        return {
+            self.modules[module]
+            for module in entry.get("imports", ())
+            if module in self.modules and self.modules[module] != path
+        }
+
+    def callees(self, path: str) -> Set[str]:
+        entry: Dict[str, Any] = self.files.get(path, {})
+        defined_elsewhere: Set[str] = set()
+
+        for symbol in entry.get("references", ()):
+            definers: Set[str] = self.definitions.get(symbol, set())
+
+            if len(definers) <= self.MAX_SYMBOL_FANOUT:
+                defined_elsewhere |= definers
+
+        return (self.imports_of(path) | defined_elsewhere) - {path}
+
+    def callers(self, path: str) -> Set[str]:
+        entry: Dict[str, Any] = self.files.get(path, {})
+        referencing: Set[str] = set()
+
+        for symbol in entry.get("defines", ()):
+            if len(self.definitions[symbol]) <= self.MAX_SYMBOL_FANOUT:
+                referencing |= self.references.get(symbol, set())
+
+        return (self.importers.get(path, set()) | referencing) - {path}
+
+    def defining(self, symbols: Iterable[str]) -> Set[str]:
+        """
+        Returns the files defining any of `symbols`, leaving out symbols
+        defined in too many files to tell them apart.
+        """
+        definers: Set[str] = set()
+
+        for symbol in symbols:
+            paths: Set[str] = self.definitions.get(symbol, set())
+
+            if len(paths) <= self.MAX_SYMBOL_FANOUT:
+                definers |= paths
+
+        return definers
+
+    def related(self, paths: Iterable[str]) -> Set[str]:
+        """
+        Returns the callers and callees of `paths`, excluding `paths` themselves.
+        """
+        paths = set(paths)
+        related: Set[str] = set()
+
+        for path in paths:
+            related |= self.callers(path) | self.callees(path)
+
+        return related - paths
@@ -0,0 +1,166 @@
+import logging
+from typing import Any, Dict, Iterable, Set, Tuple
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# MR attributes read from a webhook event before deciding to review it
+MR_EVENT_ATTRIBUTES = (
+    "iid",
+    "draft",
+    "work_in_progress",
+    "blocking_discussions_resolved",
+    "action",
+    "state",
+)
+
+
+def is_merge_request_body(data: Any) -> bool:
+    """
+    Checks that a webhook body is shaped like a merge request event, so the
+    webhooks answer 400 to anything else instead of failing on it.
+    """
+    if not isinstance(data, dict) or "event_type" not in data:
+        return False
+
+    project: Any = data.get("project")
+    attributes: Any = data.get("object_attributes")
+
+    return (
+        isinstance(project, dict)
+        and "id" in project
+        and isinstance(attributes, dict)
+        and all(name in attributes for name in MR_EVENT_ATTRIBUTES)
+    )
+
+
+def can_review_event(data: Dict[str, Any]) -> bool:
+    """
+    Checks whether a GitLab webhook event is for an MR that can be reviewed,
+    logging the reasons when it cannot.
+    """
+    obj_attrs = data["object_attributes"]
+
+    is_an_mr = data["event_type"] == "merge_request"
+    is_not_draft = obj_attrs["draft"] is False
+    is_not_wip = obj_attrs["work_in_progress"] is False
+    no_unresolved_comments: bool = obj_attrs["blocking_discussions_resolved"] is True
+    mr_action_is_valid = obj_attrs["action"] in ("update", "open")
+    is_an_open_mr = obj_attrs["state"] == "opened"
+
+    can_review: bool = all(
+        (
+            is_an_open_mr,
+            is_not_draft,
+            is_not_wip,
+            no_unresolved_comments,
+            is_an_mr,
+            mr_action_is_valid,
+        )
+    )
+
+    if not can_review:
+        log_forbidden_review(
+            data,
+            obj_attrs,
+            is_an_mr,
+            is_not_draft,
+            is_not_wip,
+            no_unresolved_comments,
+            mr_action_is_valid,
+            is_an_open_mr,
+        )
+
+    return can_review
+
+
+def merge_request_event(mr: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Shapes the attributes of an MR from the REST API like a webhook event of
+    the MR being opened, so `can_review_event` applies the webhook's rules.
+    """
+    return {
+        "event_type": "merge_request",
+        "project": {"id": mr["project_id"]},
+        "labels": [{"title": label} for label in mr.get("labels", [])],
+        "object_attributes": dict(mr, action="open", last_commit={"id": mr["sha"]}),
+    }
+
+
+def is_push_event(data: Dict[str, Any]) -> bool:
+    return data.get("object_kind") == "push"
+
+
+def push_event_target(data: Dict[str, Any]) -> Tuple[int, str, str] | None:
+    """
+    Returns the project id, branch and new head SHA of a push event, or None
+    for deleted branches.
+    """
+    branch: str = data.get("ref", "").removeprefix("refs/heads/")
+    sha: str = data.get("after") or ""
+
+    if branch == data.get("ref") or not sha.strip("0"):
+        return None
+
+    return data["project_id"], branch, sha
+
+
+def event_head_sha(data: Dict[str, Any]) -> str | None:
+    return (data["object_attributes"].get("last_commit") or {}).get("id")
+
+
+def review_priority(
+    data: Dict[str, Any], labels: Iterable[str], followups: bool
+) -> int:
+    """
+    Returns 1 for events whose review should start before other waiting
+    reviews, 0 otherwise.
+
+    Explanation:
+    - MRs carrying any of `labels` are boosted.
+    - With `followups`, pushes to an open MR are boosted, since only the new
+        commits are reviewed. The webhook carries no diff size, so these
+        stand in for small reviews.
+    """
+    titles: Set[str] = {label.get("title") for label in data.get("labels") or []}
+
+    if not titles.isdisjoint(labels):
+        return 1
+
+    return int(followups and bool(data["object_attributes"].get("oldrev")))
+
+
+def log_forbidden_review(
+    data,
+    obj_attrs,
+    is_an_mr,
+    is_not_draft,
+    is_not_wip,
+    no_unresolved_comments,
+    mr_action_is_valid,
+    is_an_open_mr,
+):
+    event_type = f"\n {data['event_type'] = } should be `merge_request`"
+    draft_status = f"\n {obj_attrs['draft'] = } should be `False`"
+    work_in_progress = f"\n {obj_attrs['work_in_progress'] = } should be `False`"
+    pending_threads = (
+        f"\n {obj_attrs['blocking_discussions_resolved'] = } should be `True`"
+    )
+    is_valid_action = f"\n {obj_attrs['action'] = } should be either open or update"
+    mr_status = f" \n {obj_attrs['state'] = } should be opened"
+
+    msg_to_state_map: Dict[bool, str] = {
+        is_an_mr: event_type,
+        is_not_draft: draft_status,
+        is_not_wip: work_in_progress,
+        no_unresolved_comments: pending_threads,
+        mr_action_is_valid: is_valid_action,
+        is_an_open_mr: mr_status,
+    }
+
+    final_msg = "Cannot Review due to: "
+
+    for status, msg in msg_to_state_map.items():
+        if not status:
+            final_msg += msg
+
+    LOGGER.error(final_msg)
@@ -0,0 +1,219 @@
+import heapq
+import itertools
+from dataclasses import dataclass, field
+from typing import Any, Dict, Generic, Iterable, List, Tuple, TypeVar
+
+from iamksm_bot.app.metrics import REVIEWS_REJECTED
+
+T = TypeVar("T")
+
+# Seconds GitLab is asked to wait before resending a rejected event
+RETRY_AFTER_SECONDS = 60
+
+
+class BacklogFull(Exception):
+    """
+    Raised when a review cannot be admitted, either because the whole backlog
+    or only that of its project is full.
+    """
+
+    def __init__(self, message: str, project_only: bool):
+        super().__init__(message)
+        self.project_only = project_only
+
+    @property
+    def status(self) -> int:
+        # Too Many Requests from one project, Service Unavailable for everyone
+        return 429 if self.project_only else 503
+
+
+@dataclass
+class ProjectPolicy:
+    """
+    How a project shares the review slots.
+
+    - `weight`: Share of the slots relative to other busy projects.
+    - `max_concurrent`: Most reviews of the project running at once, 0 for
+        no limit other than the scheduler's.
+    - `max_backlog`: Most reviews of the project waiting at once, 0 for no
+        limit other than the scheduler's.
+    """
+
+    weight: float = 1.0
+    max_concurrent: int = 0
+    max_backlog: int = 0
+
+
+@dataclass
+class SchedulingPolicy:
+    """
+    The project policies of a scheduler and the size of its whole backlog.
+    """
+
+    default: ProjectPolicy = field(default_factory=ProjectPolicy)
+    projects: Dict[int, ProjectPolicy] = field(default_factory=dict)
+    max_backlog: int = 0
+
+    @classmethod
+    def from_settings(cls, settings: Any) -> "SchedulingPolicy":
+        """
+        Reads the policies of `REVIEW_PROJECTS` and the backlog limits.
+
+        Raises ValueError for a project without a positive weight.
+        """
+        default = ProjectPolicy(
+            max_concurrent=settings.REVIEW_PROJECT_MAX_CONCURRENT,
+            max_backlog=settings.REVIEW_PROJECT_MAX_BACKLOG,
+        )
+        projects: Dict[int, ProjectPolicy] = {}
+
+        for project in settings.REVIEW_PROJECTS:
+            project_id: int = int(project["project_id"])
+            policy = ProjectPolicy(
+                weight=float(project.get("weight", default.weight)),
+                max_concurrent=int(
+                    project.get("max_concurrent", default.max_concurrent)
+                ),
+                max_backlog=int(project.get("max_backlog", default.max_backlog)),
+            )
+
+            if policy.weight <= 0:
+                raise ValueError(
+                    f"Project {project_id} needs a positive weight, got "
+                    f"{policy.weight}"
+                )
+
+            projects[project_id] = policy
+
+        return cls(
+            default=default, projects=projects, max_backlog=settings.REVIEW_MAX_BACKLOG
+        )
+
+    def project(self, project_id: int) -> ProjectPolicy:
+        return self.projects.get(project_id, self.default)
+
+    def admit(self, project_id: int, backlog: int, project_backlog: int) -> None:
+        """
+        Raises BacklogFull when one more review of `project_id` would exceed
+        the scheduler's backlog or that of the project.
+        """
+        if self.max_backlog and backlog >= self.max_backlog:
+            REVIEWS_REJECTED.inc(reason="backlog")
+            raise BacklogFull(
+                f"{backlog} reviews are waiting, rejecting project {project_id}",
+                project_only=False,
+            )
+
+        limit: int = self.project(project_id).max_backlog
+
+        if limit and project_backlog >= limit:
+            REVIEWS_REJECTED.inc(reason="project_backlog")
+            raise BacklogFull(
+                f"Project {project_id} has {project_backlog} reviews waiting",
+                project_only=True,
+            )
+
+    def at_capacity(self, project_id: int, running: int) -> bool:
+        limit: int = self.project(project_id).max_concurrent
+        return bool(limit) and running >= limit
+
+
+class FairQueue(Generic[T]):
+    """
+    Waiting reviews, queued per project and taken in weighted fair order.
+
+    Explanation:
+    - Every project has a virtual time, advanced by `1 / weight` each time
+        one of its reviews is taken. The next review comes from the project
+        with the lowest virtual time, so busy projects get turns in
+        proportion to their weights however many reviews each has waiting.
+    - A project that had nothing waiting or running starts again at the
+        virtual time of the last review taken, so it cannot bank turns
+        while idle.
+    - Projects running `max_concurrent` reviews are skipped until one of
+        them finishes, which callers report with `finished`.
+    - Reviews with a higher priority are taken before all others, in fair
+        order among themselves, and first within their project.
+    - Not thread-safe, the schedulers call it under their own lock or from
+        their event loop.
+    """
+
+    def __init__(self, policy: SchedulingPolicy):
+        self.policy = policy
+        self.clock: float = 0.0
+        self._queues: Dict[int, List[Tuple[int, int, T]]] = {}
+        self._virtual: Dict[int, float] = {}
+        self._running: Dict[int, int] = {}
+        self._order = itertools.count()
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    def backlog(self, project_id: int) -> int:
+        return len(self._queues.get(project_id, ()))
+
+    def running(self, project_id: int) -> int:
+        return self._running.get(project_id, 0)
+
+    def push(self, project_id: int, item: T, priority: int = 0) -> None:
+        queue: List[Tuple[int, int, T]] = self._queues.setdefault(project_id, [])
+
+        if not queue and not self.running(project_id):
+            self._virtual[project_id] = max(
+                self._virtual.get(project_id, 0.0), self.clock
+            )
+
+        heapq.heappush(queue, (-priority, next(self._order), item))
+
+    def remove(self, project_id: int, item: T) -> bool:
+        queue: List[Tuple[int, int, T]] = self._queues.get(project_id, [])
+
+        for index, (_, _, queued) in enumerate(queue):
+            if queued is item:
+                queue.pop(index)
+                heapq.heapify(queue)
+                self._forget(project_id)
+                return True
+
+        return False
+
+    def pop(self) -> T | None:
+        """
+        Takes the next review and counts it as running for its project.
+        """
+        ready: Iterable[int] = (
+            project_id
+            for project_id, queue in self._queues.items()
+            if queue
+            and not self.policy.at_capacity(project_id, self.running(project_id))
+        )
+        project_id: int | None = min(
+            ready,
+            key=lambda project_id: (
+                self._queues[project_id][0][0],
+                self._virtual[project_id],
+                self._queues[project_id][0][1],
+            ),
+            default=None,
+        )
+
+        if project_id is None:
+            return None
+
+        _, _, item = heapq.heappop(self._queues[project_id])
+        self.clock = self._virtual[project_id]
+        self._virtual[project_id] += 1 / self.policy.project(project_id).weight
+        self._running[project_id] = self.running(project_id) + 1
+        return item
+
+    def finished(self, project_id: int) -> None:
+        self._running[project_id] = self.running(project_id) - 1
+        self._forget(project_id)
+
+    def _forget(self, project_id: int) -> None:
+        # Idle projects keep only their virtual time
+        if not self._queues.get(project_id):
+            self._queues.pop(project_id, None)
+
+        if not self.running(project_id):
+            self._running.pop(project_id, None)
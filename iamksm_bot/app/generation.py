@@ -0,0 +1,196 @@
+import logging
+import time
+from dataclasses import dataclass
+from threading import Event
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from iamksm_bot.app.scheduler import ReviewCancelled
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+NANOSECONDS = 1e9
+
+
+class GenerationTimeout(Exception):
+    pass
+
+
+@dataclass
+class GenerationStats:
+    prompt_tokens: int = 0
+    prompt_eval_seconds: float = 0.0
+    eval_tokens: int = 0
+    eval_seconds: float = 0.0
+    wall_seconds: float = 0.0
+    truncated: bool = False
+
+    @property
+    def prompt_tokens_per_second(self) -> float:
+        return (
+            self.prompt_tokens / self.prompt_eval_seconds
+            if self.prompt_eval_seconds
+            else 0.0
+        )
+
+    @property
+    def eval_tokens_per_second(self) -> float:
+        return self.eval_tokens / self.eval_seconds if self.eval_seconds else 0.0
+
+    @classmethod
+    def from_response(
+        cls, chunk: Mapping[str, Any], wall_seconds: float
+    ) -> "GenerationStats":
+        return cls(
+            prompt_tokens=chunk.get("prompt_eval_count", 0),
+            prompt_eval_seconds=chunk.get("prompt_eval_duration", 0) / NANOSECONDS,
+            eval_tokens=chunk.get("eval_count", 0),
+            eval_seconds=chunk.get("eval_duration", 0) / NANOSECONDS,
+            wall_seconds=wall_seconds,
+        )
+
+
+def stream_generate(
+    client,
+    model: str,
+    prompt: str,
+    system: str,
+    options: Dict[str, Any],
+    timeout: float,
+    max_tokens: int,
+    cancel: Optional[Event] = None,
+    **kwargs: Any,
+) -> Tuple[str, GenerationStats]:
+    """
+    Streams a completion from Ollama, enforcing a deadline and a token cap.
+
+    Explanation:
+    - Caps the output with `num_predict` and stops locally past `max_tokens`.
+    - Closes the stream, which aborts generation on the server, once `cancel`
+        is set or `timeout` seconds have passed.
+    - Reads prompt-eval and eval counters from the final chunk.
+
+    Args:
+    - `client`: Ollama client, created with a read timeout of at most `timeout`
+        so a stalled server cannot block between chunks indefinitely.
+    - `timeout`: Wall-clock limit for the whole generation, in seconds.
+    - `max_tokens`: Maximum number of tokens to generate.
+    - `cancel`: Event set when the review has been superseded.
+
+    Returns:
+    - The generated text and its throughput statistics.
+
+    Raises:
+    - `ReviewCancelled`: If `cancel` is set during generation.
+    - `GenerationTimeout`: If generation takes longer than `timeout`.
+    """
+    start: float = time.monotonic()
+    deadline: float = start + timeout
+    pieces: List[str] = []
+    final: Mapping[str, Any] = {}
+
+    stream = client.generate(
+        model=model,
+        prompt=prompt,
+        system=system,
+        options={**options, "num_predict": max_tokens},
+        stream=True,
+        **kwargs,
+    )
+
+    try:
+        for chunk in stream:
+            pieces.append(chunk.get("response", ""))
+
+            if chunk.get("done"):
+                final = chunk
+                break
+
+            if cancel is not None and cancel.is_set():
+                raise ReviewCancelled()
+
+            if past_limits(pieces, deadline, timeout, max_tokens):
+                break
+    finally:
+        stream.close()
+
+    return "".join(pieces), generation_stats(final, pieces, start)
+
+
+async def astream_generate(
+    client,
+    model: str,
+    prompt: str,
+    system: str,
+    options: Dict[str, Any],
+    timeout: float,
+    max_tokens: int,
+    **kwargs: Any,
+) -> Tuple[str, GenerationStats]:
+    """
+    Async counterpart of `stream_generate` for an `ollama.AsyncClient`.
+
+    Cancelling the awaiting task closes the stream, which aborts generation
+    on the server.
+    """
+    start: float = time.monotonic()
+    deadline: float = start + timeout
+    pieces: List[str] = []
+    final: Mapping[str, Any] = {}
+
+    stream = await client.generate(
+        model=model,
+        prompt=prompt,
+        system=system,
+        options={**options, "num_predict": max_tokens},
+        stream=True,
+        **kwargs,
+    )
+
+    try:
+        async for chunk in stream:
+            pieces.append(chunk.get("response", ""))
+
+            if chunk.get("done"):
+                final = chunk
+                break
+
+            if past_limits(pieces, deadline, timeout, max_tokens):
+                break
+    finally:
+        await stream.aclose()
+
+    return "".join(pieces), generation_stats(final, pieces, start)
+
+
+def past_limits(
+    pieces: List[str], deadline: float, timeout: float, max_tokens: int
+) -> bool:
+    if time.monotonic() > deadline:
+        raise GenerationTimeout(
+            f"Generation exceeded {timeout}s after {len(pieces)} tokens"
+        )
+
+    # Ollama stops at `num_predict` itself, this guards against servers
+    # that ignore it
+    if len(pieces) > max_tokens:
+        LOGGER.warning(f"Stopping generation at the {max_tokens} token cap")
+        return True
+
+    return False
+
+
+def generation_stats(
+    final: Mapping[str, Any], pieces: List[str], start: float
+) -> GenerationStats:
+    stats = GenerationStats.from_response(final, time.monotonic() - start)
+    stats.truncated = not final or final.get("done_reason") == "length"
+    stats.eval_tokens = stats.eval_tokens or len(pieces)
+
+    LOGGER.info(
+        f"Generated {stats.eval_tokens} tokens at "
+        f"{stats.eval_tokens_per_second:.1f} tokens/s after evaluating "
+        f"{stats.prompt_tokens} prompt tokens at "
+        f"{stats.prompt_tokens_per_second:.1f} tokens/s "
+        f"({stats.wall_seconds:.1f}s wall clock)"
+    )
+    return stats
@@ -0,0 +1,482 @@
+import asyncio
+import json
+import logging
+import time
+from concurrent.futures import Future
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Mapping, Set, Tuple
+
+import gitlab
+import httpx
+import requests
+from gitlab.v4.objects.projects import Project
+from requests.adapters import HTTPAdapter
+
+from iamksm_bot.app.cache import BlobCache
+from iamksm_bot.app.tracing import span
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 502, 503, 504)
+# GitLab caps GraphQL connections at 100 nodes per page
+GRAPHQL_MAX_PAGE_SIZE = 100
+
+BLOBS_QUERY = """
+query ($project: ID!, $ref: String!, $paths: [String!]!) {
+  project(fullPath: $project) {
+    repository {
+      blobs(ref: $ref, paths: $paths) {
+        nodes {
+          path
+          rawTextBlob
+        }
+      }
+    }
+  }
+}
+"""
+
+BLOB_IDS_QUERY = """
+query ($project: ID!, $ref: String!, $paths: [String!]!) {
+  project(fullPath: $project) {
+    repository {
+      blobs(ref: $ref, paths: $paths) {
+        nodes {
+          path
+          oid
+        }
+      }
+    }
+  }
+}
+"""
+
+
+def header_number(headers: Mapping[str, str], name: str) -> float | None:
+    """
+    Reads a numeric header, None when it is missing or not a number.
+    """
+    try:
+        return float(headers[name])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def retry_delay(headers: Mapping[str, str], attempt: int, backoff: float) -> float:
+    """
+    Seconds to wait before retrying a response with `headers`, from
+    `Retry-After`, then `RateLimit-Reset`, then exponential backoff.
+    """
+    retry_after: float | None = header_number(headers, "Retry-After")
+
+    if retry_after is not None:
+        return max(retry_after, 0.0)
+
+    reset: float | None = header_number(headers, "RateLimit-Reset")
+
+    if reset is not None:
+        return max(reset - time.time(), 0.0)
+
+    return backoff * 2**attempt
+
+
+class RateLimitedSession(requests.Session):
+    """
+    HTTP session shared by every GitLab call made by the bot.
+
+    Explanation:
+    - Keeps up to `pool_size` connections per host alive, so concurrent
+        workers reuse connections instead of opening new ones.
+    - Retries 429 and transient 5xx responses up to `max_retries` times,
+        waiting as long as `Retry-After` or `RateLimit-Reset` ask for, and
+        GET requests that failed to connect. This is the only retry layer,
+        python-gitlab's own retries are turned off by `create_gitlab`.
+    - Once `RateLimit-Remaining` drops below `min_remaining`, spreads the
+        requests left in the window evenly until it resets.
+    - Identical GET requests in flight at the same time share one response.
+    """
+
+    def __init__(
+        self,
+        pool_size: int,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+        min_remaining: int = 10,
+    ):
+        super().__init__()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.min_remaining = min_remaining
+        self._lock = Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._resume_at: float = 0.0
+
+    def request(self, method: str, url: str, *args: Any, **kwargs: Any):
+        if method.upper() != "GET" or kwargs.get("stream") or args:
+            return self.send_with_retries(method, url, **kwargs)
+
+        key: str = json.dumps(
+            [url, kwargs.get("params"), kwargs.get("headers")],
+            sort_keys=True,
+            default=str,
+        )
+
+        with self._lock:
+            future: Future | None = self._inflight.get(key)
+            leader: bool = future is None
+
+            if leader:
+                future = self._inflight[key] = Future()
+
+        if not leader:
+            return future.result()
+
+        try:
+            response: requests.Response = self.send_with_retries(method, url, **kwargs)
+            future.set_result(response)
+            return response
+        except BaseException as error:
+            future.set_exception(error)
+            raise
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def send_with_retries(self, method: str, url: str, **kwargs: Any):
+        for attempt in range(self.max_retries + 1):
+            self.throttle()
+
+            try:
+                response: requests.Response = super().request(method, url, **kwargs)
+            except requests.ConnectionError as error:
+                # Only reads are safe to send again when the outcome is unknown
+                if method.upper() != "GET" or attempt == self.max_retries:
+                    raise
+
+                LOGGER.warning(f"GET {url} failed ({error}), retrying")
+                time.sleep(self.backoff * 2**attempt)
+                continue
+
+            self.observe(response)
+
+            if (
+                response.status_code not in RETRY_STATUSES
+                or attempt == self.max_retries
+            ):
+                return response
+
+            delay: float = retry_delay(response.headers, attempt, self.backoff)
+            LOGGER.warning(
+                f"GitLab answered {response.status_code} to {method} {url}, "
+                f"retrying in {delay:.1f}s"
+            )
+            response.close()
+            time.sleep(delay)
+
+    def throttle(self) -> None:
+        with self._lock:
+            wait: float = self._resume_at - time.monotonic()
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def observe(self, response: requests.Response) -> None:
+        remaining: float | None = header_number(response.headers, "RateLimit-Remaining")
+        reset: float | None = header_number(response.headers, "RateLimit-Reset")
+
+        if remaining is None or reset is None or remaining >= self.min_remaining:
+            return
+
+        window: float = max(reset - time.time(), 0.0)
+        pace: float = window / max(remaining, 1)
+
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + pace)
+
+
+class GitLab(gitlab.Gitlab):
+    """
+    python-gitlab client leaving every retry to its `RateLimitedSession`.
+
+    python-gitlab otherwise retries 429 responses on its own, up to ten
+    times, on top of the retries the session already made.
+    """
+
+    def http_request(self, *args: Any, **kwargs: Any) -> requests.Response:
+        kwargs.setdefault("obey_rate_limit", False)
+        kwargs.setdefault("retry_transient_errors", False)
+        return super().http_request(*args, **kwargs)
+
+
+def create_gitlab(url: str, private_token: str, pool_size: int) -> gitlab.Gitlab:
+    return GitLab(
+        url=url,
+        private_token=private_token,
+        session=RateLimitedSession(pool_size=pool_size),
+    )
+
+
+class AsyncGitLab:
+    """
+    Async GitLab REST client used by the async review pipeline.
+
+    Explanation:
+    - Keeps up to `max_connections` connections alive, shared by every
+        review running on the event loop.
+    - Retries 429 and transient 5xx responses like `RateLimitedSession`.
+    - Identical GET requests in flight at the same time share one response.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        private_token: str,
+        max_connections: int,
+        timeout: float = 60.0,
+        max_retries: int = 5,
+        backoff: float = 0.5,
+    ):
+        self.client = httpx.AsyncClient(
+            base_url=f"{url}/api/v4",
+            headers={"PRIVATE-TOKEN": private_token},
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            ),
+            timeout=timeout,
+        )
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def request(self, method: str, path: str, **kwargs: Any) -> httpx.Response:
+        for attempt in range(self.max_retries + 1):
+            response: httpx.Response = await self.client.request(method, path, **kwargs)
+
+            if (
+                response.status_code not in RETRY_STATUSES
+                or attempt == self.max_retries
+            ):
+                return response.raise_for_status()
+
+            delay: float = retry_delay(response.headers, attempt, self.backoff)
+            LOGGER.warning(
+                f"GitLab answered {response.status_code} to {method} {path}, "
+                f"retrying in {delay:.1f}s"
+            )
+            await asyncio.sleep(delay)
+
+    async def get(self, path: str, **params: Any) -> Any:
+        key: str = json.dumps([path, params], sort_keys=True, default=str)
+        future: asyncio.Future | None = self._inflight.get(key)
+
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+
+        try:
+            response: httpx.Response = await self.request("GET", path, params=params)
+            future.set_result(response.json())
+            return future.result()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # Mark the error as retrieved when nobody else was waiting for it
+            future.exception()
+            raise
+        finally:
+            del self._inflight[key]
+
+    async def get_all(self, path: str, **params: Any) -> List[Any]:
+        items: List[Any] = []
+        page: str = "1"
+
+        while page:
+            response: httpx.Response = await self.request(
+                "GET", path, params={**params, "per_page": 100, "page": page}
+            )
+            items.extend(response.json())
+            page = response.headers.get("X-Next-Page", "")
+
+        return items
+
+    async def get_bytes(self, path: str, **params: Any) -> bytes:
+        response: httpx.Response = await self.request("GET", path, params=params)
+        return response.content
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+class BlobReader:
+    """
+    Reads many repository files with as few GitLab requests as possible.
+
+    Files are fetched `batch_size` paths at a time through the GraphQL `blobs`
+    query. Batches GraphQL cannot answer fall back to the raw file endpoint.
+    Binary files and missing paths are left out of the result.
+
+    With a `cache`, the blob ids of the files at `ref` are resolved first,
+    through the same query asking only for `oid`, or HEAD requests to the
+    file endpoint, and only files whose blob is not cached are downloaded.
+    """
+
+    def __init__(
+        self,
+        gl: gitlab.Gitlab,
+        batch_size: int = GRAPHQL_MAX_PAGE_SIZE,
+        cache: BlobCache | None = None,
+    ):
+        self.gl = gl
+        self.batch_size = min(batch_size, GRAPHQL_MAX_PAGE_SIZE)
+        self.cache = cache
+        self.graphql_url: str = f"{gl.url}/api/graphql"
+
+    def batches(self, paths: Iterable[str]) -> List[Tuple[str, ...]]:
+        unique: List[str] = sorted(set(paths))
+        batches: List[Tuple[str, ...]] = []
+
+        for start in range(0, len(unique), self.batch_size):
+            end: int = start + self.batch_size
+            batches.append(tuple(unique[start:end]))
+
+        return batches
+
+    def read_files(
+        self, project: Project, ref: str, paths: Iterable[str]
+    ) -> Dict[str, str]:
+        wanted: Set[str] = set(paths)
+
+        with span("blobs", ref=ref) as current:
+            files: Dict[str, str] = self.read_cached_files(project, ref, wanted)
+            cached: int = len(files)
+            downloaded: Dict[str, str] = self.download_files(
+                project, ref, wanted.difference(files)
+            )
+            files.update(downloaded)
+
+            if self.cache is not None:
+                for content in downloaded.values():
+                    self.cache.put(content)
+
+            current.record(
+                files=len(files),
+                bytes=sum(len(content.encode()) for content in files.values()),
+                cached=cached,
+            )
+
+        return files
+
+    def read_cached_files(
+        self, project: Project, ref: str, paths: Iterable[str]
+    ) -> Dict[str, str]:
+        if self.cache is None:
+            return {}
+
+        files: Dict[str, str] = {}
+
+        for path, oid in self.resolve_blob_ids(project, ref, paths).items():
+            content: str | None = self.cache.get(oid)
+
+            if content is not None:
+                files[path] = content
+
+        return files
+
+    def resolve_blob_ids(
+        self, project: Project, ref: str, paths: Iterable[str]
+    ) -> Dict[str, str]:
+        blob_ids: Dict[str, str] = {}
+
+        for batch in self.batches(paths):
+            try:
+                nodes = self.query_nodes(project, ref, batch, BLOB_IDS_QUERY)
+                blob_ids.update({node["path"]: node["oid"] for node in nodes})
+            except (gitlab.GitlabError, KeyError, TypeError, ValueError):
+                LOGGER.exception("GraphQL blob ids query failed, asking file headers")
+                blob_ids.update(self.head_blob_ids(project, ref, batch))
+
+        return blob_ids
+
+    def head_blob_ids(
+        self, project: Project, ref: str, paths: Iterable[str]
+    ) -> Dict[str, str]:
+        blob_ids: Dict[str, str] = {}
+
+        for path in paths:
+            try:
+                headers = project.files.head(path, query_data={"ref": ref})
+            except gitlab.GitlabHeadError:
+                continue
+
+            if headers.get("X-Gitlab-Blob-Id"):
+                blob_ids[path] = headers["X-Gitlab-Blob-Id"]
+
+        return blob_ids
+
+    def download_files(
+        self, project: Project, ref: str, paths: Iterable[str]
+    ) -> Dict[str, str]:
+        files: Dict[str, str] = {}
+
+        for batch in self.batches(paths):
+            try:
+                files.update(self.query_blobs(project, ref, batch))
+            except (gitlab.GitlabError, KeyError, TypeError, ValueError):
+                LOGGER.exception("GraphQL blobs query failed, reading raw files")
+                files.update(self.read_raw_files(project, ref, batch))
+
+        return files
+
+    def query_nodes(
+        self, project: Project, ref: str, paths: Tuple[str, ...], query: str
+    ) -> List[Dict[str, Any]]:
+        payload: Dict[str, Any] = self.gl.http_post(
+            self.graphql_url,
+            post_data={
+                "query": query,
+                "variables": {
+                    "project": project.path_with_namespace,
+                    "ref": ref,
+                    "paths": list(paths),
+                },
+            },
+        )
+
+        if payload.get("errors"):
+            raise ValueError(payload["errors"])
+
+        return payload["data"]["project"]["repository"]["blobs"]["nodes"]
+
+    def query_blobs(
+        self, project: Project, ref: str, paths: Tuple[str, ...]
+    ) -> Dict[str, str]:
+        nodes: List[Dict[str, Any]] = self.query_nodes(project, ref, paths, BLOBS_QUERY)
+
+        return {
+            node["path"]: node["rawTextBlob"]
+            for node in nodes
+            if node.get("rawTextBlob") is not None
+        }
+
+    def read_raw_files(
+        self, project: Project, ref: str, paths: Iterable[str]
+    ) -> Dict[str, str]:
+        files: Dict[str, str] = {}
+
+        for path in paths:
+            try:
+                content: bytes = project.files.raw(file_path=path, ref=ref)
+                files[path] = content.decode("utf-8")
+            except gitlab.GitlabGetError:
+                LOGGER.info(f"{path} does not exist at {ref}")
+            except UnicodeDecodeError:
+                LOGGER.info(f"Skipping binary file {path}")
+
+        return files
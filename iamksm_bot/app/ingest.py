@@ -0,0 +1,198 @@
+import fnmatch
+import logging
+import posixpath
+import zipfile
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Mapping, Tuple
+
+from iamksm_bot.app.utils import is_ignored_path
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# Like git, treat a file as binary when a NUL byte shows up early on
+BINARY_SNIFF_BYTES = 8000
+LINGUIST_ATTRIBUTES = ("linguist-generated", "linguist-vendored")
+GITATTRIBUTES = ".gitattributes"
+
+
+def is_binary(head: bytes) -> bool:
+    return b"\0" in head
+
+
+@dataclass
+class AttributeRule:
+    """
+    A `.gitattributes` line setting or unsetting a linguist attribute, for
+    the file found in the `base` directory of the repository.
+    """
+
+    base: str
+    pattern: str
+    excluded: bool
+
+    def matches(self, path: str) -> bool:
+        if self.base and not path.startswith(f"{self.base}/"):
+            return False
+
+        relative: str = path.removeprefix(f"{self.base}/") if self.base else path
+        pattern: str = self.pattern.lstrip("/")
+
+        # Patterns without a slash match the file name at any depth
+        if "/" not in pattern:
+            return fnmatch.fnmatchcase(posixpath.basename(relative), pattern)
+
+        candidates: Tuple[str, ...] = (
+            pattern,
+            pattern.replace("/**/", "/"),
+            pattern.removeprefix("**/"),
+        )
+        return any(fnmatch.fnmatchcase(relative, c) for c in candidates)
+
+
+def parse_gitattributes(text: str, base: str = "") -> List[AttributeRule]:
+    rules: List[AttributeRule] = []
+
+    for line in text.splitlines():
+        line = line.strip()
+
+        if not line or line.startswith("#"):
+            continue
+
+        pattern, *attributes = line.split()
+
+        for attribute in attributes:
+            name, _, value = attribute.partition("=")
+            unset: bool = name.startswith(("-", "!")) or value == "false"
+
+            if name.lstrip("-!") in LINGUIST_ATTRIBUTES:
+                rules.append(AttributeRule(base, pattern, excluded=not unset))
+
+    return rules
+
+
+def attribute_rules(files: Iterable[Tuple[str, str]]) -> List[AttributeRule]:
+    """
+    Parses the `.gitattributes` files of a repository, given as paths and
+    contents, into rules ordered so that deeper directories come last.
+    """
+    rules: List[AttributeRule] = []
+
+    for path, text in files:
+        rules.extend(parse_gitattributes(text, posixpath.dirname(path)))
+
+    rules.sort(key=lambda rule: rule.base.count("/") + bool(rule.base))
+    return rules
+
+
+def excluded_by_attributes(path: str, rules: Iterable[AttributeRule]) -> bool:
+    excluded: bool = False
+
+    # Later rules, and rules from deeper directories, take precedence
+    for rule in rules:
+        if rule.matches(path):
+            excluded = rule.excluded
+
+    return excluded
+
+
+@dataclass
+class IngestFilter:
+    """
+    Decides which repository files are worth reading as review context.
+    """
+
+    max_file_bytes: int
+    skip_extensions: Tuple[str, ...] = ()
+    denylist: Tuple[str, ...] = ()
+
+    def skips(self, path: str, size: int) -> bool:
+        if size > self.max_file_bytes or is_ignored_path(path):
+            return True
+
+        if path.lower().endswith(self.skip_extensions):
+            return True
+
+        name: str = posixpath.basename(path)
+
+        return any(
+            fnmatch.fnmatchcase(path, pattern) or fnmatch.fnmatchcase(name, pattern)
+            for pattern in self.denylist
+        )
+
+
+class ArchiveContents(Mapping[str, str]):
+    """
+    Read-only mapping of repository paths to the text of a zipped archive.
+
+    Explanation:
+    - Entries are picked from the zip's central directory without extracting
+        anything, skipping them by size, extension and the denylist before
+        any content is read.
+    - Files marked `linguist-generated` or `linguist-vendored` in any
+        `.gitattributes` of the archive are skipped as well.
+    - Binary files are left out too, judged by the first
+        `BINARY_SNIFF_BYTES` of each file, so the set of paths never changes
+        once the snapshot is open.
+    - Files are decompressed and decoded on every access and nothing is
+        kept, so an open snapshot costs little more than its zip directory.
+    """
+
+    def __init__(self, archive_path: Path, ingest_filter: IngestFilter):
+        self.archive_path = archive_path
+        self.zip = zipfile.ZipFile(archive_path)
+        self._entries: Dict[str, zipfile.ZipInfo] = {}
+
+        infos: List[zipfile.ZipInfo] = [
+            info for info in self.zip.infolist() if not info.is_dir()
+        ]
+        prefix: str = self.common_prefix(infos)
+        candidates: Dict[str, zipfile.ZipInfo] = {}
+        attributes: List[Tuple[str, str]] = []
+
+        for info in infos:
+            path: str = info.filename.removeprefix(prefix)
+
+            if posixpath.basename(path) == GITATTRIBUTES:
+                text: str = self.zip.read(info).decode(errors="replace")
+                attributes.append((path, text))
+            elif not ingest_filter.skips(path, info.file_size):
+                candidates[path] = info
+
+        rules: List[AttributeRule] = attribute_rules(attributes)
+
+        for path, info in candidates.items():
+            if not excluded_by_attributes(path, rules) and not self.sniff(info):
+                self._entries[path] = info
+
+        LOGGER.info(
+            f"Ingesting {len(self._entries)} of {len(infos)} files from "
+            f"{archive_path}"
+        )
+
+    @staticmethod
+    def common_prefix(infos: List[zipfile.ZipInfo]) -> str:
+        # GitLab archives wrap everything in a single `{name}-{sha}` folder
+        tops = {info.filename.split("/", 1)[0] for info in infos}
+
+        if len(tops) == 1 and all("/" in info.filename for info in infos):
+            return f"{tops.pop()}/"
+
+        return ""
+
+    def sniff(self, info: zipfile.ZipInfo) -> bool:
+        # Only the head of the file is decompressed
+        with self.zip.open(info) as member:
+            return is_binary(member.read(BINARY_SNIFF_BYTES))
+
+    def __getitem__(self, path: str) -> str:
+        return self.zip.read(self._entries[path]).decode("utf-8", errors="replace")
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._entries)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def close(self) -> None:
+        self.zip.close()
@@ -0,0 +1,369 @@
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from iamksm_bot.app.fairqueue import SchedulingPolicy
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_id INTEGER NOT NULL,
+    mr_iid INTEGER NOT NULL,
+    sha TEXT,
+    priority INTEGER NOT NULL DEFAULT 0,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    leased_at REAL,
+    leased_until REAL,
+    lease_owner TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (state, available_at);
+CREATE INDEX IF NOT EXISTS jobs_key ON jobs (project_id, mr_iid, state);
+"""
+# Columns added since the first schema, created on queues that predate them
+MIGRATIONS = {
+    "priority": "ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 0",
+    "leased_at": "ALTER TABLE jobs ADD COLUMN leased_at REAL",
+}
+# Indexes on migrated columns, created once the migrations ran
+INDEXES = """
+CREATE INDEX IF NOT EXISTS jobs_expired ON jobs (state, leased_until);
+CREATE INDEX IF NOT EXISTS jobs_leased_at ON jobs (leased_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (state, updated_at);
+"""
+# Reviews leased within this many seconds count towards each project's share
+FAIR_SHARE_WINDOW = 3600
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+FAILED = "failed"
+SUPERSEDED = "superseded"
+
+
+@dataclass
+class Job:
+    id: int
+    project_id: int
+    mr_iid: int
+    sha: Optional[str]
+    attempts: int
+    created_at: float
+
+
+class JobQueue:
+    """
+    A review queue persisted in a local SQLite file, shared by every process
+    on the host.
+
+    Jobs are leased for `visibility_timeout` seconds. A worker that dies
+    without completing its job lets the lease expire and another worker picks
+    the job up again, up to `max_attempts` times. Enqueuing a review for an
+    MR supersedes any of its jobs that are still waiting.
+
+    Ready jobs are leased highest priority first, then from the project that
+    leased the fewest jobs within `FAIR_SHARE_WINDOW` relative to its
+    weight, skipping projects at their concurrency limit. Enqueuing raises
+    BacklogFull when `policy` does not admit the job.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        visibility_timeout: float,
+        max_attempts: int,
+        policy: SchedulingPolicy | None = None,
+    ):
+        self.path = path
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.policy = policy or SchedulingPolicy()
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(jobs)")}
+
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    db.execute(statement)
+
+            db.executescript(INDEXES)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        db.row_factory = sqlite3.Row
+
+        try:
+            yield db
+        finally:
+            db.close()
+
+    @contextmanager
+    def _transaction(self) -> Iterator[sqlite3.Connection]:
+        with self._connect() as db:
+            # Take the write lock up front so concurrent leases cannot race
+            db.execute("BEGIN IMMEDIATE")
+
+            try:
+                yield db
+            except BaseException:
+                db.execute("ROLLBACK")
+                raise
+
+            db.execute("COMMIT")
+
+    def enqueue(
+        self,
+        project_id: int,
+        mr_iid: int,
+        sha: Optional[str],
+        delay: float = 0,
+        priority: int = 0,
+    ) -> Optional[int]:
+        """
+        Queues a review, superseding any queued review of the same MR.
+
+        Args:
+        - `project_id`: ID of the project the MR belongs to.
+        - `mr_iid`: IID of the merge request.
+        - `sha`: Head commit SHA the review is for.
+        - `delay`: Seconds to wait before the job may be leased, used to
+            debounce bursts of pushes.
+        - `priority`: Jobs with a higher priority are leased first.
+
+        Returns:
+        - The new job id, or None if that SHA is already being reviewed.
+        """
+        now: float = time.time()
+
+        with self._transaction() as db:
+            in_flight = db.execute(
+                "SELECT id FROM jobs WHERE project_id = ? AND mr_iid = ? "
+                "AND state = ? AND sha IS ?",
+                (project_id, mr_iid, LEASED, sha),
+            ).fetchone()
+
+            if in_flight is not None:
+                LOGGER.info(f"Review of {project_id}!{mr_iid}@{sha} already leased")
+                return None
+
+            self._admit(db, project_id, mr_iid)
+            db.execute(
+                "UPDATE jobs SET state = ?, updated_at = ? "
+                "WHERE project_id = ? AND mr_iid = ? AND state = ?",
+                (SUPERSEDED, now, project_id, mr_iid, QUEUED),
+            )
+            cursor = db.execute(
+                "INSERT INTO jobs (project_id, mr_iid, sha, priority, state, "
+                "available_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (project_id, mr_iid, sha, priority, QUEUED, now + delay, now, now),
+            )
+
+        LOGGER.info(f"Queued review of {project_id}!{mr_iid}@{sha}")
+        return cursor.lastrowid
+
+    def _admit(self, db: sqlite3.Connection, project_id: int, mr_iid: int) -> None:
+        waiting: Dict[int, int] = dict(
+            db.execute(
+                "SELECT project_id, COUNT(*) FROM jobs WHERE state = ? "
+                "GROUP BY project_id",
+                (QUEUED,),
+            ).fetchall()
+        )
+        replacing = db.execute(
+            "SELECT 1 FROM jobs WHERE project_id = ? AND mr_iid = ? AND state = ?",
+            (project_id, mr_iid, QUEUED),
+        ).fetchone()
+
+        # Replacing a waiting review of the MR does not grow the backlog
+        if replacing is None:
+            self.policy.admit(
+                project_id,
+                backlog=sum(waiting.values()),
+                project_backlog=waiting.get(project_id, 0),
+            )
+
+    def _next(self, db: sqlite3.Connection, now: float) -> Optional[sqlite3.Row]:
+        rows: List[sqlite3.Row] = db.execute(
+            "SELECT * FROM jobs WHERE (state = ? AND available_at <= ?) "
+            "OR (state = ? AND leased_until < ?) ORDER BY priority DESC, available_at",
+            (QUEUED, now, LEASED, now),
+        ).fetchall()
+
+        if not rows:
+            return None
+
+        service: Dict[int, Tuple[int, int]] = {
+            row[0]: (row[1], row[2])
+            for row in db.execute(
+                "SELECT project_id, SUM(state = ? AND leased_until >= ?), COUNT(*) "
+                "FROM jobs WHERE state = ? OR leased_at >= ? GROUP BY project_id",
+                (LEASED, now, LEASED, now - FAIR_SHARE_WINDOW),
+            )
+        }
+        heads: Dict[int, sqlite3.Row] = {}
+
+        for row in rows:
+            running: int = service.get(row["project_id"], (0, 0))[0]
+
+            if not self.policy.at_capacity(row["project_id"], running):
+                heads.setdefault(row["project_id"], row)
+
+        def share(row: sqlite3.Row) -> Tuple[int, float, float]:
+            leased: int = service.get(row["project_id"], (0, 0))[1]
+            weight: float = self.policy.project(row["project_id"]).weight
+            return (-row["priority"], leased / weight, row["available_at"])
+
+        return min(heads.values(), key=share, default=None)
+
+    def lease(self, owner: str) -> Optional[Job]:
+        """
+        Leases the next ready job, including jobs whose lease expired.
+        """
+        now: float = time.time()
+
+        with self._transaction() as db:
+            row: Optional[sqlite3.Row] = self._next(db, now)
+
+            if row is None:
+                return None
+
+            if row["attempts"] >= self.max_attempts:
+                db.execute(
+                    "UPDATE jobs SET state = ?, error = ?, updated_at = ? "
+                    "WHERE id = ?",
+                    (FAILED, "Lease expired too many times", now, row["id"]),
+                )
+                return None
+
+            db.execute(
+                "UPDATE jobs SET state = ?, attempts = attempts + 1, leased_at = ?, "
+                "leased_until = ?, lease_owner = ?, updated_at = ? WHERE id = ?",
+                (LEASED, now, now + self.visibility_timeout, owner, now, row["id"]),
+            )
+
+        return Job(
+            id=row["id"],
+            project_id=row["project_id"],
+            mr_iid=row["mr_iid"],
+            sha=row["sha"],
+            attempts=row["attempts"] + 1,
+            created_at=row["created_at"],
+        )
+
+    def heartbeat(self, job: Job, owner: str) -> bool:
+        """
+        Extends the lease of a job.
+
+        Returns:
+        - False if the job is no longer leased by `owner` or was superseded
+            by a newer push, in which case the review should be cancelled.
+        """
+        now: float = time.time()
+
+        with self._transaction() as db:
+            updated = db.execute(
+                "UPDATE jobs SET leased_until = ?, updated_at = ? "
+                "WHERE id = ? AND state = ? AND lease_owner = ?",
+                (now + self.visibility_timeout, now, job.id, LEASED, owner),
+            ).rowcount
+            newer = db.execute(
+                "SELECT 1 FROM jobs WHERE project_id = ? AND mr_iid = ? AND id > ? "
+                "AND sha IS NOT ? AND state IN (?, ?, ?)",
+                (job.project_id, job.mr_iid, job.id, job.sha, QUEUED, LEASED, DONE),
+            ).fetchone()
+
+        return bool(updated) and newer is None
+
+    def _finish(self, job: Job, state: str, error: Optional[str] = None) -> None:
+        with self._transaction() as db:
+            db.execute(
+                "UPDATE jobs SET state = ?, error = ?, leased_until = NULL, "
+                "updated_at = ? WHERE id = ?",
+                (state, error, time.time(), job.id),
+            )
+
+    def complete(self, job: Job) -> None:
+        self._finish(job, DONE)
+
+    def supersede(self, job: Job) -> None:
+        self._finish(job, SUPERSEDED)
+
+    def fail(self, job: Job, error: str, backoff: float = 30) -> None:
+        """
+        Requeues a failed job with exponential backoff until it runs out of
+        attempts.
+        """
+        if job.attempts >= self.max_attempts:
+            LOGGER.error(f"Giving up on job {job.id} after {job.attempts} attempts")
+            self._finish(job, FAILED, error)
+            return
+
+        now: float = time.time()
+        retry_at: float = now + backoff * 2 ** (job.attempts - 1)
+
+        with self._transaction() as db:
+            newer = db.execute(
+                "SELECT 1 FROM jobs WHERE project_id = ? AND mr_iid = ? AND id > ?",
+                (job.project_id, job.mr_iid, job.id),
+            ).fetchone()
+            db.execute(
+                "UPDATE jobs SET state = ?, error = ?, available_at = ?, "
+                "leased_until = NULL, updated_at = ? WHERE id = ?",
+                (SUPERSEDED if newer else QUEUED, error, retry_at, now, job.id),
+            )
+
+    def purge(self, retention: float) -> int:
+        """
+        Deletes jobs that finished, failed or were superseded more than
+        `retention` seconds ago.
+
+        Jobs leased within `FAIR_SHARE_WINDOW` are always kept, since they
+        count towards their project's share.
+
+        Returns:
+        - Number of jobs deleted.
+        """
+        before: float = time.time() - max(retention, FAIR_SHARE_WINDOW)
+
+        with self._transaction() as db:
+            deleted: int = db.execute(
+                "DELETE FROM jobs WHERE state IN (?, ?, ?) AND updated_at < ?",
+                (DONE, FAILED, SUPERSEDED, before),
+            ).rowcount
+
+        if deleted:
+            LOGGER.info(f"Purged {deleted} finished jobs from {self.path}")
+
+        return deleted
+
+    def depth(self) -> int:
+        with self._connect() as db:
+            return db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = ?", (QUEUED,)
+            ).fetchone()[0]
+
+    def in_flight(self) -> int:
+        with self._connect() as db:
+            return db.execute(
+                "SELECT COUNT(*) FROM jobs WHERE state = ? AND leased_until > ?",
+                (LEASED, time.time()),
+            ).fetchone()[0]
+
+
+def default_owner() -> str:
+    return f"{os.uname().nodename}:{os.getpid()}"
@@ -0,0 +1,54 @@
+from typing import Any, Dict, List
+
+from iamksm_bot.app.context import estimate_tokens
+from iamksm_bot.app.retrieval import diff_hunks
+
+Change = Dict[str, Any]
+
+
+def diff_tokens(changes: List[Change]) -> int:
+    return sum(estimate_tokens(change.get("diff", "")) for change in changes)
+
+
+def split_change(change: Change, unit_tokens: int) -> List[Change]:
+    """
+    Splits the diff of one file into groups of hunks of about `unit_tokens`.
+    """
+    groups: List[List[str]] = [[]]
+    used: int = 0
+
+    for hunk in diff_hunks(change.get("diff", "")):
+        cost: int = estimate_tokens(hunk)
+
+        if groups[-1] and used + cost > unit_tokens:
+            groups.append([])
+            used = 0
+
+        groups[-1].append(hunk)
+        used += cost
+
+    return [dict(change, diff="".join(group)) for group in groups if group]
+
+
+def split_review_units(changes: List[Change], unit_tokens: int) -> List[List[Change]]:
+    """
+    Groups the changes of an MR into review units of about `unit_tokens`.
+
+    Files are kept together where possible and packed with their neighbours
+    in path order, while files with larger diffs are split by hunks.
+    """
+    units: List[List[Change]] = [[]]
+    used: int = 0
+
+    for change in sorted(changes, key=lambda c: c["new_path"]):
+        for part in split_change(change, unit_tokens) or [change]:
+            cost: int = estimate_tokens(part.get("diff", ""))
+
+            if units[-1] and used + cost > unit_tokens:
+                units.append([])
+                used = 0
+
+            units[-1].append(part)
+            used += cost
+
+    return [unit for unit in units if unit]
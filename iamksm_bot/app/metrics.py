@@ -0,0 +1,310 @@
+import logging
+import math
+from abc import ABC, abstractmethod
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Lock, Thread
+from typing import Callable, Dict, Iterable, List, Tuple
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+DEFAULT_BUCKETS = (
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    120,
+    300,
+    600,
+)
+
+LabelValues = Tuple[str, ...]
+
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+
+    return repr(float(value))
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: Iterable[str], values: Iterable[str]) -> str:
+    pairs: List[str] = [
+        f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)
+    ]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Metric(ABC):
+    """
+    Base of the metrics rendered in the Prometheus text exposition format.
+    """
+
+    kind: str = "untyped"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names: LabelValues = tuple(labels)
+        self._lock = Lock()
+
+    def key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    @abstractmethod
+    def samples(self) -> List[str]:
+        pass
+
+    def render(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key: LabelValues = self.key(labels)
+
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            values: List[Tuple[LabelValues, float]] = sorted(self._values.items())
+
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Gauge(Metric):
+    """
+    A value that goes up and down, either set directly or read from a
+    function every time the metrics are scraped.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: Iterable[str] = ()):
+        super().__init__(name, documentation, labels)
+        self._values: Dict[LabelValues, float] = {}
+        self._function: Callable[[], float] | None = None
+
+    def set(self, value: float, **labels: str) -> None:
+        with self._lock:
+            self._values[self.key(labels)] = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._function = function
+
+    def samples(self) -> List[str]:
+        if self._function is not None:
+            return [f"{self.name} {format_value(self._function())}"]
+
+        with self._lock:
+            values: List[Tuple[LabelValues, float]] = sorted(self._values.items())
+
+        return [
+            f"{self.name}{format_labels(self.label_names, key)} {format_value(value)}"
+            for key, value in values
+        ]
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets: Tuple[float, ...] = (*sorted(buckets), math.inf)
+        self._counts: Dict[LabelValues, List[int]] = {}
+        self._sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key: LabelValues = self.key(labels)
+
+        with self._lock:
+            counts: List[int] = self._counts.setdefault(key, [0] * len(self.buckets))
+            self._sums[key] = self._sums.get(key, 0.0) + value
+
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+
+    def totals(self) -> Dict[LabelValues, Tuple[int, float]]:
+        """
+        Returns the number and sum of the observations of each label set.
+        """
+        with self._lock:
+            return {
+                key: (sum(counts), self._sums[key])
+                for key, counts in self._counts.items()
+            }
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series: List[Tuple[LabelValues, List[int], float]] = [
+                (key, list(counts), self._sums[key])
+                for key, counts in sorted(self._counts.items())
+            ]
+
+        lines: List[str] = []
+
+        for key, counts, total in series:
+            cumulative: int = 0
+
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels: str = format_labels(
+                    (*self.label_names, "le"), (*key, format_value(bound))
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = format_labels(self.label_names, key)
+            lines.append(f"{self.name}_sum{labels} {format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+
+        return lines
+
+
+class Registry:
+    """
+    The metrics of the process, rendered for Prometheus on `/metrics`.
+    """
+
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, documentation: str, labels=()) -> Counter:
+        return self.register(Counter(name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels=()) -> Gauge:
+        return self.register(Gauge(name, documentation, labels))
+
+    def histogram(
+        self, name: str, documentation: str, labels=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, documentation, labels, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+
+        for metric in self._metrics:
+            lines.extend(metric.render())
+
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path != "/metrics":
+            self.send_error(404)
+            return
+
+        body: bytes = REGISTRY.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def serve_metrics(port: int, host: str = "0.0.0.0") -> ThreadingHTTPServer:
+    """
+    Serves the metrics of the process on `GET /metrics` from a background
+    thread, for processes without a web app such as `iamksm-bot worker`.
+    """
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    LOGGER.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "iamksm_stage_duration_seconds", "Time spent in each review stage", ("stage",)
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "iamksm_stage_errors_total", "Review stages that raised an error", ("stage",)
+)
+STAGE_BYTES = REGISTRY.counter(
+    "iamksm_stage_bytes_total", "Bytes handled by each review stage", ("stage",)
+)
+STAGE_FILES = REGISTRY.counter(
+    "iamksm_stage_files_total", "Files handled by each review stage", ("stage",)
+)
+PROMPT_TOKENS = REGISTRY.histogram(
+    "iamksm_prompt_tokens",
+    "Estimated tokens of each prompt sent to the model",
+    buckets=(256, 512, 1024, 2048, 4096, 8192, 16384, 32768),
+)
+EVAL_TOKENS_PER_SECOND = REGISTRY.histogram(
+    "iamksm_eval_tokens_per_second",
+    "Generation throughput of each model call",
+    ("model",),
+    buckets=(1, 2.5, 5, 10, 20, 40, 80, 160),
+)
+REVIEWS = REGISTRY.counter(
+    "iamksm_reviews_total", "Reviews that ran, by outcome", ("outcome",)
+)
+REVIEWS_IN_FLIGHT = REGISTRY.gauge("iamksm_reviews_in_flight", "Reviews running")
+QUEUE_DEPTH = REGISTRY.gauge(
+    "iamksm_review_queue_depth", "Reviews waiting to start, including debounced ones"
+)
+QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "iamksm_review_queue_wait_seconds",
+    "Time reviews waited for a slot after debouncing, by project",
+    ("project",),
+)
+REVIEWS_REJECTED = REGISTRY.counter(
+    "iamksm_reviews_rejected_total",
+    "Webhook events turned away because the review backlog was full",
+    ("reason",),
+)
+BLOB_CACHE_LOOKUPS = REGISTRY.counter(
+    "iamksm_blob_cache_lookups_total",
+    "Blob cache lookups of changed files, by where the blob was found",
+    ("result",),
+)
+PREWARMS = REGISTRY.counter(
+    "iamksm_prewarms_total",
+    "Pushed branches whose repository context was prebuilt, by outcome",
+    ("outcome",),
+)
@@ -0,0 +1,221 @@
+import base64
+import logging
+import os
+import posixpath
+import subprocess
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from iamksm_bot.app.ingest import (
+    BINARY_SNIFF_BYTES,
+    GITATTRIBUTES,
+    AttributeRule,
+    IngestFilter,
+    attribute_rules,
+    excluded_by_attributes,
+    is_binary,
+)
+from iamksm_bot.app.utils import is_ignored_path
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+
+class GitMirrorError(Exception):
+    pass
+
+
+class GitMirror:
+    """
+    A bare git mirror of a single project used as a local repository source.
+
+    Refs are fetched incrementally so only new objects travel over the wire,
+    and file contents are read straight from the local object database.
+    The token is sent as a per-command header through git's environment,
+    so it never shows up in process listings nor gets written to disk, and
+    any git remote works, including `file://` URLs.
+    """
+
+    def __init__(self, path: Path, url: str, token: Optional[str] = None):
+        self.path = path
+        self.url = url
+        self.token = token
+        self._lock = Lock()
+
+    def _git(self, *args: str, stdin: Optional[bytes] = None) -> bytes:
+        command: List[str] = ["git", f"--git-dir={self.path}", *args]
+        env: Dict[str, str] = dict(os.environ)
+
+        if self.token:
+            credentials = base64.b64encode(f"oauth2:{self.token}".encode()).decode()
+            env.update(
+                GIT_CONFIG_COUNT="1",
+                GIT_CONFIG_KEY_0="http.extraHeader",
+                GIT_CONFIG_VALUE_0=f"Authorization: Basic {credentials}",
+            )
+
+        result = subprocess.run(
+            command, input=stdin, env=env, capture_output=True, check=False
+        )
+
+        if result.returncode != 0:
+            error: str = result.stderr.decode(errors="replace").strip()
+            raise GitMirrorError(f"git {args[0]} failed: {error}")
+
+        return result.stdout
+
+    def ensure(self) -> None:
+        if self.path.exists():
+            return
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        subprocess.run(
+            ["git", "init", "--bare", "--quiet", str(self.path)],
+            capture_output=True,
+            check=True,
+        )
+        LOGGER.info(f"Created git mirror at {self.path}")
+
+    def has_commits(self, shas: Iterable[str]) -> bool:
+        specs: bytes = "".join(f"{sha}^{{commit}}\n" for sha in shas).encode()
+        output: bytes = self._git("cat-file", "--batch-check", stdin=specs)
+
+        return b" missing" not in output
+
+    def fetch(self, refs: Iterable[str], wanted: Iterable[str] = ()) -> None:
+        """
+        Fetches `refs` from the remote unless every `wanted` commit is present.
+
+        Args:
+        - `refs`: Remote refs to update, e.g. `refs/heads/main`.
+        - `wanted`: Commit SHAs the caller is about to read.
+        """
+        wanted = [sha for sha in wanted if sha]
+
+        with self._lock:
+            self.ensure()
+
+            if wanted and self.has_commits(wanted):
+                LOGGER.info(f"Git mirror {self.path} already has {wanted}")
+                return
+
+            refspecs: List[str] = [f"+{ref}:{ref}" for ref in refs]
+            self._git("fetch", "--quiet", "--no-tags", self.url, *refspecs)
+            LOGGER.info(f"Fetched {refspecs} into {self.path}")
+
+    def list_blobs(self, sha: str) -> List[Tuple[str, str, int]]:
+        """
+        Lists the files of a commit as paths, blob SHAs and sizes.
+        """
+        output: bytes = self._git("ls-tree", "-r", "-z", "--long", sha)
+        blobs: List[Tuple[str, str, int]] = []
+
+        for entry in output.split(b"\0"):
+            if not entry:
+                continue
+
+            info, path = entry.decode(errors="replace").split("\t", 1)
+            _, object_type, object_id, size = info.split()
+
+            if object_type == "blob":
+                blobs.append((path, object_id, int(size)))
+
+        return blobs
+
+    def read_objects(self, specs: Iterable[str]) -> Dict[str, bytes]:
+        """
+        Reads many objects with a single `git cat-file --batch` process.
+
+        Args:
+        - `specs`: Object names such as a blob SHA or `{commit}:{path}`.
+
+        Returns:
+        - Mapping of each found spec to its raw contents.
+        """
+        specs = list(specs)
+        output: bytes = self._git(
+            "cat-file", "--batch", stdin="".join(f"{s}\n" for s in specs).encode()
+        )
+        objects: Dict[str, bytes] = {}
+        offset: int = 0
+
+        for spec in specs:
+            header_end: int = output.index(b"\n", offset)
+            header: List[bytes] = output[offset:header_end].split(b" ")
+            offset = header_end + 1
+
+            if header[-1] == b"missing":
+                continue
+
+            end: int = offset + int(header[2])
+            objects[spec] = output[offset:end]
+            # Each object is followed by a newline
+            offset = end + 1
+
+        return objects
+
+    def read_files(self, sha: str, paths: Iterable[str]) -> Dict[str, str]:
+        paths = list(paths)
+        objects: Dict[str, bytes] = self.read_objects(f"{sha}:{p}" for p in paths)
+        files: Dict[str, str] = {}
+
+        for path in paths:
+            content: Optional[bytes] = objects.get(f"{sha}:{path}")
+
+            if content is None:
+                continue
+
+            try:
+                files[path] = content.decode("utf-8")
+            except UnicodeDecodeError:
+                continue
+
+        return files
+
+    def read_tree(
+        self, sha: str, ingest_filter: Optional[IngestFilter] = None
+    ) -> Dict[str, str]:
+        """
+        Reads the text files of a commit worth using as review context.
+
+        Explanation:
+        - Entries are picked from the tree listing before any content is read,
+            skipping them with `ingest_filter` by size, extension and the
+            denylist, or only ignored paths without one.
+        - Files marked `linguist-generated` or `linguist-vendored` in any
+            `.gitattributes` of the commit are skipped as well.
+        - The remaining blobs are read with a single `cat-file` process and
+            binaries, found by a NUL byte early on, are dropped.
+        """
+        blobs: List[Tuple[str, str, int]] = self.list_blobs(sha)
+
+        if ingest_filter is None:
+            paths: List[str] = [
+                path for path, _, _ in blobs if not is_ignored_path(path)
+            ]
+            return self.read_files(sha, paths)
+
+        attributes: Dict[str, bytes] = self.read_objects(
+            object_id
+            for path, object_id, _ in blobs
+            if posixpath.basename(path) == GITATTRIBUTES
+        )
+        rules: List[AttributeRule] = attribute_rules(
+            (path, attributes[object_id].decode(errors="replace"))
+            for path, object_id, _ in blobs
+            if object_id in attributes
+        )
+        paths = [
+            path
+            for path, _, size in blobs
+            if posixpath.basename(path) != GITATTRIBUTES
+            and not ingest_filter.skips(path, size)
+            and not excluded_by_attributes(path, rules)
+        ]
+        files: Dict[str, str] = self.read_files(sha, paths)
+
+        return {
+            path: content
+            for path, content in files.items()
+            if not is_binary(content[:BINARY_SNIFF_BYTES].encode())
+        }
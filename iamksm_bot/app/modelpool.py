@@ -0,0 +1,323 @@
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+from dataclasses import dataclass
+from threading import BoundedSemaphore, Event, Lock
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Set, Tuple
+
+import httpx
+import ollama
+
+from iamksm_bot.app.generation import GenerationStats, astream_generate, stream_generate
+from iamksm_bot.app.scheduler import raise_if_cancelled
+from iamksm_bot.app.tracing import Span, span
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# Seconds a health check may take before the endpoint counts as unhealthy
+HEALTH_CHECK_TIMEOUT = 5.0
+
+
+class NoHealthyEndpoint(Exception):
+    pass
+
+
+def model_name(model: str) -> str:
+    # Ollama lists untagged models under their `latest` tag
+    return model if ":" in model else f"{model}:latest"
+
+
+@dataclass
+class ModelRule:
+    """
+    Picks `model` for MRs whose diff size is within the token bounds and, when
+    `labels` are given, that carry at least one of them.
+    """
+
+    model: str
+    min_diff_tokens: int = 0
+    max_diff_tokens: int | None = None
+    labels: Tuple[str, ...] = ()
+
+    @classmethod
+    def from_config(cls, rule: Dict[str, Any]) -> "ModelRule":
+        max_diff_tokens: Any = rule.get("max_diff_tokens")
+
+        return cls(
+            model=rule["model"],
+            min_diff_tokens=int(rule.get("min_diff_tokens", 0)),
+            max_diff_tokens=None if max_diff_tokens is None else int(max_diff_tokens),
+            labels=tuple(rule.get("labels", ())),
+        )
+
+    def matches(self, tokens: int, labels: Set[str]) -> bool:
+        if tokens < self.min_diff_tokens:
+            return False
+
+        if self.max_diff_tokens is not None and tokens > self.max_diff_tokens:
+            return False
+
+        return not self.labels or not labels.isdisjoint(self.labels)
+
+
+def select_model(
+    rules: Iterable[ModelRule], default: str, tokens: int, labels: Iterable[str]
+) -> str:
+    """
+    Returns the model of the first rule matching a diff of `tokens` tokens
+    with `labels`, or `default` when none does.
+    """
+    label_set: Set[str] = set(labels)
+
+    for rule in rules:
+        if rule.matches(tokens, label_set):
+            return rule.model
+
+    return default
+
+
+class Endpoint:
+    """
+    One Ollama server of the pool, with its slots and load counters.
+    """
+
+    def __init__(self, host: str | None, concurrency: int, timeout: float):
+        self.host = host
+        self.concurrency = concurrency
+        self.client = ollama.Client(host=host, timeout=timeout)
+        self.async_client = ollama.AsyncClient(host=host, timeout=timeout)
+        self.health_client = ollama.Client(host=host, timeout=HEALTH_CHECK_TIMEOUT)
+        self.slots = BoundedSemaphore(concurrency)
+        self.async_slots = asyncio.Semaphore(concurrency)
+        self.in_flight: int = 0
+        self.queued: int = 0
+        self.healthy: bool = True
+        self.checked_at: float = float("-inf")
+        self.models: Set[str] = set()
+
+    @property
+    def name(self) -> str:
+        return self.host or "default"
+
+    @property
+    def load(self) -> float:
+        return (self.in_flight + self.queued) / self.concurrency
+
+    def serves(self, model: str) -> bool:
+        # Before the first successful health check the models are unknown
+        return not self.models or model_name(model) in self.models
+
+    def check(self) -> None:
+        try:
+            listed: Dict[str, Any] = self.health_client.list()
+            self.models = {model["name"] for model in listed.get("models", [])}
+            healthy: bool = True
+        except (httpx.HTTPError, ollama.ResponseError) as error:
+            LOGGER.debug(f"Health check of Ollama at {self.name} failed: {error}")
+            healthy = False
+
+        if healthy != self.healthy:
+            state: str = "healthy" if healthy else "unhealthy"
+            LOGGER.warning(f"Ollama at {self.name} is {state}")
+
+        self.healthy = healthy
+
+
+def is_endpoint_failure(error: Exception) -> bool:
+    if isinstance(error, httpx.TransportError):
+        return True
+
+    return isinstance(error, ollama.ResponseError) and error.status_code >= 500
+
+
+class ModelPool:
+    """
+    Spreads generations over one or more Ollama servers.
+
+    Explanation:
+    - Each endpoint runs at most `concurrency` generations at once, and the
+        generations waiting for one of its slots make up its queue depth.
+    - A generation goes to the healthy endpoint serving the model with the
+        fewest generations running or queued per slot.
+    - Endpoints are checked through `/api/tags` at most every
+        `health_interval` seconds, which also lists the models they serve.
+    - An endpoint that cannot be reached or answers with a server error is
+        marked unhealthy and the generation fails over to the next endpoint.
+    """
+
+    def __init__(
+        self,
+        endpoints: Iterable[Dict[str, Any]],
+        timeout: float,
+        health_interval: float = 30.0,
+    ):
+        self.endpoints: List[Endpoint] = [
+            Endpoint(
+                host=endpoint.get("host"),
+                concurrency=int(endpoint.get("concurrency", 1)),
+                timeout=timeout,
+            )
+            for endpoint in endpoints
+        ]
+        self.health_interval = health_interval
+        self._lock = Lock()
+
+        if not self.endpoints:
+            raise ValueError("The model pool needs at least one Ollama endpoint")
+
+    @property
+    def capacity(self) -> int:
+        return sum(endpoint.concurrency for endpoint in self.endpoints)
+
+    def refresh_health(self) -> None:
+        now: float = time.monotonic()
+
+        with self._lock:
+            stale: List[Endpoint] = [
+                endpoint
+                for endpoint in self.endpoints
+                if now - endpoint.checked_at >= self.health_interval
+            ]
+
+            # Claim the checks so concurrent callers do not repeat them
+            for endpoint in stale:
+                endpoint.checked_at = now
+
+        for endpoint in stale:
+            endpoint.check()
+
+    def pick(self, model: str, tried: List[Endpoint]) -> Endpoint:
+        with self._lock:
+            untried: List[Endpoint] = [
+                endpoint for endpoint in self.endpoints if endpoint not in tried
+            ]
+            candidates: List[Endpoint] = [
+                endpoint for endpoint in untried if endpoint.healthy
+            ]
+
+            # With every endpoint down, try them anyway rather than fail outright
+            if not candidates and not tried:
+                candidates = untried
+
+            serving: List[Endpoint] = [
+                endpoint for endpoint in candidates if endpoint.serves(model)
+            ] or candidates
+
+            if not serving:
+                raise NoHealthyEndpoint(f"No healthy Ollama endpoint left for {model}")
+
+            endpoint: Endpoint = min(serving, key=lambda endpoint: endpoint.load)
+            endpoint.queued += 1
+
+        return endpoint
+
+    def started(self, endpoint: Endpoint) -> None:
+        with self._lock:
+            endpoint.queued -= 1
+            endpoint.in_flight += 1
+
+    def finished(self, endpoint: Endpoint, running: bool = True) -> None:
+        with self._lock:
+            if running:
+                endpoint.in_flight -= 1
+            else:
+                endpoint.queued -= 1
+
+    def record(self, current: Span, stats: GenerationStats) -> None:
+        current.record(
+            prompt_eval_tokens=stats.prompt_tokens,
+            eval_tokens=stats.eval_tokens,
+            eval_tokens_per_second=round(stats.eval_tokens_per_second, 1),
+        )
+
+    def failed_over(self, endpoint: Endpoint, error: Exception) -> bool:
+        if not is_endpoint_failure(error):
+            return False
+
+        LOGGER.warning(f"Ollama at {endpoint.name} failed ({error}), failing over")
+
+        with self._lock:
+            endpoint.healthy = False
+
+        return True
+
+    @contextmanager
+    def slot(self, endpoint: Endpoint) -> Iterator[None]:
+        with endpoint.slots:
+            self.started(endpoint)
+
+            try:
+                yield
+            finally:
+                self.finished(endpoint)
+
+    @asynccontextmanager
+    async def async_slot(self, endpoint: Endpoint) -> AsyncIterator[None]:
+        try:
+            await endpoint.async_slots.acquire()
+        except asyncio.CancelledError:
+            self.finished(endpoint, running=False)
+            raise
+
+        self.started(endpoint)
+
+        try:
+            yield
+        finally:
+            self.finished(endpoint)
+            endpoint.async_slots.release()
+
+    def generate(
+        self, model: str, cancel: Event = None, **kwargs: Any
+    ) -> Tuple[str, GenerationStats]:
+        """
+        Streams a completion with `stream_generate` from the least loaded
+        endpoint serving `model`, failing over to the others on errors.
+        """
+        tried: List[Endpoint] = []
+
+        while True:
+            self.refresh_health()
+            endpoint: Endpoint = self.pick(model, tried)
+            tried.append(endpoint)
+
+            try:
+                with (
+                    self.slot(endpoint),
+                    span("generate", model=model, endpoint=endpoint.name) as current,
+                ):
+                    raise_if_cancelled(cancel)
+                    response, stats = stream_generate(
+                        client=endpoint.client, model=model, cancel=cancel, **kwargs
+                    )
+                    self.record(current, stats)
+                    return response, stats
+            except Exception as error:
+                if not self.failed_over(endpoint, error):
+                    raise
+
+    async def agenerate(self, model: str, **kwargs: Any) -> Tuple[str, GenerationStats]:
+        """
+        Async counterpart of `generate`, streaming with `astream_generate`.
+        """
+        tried: List[Endpoint] = []
+
+        while True:
+            await asyncio.to_thread(self.refresh_health)
+            endpoint: Endpoint = self.pick(model, tried)
+            tried.append(endpoint)
+
+            try:
+                async with self.async_slot(endpoint):
+                    with span(
+                        "generate", model=model, endpoint=endpoint.name
+                    ) as current:
+                        response, stats = await astream_generate(
+                            client=endpoint.async_client, model=model, **kwargs
+                        )
+                        self.record(current, stats)
+                        return response, stats
+            except Exception as error:
+                if not self.failed_over(endpoint, error):
+                    raise
@@ -0,0 +1,205 @@
+import asyncio
+import logging
+import time
+from threading import Event
+from typing import Any, Dict, List, Tuple
+
+from gitlab.v4.objects.merge_request_approvals import ProjectMergeRequestApproval
+from gitlab.v4.objects.merge_requests import ProjectMergeRequest
+from gitlab.v4.objects.projects import Project
+
+from iamksm_bot.app.ai import IAMKSM, ContextHints, ReviewPlan
+from iamksm_bot.app.gitlab_client import AsyncGitLab
+from iamksm_bot.app.mapreduce import split_review_units
+from iamksm_bot.app.scheduler import raise_if_cancelled
+from iamksm_bot.app.template import SYSTEM_PERSONA
+from iamksm_bot.app.tracing import span, trace
+from iamksm_bot.config.settings import settings
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+REPO_SOURCE = settings.REPO_SOURCE
+OLLAMA_OPTIONS = settings.OLLAMA_OPTIONS
+OLLAMA_TIMEOUT = settings.OLLAMA_TIMEOUT
+OLLAMA_MAX_TOKENS = settings.OLLAMA_MAX_TOKENS
+OLLAMA_KEEP_ALIVE = settings.OLLAMA_KEEP_ALIVE
+MAP_REDUCE_UNIT_TOKENS = settings.MAP_REDUCE_UNIT_TOKENS
+
+
+class AsyncReviewPipeline:
+    """
+    Runs the review stages of IAMKSM as awaitable steps on one event loop.
+
+    Fetching the MR, downloading its snapshot archive and generating the
+    review are awaited, so a process can hold hundreds of reviews waiting on
+    the model without a thread per review.
+
+    The other stages run the threaded code of IAMKSM through
+    `asyncio.to_thread`, and are bounded by the default executor:
+    - `plan_review` indexes the snapshot and selects context, and still reads
+        the changed files, compares commits for follow-up reviews and syncs
+        mirrors through the blocking python-gitlab client and git.
+    - `finish_review` posts the comments and approvals through python-gitlab.
+    """
+
+    def __init__(self, air: IAMKSM, gitlab: AsyncGitLab):
+        self.air = air
+        self.gitlab = gitlab
+
+    async def fetch_merge_request(
+        self, project_id: int, mr_id: int
+    ) -> Tuple[
+        Project, ProjectMergeRequest, Dict[str, Any], ProjectMergeRequestApproval
+    ]:
+        project_path: str = f"/projects/{project_id}"
+        mr_path: str = f"{project_path}/merge_requests/{mr_id}"
+
+        with span("mr_fetch") as current:
+            project_attrs, mr_changes, commits, approvals = await asyncio.gather(
+                self.gitlab.get(project_path),
+                self.gitlab.get(f"{mr_path}/changes"),
+                self.gitlab.get_all(f"{mr_path}/commits"),
+                self.gitlab.get(f"{mr_path}/approvals"),
+            )
+            current.record(
+                files=len(mr_changes["changes"]),
+                bytes=sum(len(c.get("diff", "")) for c in mr_changes["changes"]),
+            )
+
+        # Wrap the responses in python-gitlab objects for the threaded stages
+        project = Project(self.air.gl.projects, project_attrs)
+        mr: ProjectMergeRequest = project.mergerequests.get(id=mr_id, lazy=True)
+        mr_changes["commits"] = commits
+
+        return (
+            project,
+            mr,
+            mr_changes,
+            ProjectMergeRequestApproval(mr.approvals, approvals),
+        )
+
+    async def prefetch_snapshot(self, project: Project, mr_changes) -> None:
+        if REPO_SOURCE != "archive":
+            return
+
+        sha: str = await asyncio.to_thread(
+            self.air.get_context_sha, project, mr_changes
+        )
+
+        if self.air.snapshots.archive_for(project.id, sha).exists():
+            return
+
+        with span("archive_download", sha=sha) as current:
+            archive: bytes = await self.gitlab.get_bytes(
+                f"/projects/{project.id}/repository/archive.zip", sha=sha
+            )
+            current.record(bytes=len(archive))
+
+        await asyncio.to_thread(
+            self.air.snapshots.get,
+            project_id=project.id,
+            sha=sha,
+            download=lambda: archive,
+        )
+
+    async def generate_response(self, prompt: str, model: str) -> str:
+        response, _ = await self.air.model_pool.agenerate(
+            model=model,
+            prompt=prompt,
+            system=SYSTEM_PERSONA,
+            options=OLLAMA_OPTIONS,
+            timeout=OLLAMA_TIMEOUT,
+            max_tokens=OLLAMA_MAX_TOKENS,
+            keep_alive=OLLAMA_KEEP_ALIVE,
+        )
+
+        return response
+
+    async def generate_review(self, plan: ReviewPlan) -> str:
+        if not self.air.should_map_reduce(plan.review_changes):
+            prompt: str = await asyncio.to_thread(self.air.review_prompt, plan)
+            return await self.generate_response(prompt, plan.model)
+
+        units: List[List[Dict[str, Any]]] = split_review_units(
+            plan.review_changes["changes"], MAP_REDUCE_UNIT_TOKENS
+        )
+        LOGGER.info(f"Reviewing {len(units)} parts of {plan.mr_changes['title']}")
+        hints: ContextHints = await asyncio.to_thread(
+            self.air.context_hints,
+            plan.project,
+            plan.context_sha,
+            plan.repo_contents,
+            plan.review_changes,
+        )
+
+        prompts: List[str] = await asyncio.gather(
+            *(
+                asyncio.to_thread(
+                    self.air.unit_prompt,
+                    plan.project,
+                    plan.context_sha,
+                    plan.repo_contents,
+                    plan.file_paths_context,
+                    plan.review_changes,
+                    unit,
+                    hints,
+                )
+                for unit in units
+            )
+        )
+        findings: List[str] = await asyncio.gather(
+            *(self.generate_response(prompt, plan.model) for prompt in prompts)
+        )
+
+        return await self.generate_response(
+            self.air.reduce_prompt(plan.review_changes, units, findings), plan.model
+        )
+
+    async def review_merge_request(
+        self, project_id: int, mr_id: int, cancel: Event = None
+    ) -> None:
+        """
+        Reviews an open merge request without blocking the event loop.
+
+        Explanation:
+        - Fetches the project, MR changes, commits and approvals concurrently
+            and downloads a missing repository snapshot asynchronously.
+        - Gathers the review context with `IAMKSM.plan_review` in a thread,
+            which makes its own blocking GitLab calls.
+        - Streams the review from the least loaded server of the model pool,
+            reviewing the parts of a large MR concurrently.
+        - Comments on the MR with `IAMKSM.finish_review` in a thread, through
+            the blocking GitLab client.
+
+        Args:
+        - `project_id`: Integer representing the project ID.
+        - `mr_id`: Integer representing the merge request ID.
+        - `cancel`: Event set when a newer push supersedes this review.
+
+        Returns:
+        - None
+        """
+        with trace(f"{project_id}!{mr_id}"):
+            await self.run_review(project_id, mr_id, cancel)
+
+    async def run_review(self, project_id: int, mr_id: int, cancel: Event) -> None:
+        start: float = time.perf_counter()
+        project, mr, mr_changes, approvals = await self.fetch_merge_request(
+            project_id, mr_id
+        )
+        await self.prefetch_snapshot(project, mr_changes)
+
+        plan: ReviewPlan | None = await asyncio.to_thread(
+            self.air.plan_review, project, mr, mr_changes, approvals, cancel
+        )
+
+        if plan is None:
+            return
+
+        if plan.response is None:
+            plan.response = await self.generate_review(plan)
+
+        raise_if_cancelled(cancel)
+        await asyncio.to_thread(self.air.finish_review, plan, cancel)
+
+        time_taken: float = round(time.perf_counter() - start, 2)
+        LOGGER.info(f"Finished review of {plan.mr_ref} in {time_taken} seconds")
@@ -0,0 +1,80 @@
+import logging
+from collections import OrderedDict
+from threading import Condition, Thread
+from typing import Callable, Tuple
+
+from iamksm_bot.app.metrics import PREWARMS
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# Seconds between two checks for a free review slot
+BUSY_POLL_SECONDS = 1.0
+
+PrewarmKey = Tuple[int, str]
+
+
+class Prewarmer:
+    """
+    Builds the repository context of pushed branches in the background, so
+    reviews of MRs targeting them start with it ready.
+
+    Explanation:
+    - Pushes are kept per project and branch, a newer push replacing the
+        one still waiting, and at most `max_pending` are kept, the oldest
+        being dropped first.
+    - One thread builds them in push order, and only while `busy` is false,
+        that is while a review slot is free, so reviews never wait for it.
+    - `prewarm` is called with the project id, branch and pushed SHA, and
+        returns whether the branch was one to prewarm.
+    """
+
+    def __init__(
+        self,
+        prewarm: Callable[[int, str, str], bool],
+        busy: Callable[[], bool],
+        max_pending: int,
+    ):
+        self.prewarm = prewarm
+        self.busy = busy
+        self.max_pending = max_pending
+        self._pending: OrderedDict[PrewarmKey, str] = OrderedDict()
+        self._condition = Condition()
+        self._thread: Thread | None = None
+
+    def depth(self) -> int:
+        with self._condition:
+            return len(self._pending)
+
+    def submit(self, project_id: int, branch: str, sha: str) -> None:
+        key: PrewarmKey = (project_id, branch)
+
+        with self._condition:
+            if self._pending.pop(key, None) is not None:
+                PREWARMS.inc(outcome="superseded")
+
+            self._pending[key] = sha
+
+            while len(self._pending) > self.max_pending:
+                self._pending.popitem(last=False)
+                PREWARMS.inc(outcome="dropped")
+
+            if self._thread is None:
+                self._thread = Thread(target=self.run, name="prewarm", daemon=True)
+                self._thread.start()
+
+            self._condition.notify()
+
+    def run(self) -> None:
+        while True:
+            with self._condition:
+                while not self._pending or self.busy():
+                    self._condition.wait(BUSY_POLL_SECONDS)
+
+                (project_id, branch), sha = self._pending.popitem(last=False)
+
+            try:
+                built: bool = self.prewarm(project_id, branch, sha)
+                PREWARMS.inc(outcome="built" if built else "skipped")
+            except Exception:
+                PREWARMS.inc(outcome="failed")
+                LOGGER.exception(f"Prewarming {project_id}@{branch} ({sha}) failed")
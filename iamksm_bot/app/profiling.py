@@ -0,0 +1,325 @@
+import fcntl
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+from threading import Event, Lock, Thread
+from types import FrameType
+from typing import Any, Dict, Iterator, List
+
+from iamksm_bot.config.settings import settings
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+ARMED_FILE = "armed.json"
+LOCK_FILE = "armed.lock"
+# Frames kept per allocation, so memory stacks show who asked for it
+MEMORY_FRAMES = 16
+MB = 1024 * 1024
+
+
+@dataclass
+class ProfileRequest:
+    """
+    Profiling asked for the next `reviews` reviews.
+
+    - `interval`: Seconds between two samples of every thread's stack.
+    - `memory`: Whether to also trace allocations per review stage.
+    """
+
+    reviews: int
+    interval: float
+    memory: bool = False
+    armed_at: float = field(default_factory=time.time)
+
+
+def armed_path(directory: str) -> Path:
+    return Path(directory) / ARMED_FILE
+
+
+@contextmanager
+def locked(directory: str) -> Iterator[None]:
+    # Every process reviewing on the host shares the armed file
+    Path(directory).mkdir(parents=True, exist_ok=True)
+
+    with open(Path(directory) / LOCK_FILE, "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def read_request(path: Path) -> ProfileRequest | None:
+    try:
+        return ProfileRequest(**json.loads(path.read_text()))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def write_request(path: Path, request: ProfileRequest) -> None:
+    staging: Path = path.with_name(f"{ARMED_FILE}.{os.getpid()}.tmp")
+    staging.write_text(json.dumps(asdict(request)))
+    os.replace(staging, path)
+
+
+def arm(directory: str, request: ProfileRequest) -> None:
+    if request.reviews < 1 or request.interval <= 0:
+        raise ValueError("Profile at least one review with a positive interval")
+
+    with locked(directory):
+        write_request(armed_path(directory), request)
+
+    LOGGER.info(f"Profiling the next {request.reviews} reviews into {directory}")
+
+
+def disarm(directory: str) -> None:
+    with locked(directory):
+        armed_path(directory).unlink(missing_ok=True)
+
+
+def armed(directory: str) -> ProfileRequest | None:
+    return read_request(armed_path(directory))
+
+
+def claim(directory: str) -> ProfileRequest | None:
+    """
+    Takes one review off the armed request, if any.
+
+    While nothing is armed this costs one `stat` per review.
+    """
+    path: Path = armed_path(directory)
+
+    if not path.exists():
+        return None
+
+    with locked(directory):
+        request: ProfileRequest | None = read_request(path)
+
+        if request is None:
+            return None
+
+        if request.reviews > 1:
+            write_request(path, replace(request, reviews=request.reviews - 1))
+        else:
+            path.unlink(missing_ok=True)
+
+    return request
+
+
+def frame_name(filename: str, function: str, line: int) -> str:
+    # Semicolons separate frames in collapsed stacks
+    return f"{function} ({filename}:{line})".replace(";", ":")
+
+
+def collapse_frame(root: str, frame: FrameType | None) -> str:
+    frames: List[str] = []
+
+    while frame is not None:
+        code = frame.f_code
+        frames.append(frame_name(code.co_filename, code.co_name, code.co_firstlineno))
+        frame = frame.f_back
+
+    return ";".join([root, *reversed(frames)])
+
+
+class StackSampler(Thread):
+    """
+    Samples the stack of every other thread of the process each `interval`
+    seconds, counting identical stacks.
+
+    Waiting threads are sampled too, so the profile shows where a review
+    spent its wall-clock time, including time spent waiting on GitLab or
+    the model.
+    """
+
+    def __init__(self, interval: float):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.interval = interval
+        self.samples: Counter[str] = Counter()
+        self.done = Event()
+
+    def run(self) -> None:
+        while not self.done.wait(self.interval):
+            self.sample()
+
+    def sample(self) -> None:
+        names: Dict[int, str] = {
+            thread.ident: thread.name for thread in threading.enumerate()
+        }
+
+        for ident, frame in sys._current_frames().items():
+            if ident != self.ident:
+                self.samples[collapse_frame(names.get(ident, str(ident)), frame)] += 1
+
+    def stop(self) -> None:
+        self.done.set()
+        self.join()
+
+
+class MemoryTracker:
+    """
+    Snapshots `tracemalloc` at the end of every review stage and keeps what
+    was allocated, and not freed, since the previous stage ended.
+
+    Tracing starts with the first tracker and stops with the last one.
+    Allocations of other reviews running in the process at the same time are
+    counted too.
+    """
+
+    _users: int = 0
+    _users_lock = Lock()
+
+    def __init__(self, top: int):
+        self.top = top
+        self.stacks: Counter[str] = Counter()
+        self.report: List[str] = []
+        self._lock = Lock()
+
+        with MemoryTracker._users_lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(MEMORY_FRAMES)
+
+            MemoryTracker._users += 1
+
+        self.last: tracemalloc.Snapshot = self.snapshot()
+
+    def snapshot(self) -> tracemalloc.Snapshot:
+        # Leave out what tracing and profiling allocate themselves
+        return tracemalloc.take_snapshot().filter_traces(
+            (
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, __file__),
+            )
+        )
+
+    def stage(self, stage: str, duration: float) -> None:
+        with self._lock:
+            snapshot: tracemalloc.Snapshot = self.snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            self.report.append(
+                f"{stage} took {duration:.3f}s, traced {current / MB:.1f} MB, "
+                f"peak {peak / MB:.1f} MB"
+            )
+
+            for stat in snapshot.compare_to(self.last, "traceback"):
+                if stat.size_diff > 0:
+                    frames: str = ";".join(
+                        f"{frame.filename}:{frame.lineno}" for frame in stat.traceback
+                    )
+                    self.stacks[f"{stage};{frames}"] += stat.size_diff
+
+            for stat in snapshot.compare_to(self.last, "lineno")[: self.top]:
+                self.report.append(
+                    f"  {stat.size_diff / 1024:+.1f} KiB {stat.count_diff:+d} blocks "
+                    f"{stat.traceback[-1]}"
+                )
+
+            self.last = snapshot
+
+    def stop(self) -> None:
+        with MemoryTracker._users_lock:
+            MemoryTracker._users -= 1
+
+            if not MemoryTracker._users:
+                tracemalloc.stop()
+
+
+class ReviewProfile:
+    """
+    The profile of one review, written under `directory` when it ends:
+
+    - `<name>.cpu.folded`: Sampled stacks of every thread, one collapsed
+        stack and its sample count per line, as read by `flamegraph.pl` or
+        speedscope.
+    - `<name>.memory.folded`: Bytes allocated per stage and allocation
+        stack, rooted at the stage name, when memory was asked for.
+    - `<name>.memory.txt`: Traced memory after each stage and its top
+        allocating lines.
+    """
+
+    def __init__(self, trace_id: str, request: ProfileRequest, directory: str):
+        stamp: str = time.strftime("%Y%m%d-%H%M%S")
+        name: str = re.sub(r"[^\w.-]", "_", trace_id)
+        self.trace_id = trace_id
+        self.path = Path(directory) / f"{stamp}-{name}"
+        self.memory: MemoryTracker | None = (
+            MemoryTracker(top=settings.PROFILE_MEMORY_TOP) if request.memory else None
+        )
+        self.sampler = StackSampler(request.interval)
+        self.sampler.start()
+
+    def stage(self, stage: str, duration: float) -> None:
+        if self.memory is not None:
+            self.memory.stage(stage, duration)
+
+    def finish(self) -> None:
+        self.sampler.stop()
+        self.write("cpu.folded", self.sampler.samples)
+
+        if self.memory is not None:
+            self.memory.stop()
+            self.write("memory.folded", self.memory.stacks)
+            self.path.with_name(f"{self.path.name}.memory.txt").write_text(
+                "\n".join(self.memory.report) + "\n"
+            )
+
+        LOGGER.info(f"[{self.trace_id}] Wrote profile {self.path}.*")
+
+    def write(self, suffix: str, stacks: Counter) -> None:
+        lines: List[str] = [f"{stack} {count}" for stack, count in stacks.items()]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.with_name(f"{self.path.name}.{suffix}").write_text(
+            "\n".join(lines) + "\n"
+        )
+
+
+# The profile of the review a stage belongs to, None while not profiling
+PROFILE: ContextVar[ReviewProfile | None] = ContextVar("profile", default=None)
+
+
+@contextmanager
+def profile_review(trace_id: str) -> Iterator[None]:
+    request: ProfileRequest | None = claim(settings.PROFILE_DIR)
+
+    if request is None:
+        yield
+        return
+
+    profile = ReviewProfile(trace_id, request, settings.PROFILE_DIR)
+    token = PROFILE.set(profile)
+
+    try:
+        yield
+    finally:
+        PROFILE.reset(token)
+        profile.finish()
+
+
+def profile_command(method: str, body: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Arms (`POST`), disarms (`DELETE`) or reads (`GET`) profiling for the
+    admin endpoints and returns what is armed afterwards.
+
+    Raises ValueError on an invalid request body.
+    """
+    if method == "POST":
+        arm(
+            settings.PROFILE_DIR,
+            ProfileRequest(
+                reviews=int(body.get("reviews", 1)),
+                interval=float(body.get("interval", settings.PROFILE_INTERVAL)),
+                memory=bool(body.get("memory", False)),
+            ),
+        )
+    elif method == "DELETE":
+        disarm(settings.PROFILE_DIR)
+
+    request: ProfileRequest | None = armed(settings.PROFILE_DIR)
+    return {"directory": settings.PROFILE_DIR, "armed": request and asdict(request)}
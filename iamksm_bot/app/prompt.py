@@ -0,0 +1,215 @@
+import logging
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Set
+
+from iamksm_bot.app.context import estimate_tokens
+from iamksm_bot.app.tracing import span
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+Change = Dict[str, Any]
+EMPTY_SECTION = "(none)"
+
+
+def change_title(change: Change) -> str:
+    path: str = change["new_path"]
+
+    if change.get("new_file"):
+        return f"{path} (new file)"
+
+    if change.get("deleted_file"):
+        return f"{change['old_path']} (deleted)"
+
+    if change.get("renamed_file"):
+        return f"{path} (renamed from {change['old_path']})"
+
+    return path
+
+
+def collapse_context(diff: str, context_lines: int) -> str:
+    """
+    Shortens runs of unchanged lines in a unified diff to `context_lines` on
+    each side of a change, noting how many lines were left out.
+    """
+    collapsed: List[str] = []
+    run: List[str] = []
+    after_change: bool = False
+
+    def flush(before_change: bool) -> None:
+        keep_head: int = context_lines if after_change else 0
+        keep_tail: int = context_lines if before_change else 0
+        left_out: int = len(run) - keep_head - keep_tail
+
+        if left_out <= 1:
+            collapsed.extend(run)
+        else:
+            tail_start: int = len(run) - keep_tail
+            collapsed.extend(run[:keep_head])
+            collapsed.append(f" ... {left_out} unchanged lines")
+            collapsed.extend(run[tail_start:])
+
+        run.clear()
+
+    for line in diff.splitlines():
+        if line.startswith(" "):
+            run.append(line)
+            continue
+
+        is_change: bool = line.startswith(("+", "-"))
+        flush(before_change=is_change)
+        collapsed.append(line)
+        after_change = is_change
+
+    flush(before_change=False)
+    return "\n".join(collapsed)
+
+
+def render_changes(changes: Iterable[Change], context_lines: int) -> str:
+    rendered: List[str] = [
+        f"### {change_title(change)}\n```diff\n"
+        f"{collapse_context(change.get('diff', ''), context_lines)}\n```"
+        for change in changes
+    ]
+    return "\n\n".join(rendered) or EMPTY_SECTION
+
+
+def render_files(files: Mapping[str, str], skip: Set[str] = frozenset()) -> str:
+    rendered: List[str] = [
+        f"### {path}\n```\n{content.rstrip()}\n```"
+        for path, content in files.items()
+        if path not in skip
+    ]
+    return "\n\n".join(rendered) or EMPTY_SECTION
+
+
+def render_commits(commits: Iterable[Mapping[str, Any]]) -> str:
+    rendered: List[str] = []
+
+    for commit in commits:
+        title: str = commit["title"].strip()
+        body: str = commit["message"].strip().removeprefix(title).strip()
+        rendered.append(f"- {title}")
+
+        if body:
+            rendered.extend(f"  {line}" for line in body.splitlines())
+
+    return "\n".join(rendered) or EMPTY_SECTION
+
+
+def render_tree(paths: Iterable[str], token_budget: int) -> str:
+    """
+    Lists repository files grouped by directory, up to `token_budget` tokens.
+    """
+    by_directory: Dict[str, List[str]] = {}
+
+    for path in sorted(paths):
+        directory, _, name = path.rpartition("/")
+        by_directory.setdefault(directory or ".", []).append(name)
+
+    total: int = sum(len(names) for names in by_directory.values())
+    lines: List[str] = []
+    listed: int = 0
+    used: int = 0
+
+    for directory, names in by_directory.items():
+        line: str = f"{directory}/: {', '.join(names)}"
+        used += estimate_tokens(line)
+
+        if used > token_budget:
+            break
+
+        lines.append(line)
+        listed += len(names)
+
+    if listed < total:
+        lines.append(f"... and {total - listed} more files")
+
+    return "\n".join(lines) or EMPTY_SECTION
+
+
+@dataclass
+class Prompt:
+    text: str
+    tokens: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def total_tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+class PromptBuilder:
+    """
+    Renders review prompts compactly, with every piece of content once.
+
+    Explanation:
+    - Diffs are rendered once each, as fenced unified hunks under the file
+        path, with long runs of unchanged lines collapsed.
+    - Changed files are left out of the repository context, since their
+        current contents are shown, and new files are left out of the
+        changed files, since the diff already holds all of their lines.
+    - Files and commits are rendered as Markdown instead of Python reprs.
+    - The project overview only depends on the files of the repository, so
+        it renders identically for every review of a project at a commit.
+    - The token count of each section is logged and kept on the prompt.
+    """
+
+    def __init__(self, context_lines: int = 3, overview_tokens: int = 1024):
+        self.context_lines = context_lines
+        self.overview_tokens = overview_tokens
+
+    def sections(
+        self,
+        changes: Optional[Iterable[Change]] = None,
+        repo: Optional[Mapping[str, str]] = None,
+        file_paths_context: Optional[Mapping[str, str]] = None,
+        commits: Optional[Iterable[Mapping[str, Any]]] = None,
+        project_files: Optional[Iterable[str]] = None,
+        **text: str,
+    ) -> Dict[str, str]:
+        changed_files: List[Change] = list(changes or ())
+        changed: Set[str] = {change["new_path"] for change in changed_files}
+        new_files: Set[str] = {
+            change["new_path"] for change in changed_files if change.get("new_file")
+        }
+        sections: Dict[str, str] = {
+            name: value or EMPTY_SECTION for name, value in text.items()
+        }
+
+        if changes is not None:
+            sections["changes"] = render_changes(changed_files, self.context_lines)
+
+        if repo is not None:
+            sections["repo"] = render_files(repo, skip=changed)
+
+        if file_paths_context is not None:
+            sections["file_paths_context"] = render_files(
+                file_paths_context, skip=new_files
+            )
+
+        if commits is not None:
+            sections["commits"] = render_commits(commits)
+
+        if project_files is not None:
+            sections["project_context"] = render_tree(
+                project_files, self.overview_tokens
+            )
+
+        return sections
+
+    def render(self, template: str, sections: Dict[str, str]) -> Prompt:
+        with span("prompt") as current:
+            prompt = Prompt(
+                text=template.format(**sections),
+                tokens={
+                    name: estimate_tokens(value) for name, value in sections.items()
+                },
+            )
+            current.record(prompt_tokens=prompt.total_tokens)
+
+        breakdown: str = ", ".join(
+            f"{name}={tokens}"
+            for name, tokens in sorted(prompt.tokens.items(), key=lambda t: -t[1])
+        )
+        LOGGER.info(f"Prompt of ~{prompt.total_tokens} tokens ({breakdown})")
+
+        return prompt
@@ -0,0 +1,255 @@
+import fcntl
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Mapping, Optional
+
+import ollama
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+INDEX_DIRNAME = "embeddings"
+VECTORS_FILENAME = "vectors.npy"
+META_FILENAME = "meta.json"
+LOCK_FILENAME = ".lock"
+
+
+def require_numpy() -> None:
+    if np is None:
+        raise ImportError(
+            "Retrieval needs numpy, install it with `pip install iamksm-bot[retrieval]`"
+        )
+
+
+def chunk_file(
+    path: str, content: str, chunk_lines: int, overlap: int
+) -> List[Dict[str, Any]]:
+    lines: List[str] = content.splitlines()
+    step: int = max(1, chunk_lines - overlap)
+    chunks: List[Dict[str, Any]] = []
+
+    for start in range(0, max(len(lines), 1), step):
+        end: int = start + chunk_lines
+        text: str = "\n".join(lines[start:end])
+
+        if text.strip():
+            chunks.append({"path": path, "start": start, "end": end, "text": text})
+
+        if end >= len(lines):
+            break
+
+    return chunks
+
+
+def diff_hunks(diff: str) -> List[str]:
+    hunks: List[str] = []
+
+    for line in diff.splitlines():
+        if line.startswith("@@") or not hunks:
+            hunks.append("")
+        hunks[-1] += line + "\n"
+
+    return [hunk for hunk in hunks if hunk.strip()]
+
+
+class OllamaEmbedder:
+    """
+    Embeds texts through the Ollama embeddings endpoint, one request per text
+    spread over `executor`.
+    """
+
+    def __init__(self, model: str, executor: Executor, client=None):
+        self.model = model
+        self.executor = executor
+        self.client = client or ollama
+
+    def embed_one(self, text: str) -> List[float]:
+        return self.client.embeddings(model=self.model, prompt=text)["embedding"]
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        return list(self.executor.map(self.embed_one, texts))
+
+
+class EmbeddingIndex:
+    """
+    Chunk embeddings of a repository snapshot.
+
+    Vectors are stored normalised in a NumPy array that is memory-mapped on
+    load, with chunk locations and content hashes in a JSON metadata file.
+    Building from a seed index only embeds chunks whose content changed.
+
+    Each write stores its vectors under a name of its own and then points
+    the metadata file at them with a single rename, so readers always see a
+    complete index.
+    """
+
+    def __init__(self, path: Path, vectors=None, meta: List[Dict[str, Any]] = None):
+        self.path = path
+        self.vectors = vectors
+        self.meta: List[Dict[str, Any]] = meta or []
+
+    @classmethod
+    def load(cls, path: Optional[Path], model: str) -> Optional["EmbeddingIndex"]:
+        require_numpy()
+
+        if path is None or not (path / META_FILENAME).exists():
+            return None
+
+        # A write may remove the vectors between reading the metadata and them
+        for _ in range(2):
+            meta: Dict[str, Any] = json.loads((path / META_FILENAME).read_text())
+
+            if meta["model"] != model:
+                return None
+
+            try:
+                vectors = np.load(
+                    path / meta.get("vectors", VECTORS_FILENAME), mmap_mode="r"
+                )
+            except FileNotFoundError:
+                continue
+
+            return cls(path, vectors, meta["chunks"])
+
+        return None
+
+    @classmethod
+    def build(
+        cls,
+        path: Path,
+        repo_contents: Mapping[str, str],
+        embed,
+        model: str,
+        chunk_lines: int = 40,
+        overlap: int = 8,
+        seed: Optional["EmbeddingIndex"] = None,
+    ) -> "EmbeddingIndex":
+        """
+        Chunks and embeds a snapshot, reusing vectors from `seed` where possible.
+
+        Args:
+        - `path`: Directory the index is written to.
+        - `repo_contents`: Mapping of repository paths to file contents.
+        - `embed`: Callable turning a list of texts into a list of vectors.
+        - `model`: Name of the embedding model, part of each chunk hash.
+        - `seed`: Index of an earlier snapshot of the same project.
+
+        Returns:
+        - The loaded, memory-mapped index.
+        """
+        require_numpy()
+        chunks: List[Dict[str, Any]] = []
+
+        for file_path, content in repo_contents.items():
+            for chunk in chunk_file(file_path, content, chunk_lines, overlap):
+                key: bytes = f"{model}\0{chunk['text']}".encode()
+                chunk["hash"] = hashlib.sha1(key).hexdigest()
+                chunks.append(chunk)
+
+        known: Dict[str, int] = {}
+
+        if seed is not None:
+            known = {chunk["hash"]: row for row, chunk in enumerate(seed.meta)}
+
+        missing: List[Dict[str, Any]] = [c for c in chunks if c["hash"] not in known]
+        embedded: Dict[str, Any] = {}
+
+        if missing:
+            vectors = embed([chunk["text"] for chunk in missing])
+            embedded = {c["hash"]: v for c, v in zip(missing, vectors)}
+
+        LOGGER.info(
+            f"Embedding index: {len(chunks)} chunks, {len(missing)} embedded, "
+            f"{len(chunks) - len(missing)} reused"
+        )
+
+        rows: List[Any] = [
+            embedded.get(c["hash"]) or seed.vectors[known[c["hash"]]] for c in chunks
+        ]
+        matrix = np.asarray(rows, dtype=np.float32).reshape(
+            len(chunks), -1 if rows else 0
+        )
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+
+        for chunk in chunks:
+            del chunk["text"]
+
+        cls.write(path, matrix, {"model": model, "chunks": chunks})
+        return cls.load(path, model)
+
+    @staticmethod
+    def write(path: Path, matrix, meta: Dict[str, Any]) -> None:
+        path.mkdir(parents=True, exist_ok=True)
+
+        # Writers of the same snapshot take turns, each removing the vectors
+        # the previous one left behind
+        with open(path / LOCK_FILENAME, "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            fd, vectors = tempfile.mkstemp(prefix="vectors-", suffix=".npy", dir=path)
+
+            with os.fdopen(fd, "wb") as file:
+                np.save(file, matrix)
+
+            fd, staging = tempfile.mkstemp(suffix=".tmp", dir=path)
+
+            with os.fdopen(fd, "w") as file:
+                json.dump(dict(meta, vectors=Path(vectors).name), file)
+
+            os.replace(staging, path / META_FILENAME)
+
+            for stale in path.glob("vectors*.npy"):
+                if stale.name != Path(vectors).name:
+                    stale.unlink(missing_ok=True)
+
+    def search(self, queries: List[List[float]], k: int) -> List[Dict[str, Any]]:
+        """
+        Returns the `k` chunks closest to any of the query vectors.
+        """
+        if not self.meta or not queries:
+            return []
+
+        query_matrix = np.asarray(queries, dtype=np.float32)
+        query_matrix /= np.linalg.norm(query_matrix, axis=1, keepdims=True) + 1e-12
+        scores = (self.vectors @ query_matrix.T).max(axis=1)
+        k = min(k, len(self.meta))
+        top = np.argpartition(-scores, k - 1)[:k]
+
+        return [
+            dict(self.meta[row], score=float(scores[row]))
+            for row in top[np.argsort(-scores[top])]
+        ]
+
+
+def retrieve_context(
+    index: EmbeddingIndex,
+    repo_contents: Mapping[str, str],
+    changes: Iterable[Dict[str, Any]],
+    embed,
+    k: int,
+) -> Dict[str, str]:
+    """
+    Embeds the diff hunks of an MR and returns the top `k` matching chunks,
+    keyed by `{path}:{first line}-{last line}`.
+    """
+    hunks: List[str] = [
+        hunk for change in changes for hunk in diff_hunks(change.get("diff", ""))
+    ]
+    matches: List[Dict[str, Any]] = index.search(embed(hunks), k) if hunks else []
+    context: Dict[str, str] = {}
+
+    for match in matches:
+        lines: List[str] = repo_contents.get(match["path"], "").splitlines()
+        start, end = match["start"], min(match["end"], len(lines))
+        context[f"{match['path']}:{start + 1}-{end}"] = "\n".join(lines[start:end])
+
+    return context
@@ -0,0 +1,330 @@
+import asyncio
+import itertools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from threading import Event, Lock, Timer
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+from iamksm_bot.app.fairqueue import FairQueue, SchedulingPolicy
+from iamksm_bot.app.metrics import QUEUE_WAIT_SECONDS, REVIEWS
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+ReviewKey = Tuple[int, int]
+
+
+class ReviewCancelled(Exception):
+    pass
+
+
+def raise_if_cancelled(cancel: Optional[Event]) -> None:
+    if cancel is not None and cancel.is_set():
+        raise ReviewCancelled()
+
+
+@dataclass
+class ReviewJob:
+    project_id: int
+    mr_iid: int
+    sha: Optional[str]
+    cancel: Event = field(default_factory=Event)
+    priority: int = 0
+    submitted_at: float = field(default_factory=time.monotonic)
+    queued_at: Optional[float] = None
+    started_at: Optional[float] = None
+
+    @property
+    def key(self) -> ReviewKey:
+        return (self.project_id, self.mr_iid)
+
+
+class ReviewScheduler:
+    """
+    Coalesces review requests per MR and shares the review slots fairly
+    between projects.
+
+    Events for the same (project, MR iid) within `debounce_seconds` collapse
+    into a single review of the latest head SHA. A newer SHA cancels the
+    in-flight or waiting review of an older one. Debounced reviews wait in a
+    FairQueue and at most `max_concurrent` of them run at the same time.
+    Submitting a review raises BacklogFull when `policy` does not admit it.
+    """
+
+    def __init__(
+        self,
+        review: Callable[[int, int, Event], None],
+        debounce_seconds: float,
+        max_concurrent: int,
+        policy: SchedulingPolicy | None = None,
+    ):
+        self.review = review
+        self.debounce_seconds = debounce_seconds
+        self.max_concurrent = max_concurrent
+        self.policy = policy or SchedulingPolicy()
+        self.queue: FairQueue[ReviewJob] = FairQueue(self.policy)
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_concurrent, thread_name_prefix="review"
+        )
+        self._lock = Lock()
+        self._pending: Dict[ReviewKey, Tuple[ReviewJob, Timer]] = {}
+        self._queued: Dict[ReviewKey, ReviewJob] = {}
+        self._running: Dict[ReviewKey, ReviewJob] = {}
+        self._active: int = 0
+
+    def depth(self) -> int:
+        with self._lock:
+            return len(self._pending) + len(self._queued)
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return self._active
+
+    def _admit(self, job: ReviewJob) -> None:
+        # Replacing a waiting review of the MR does not grow the backlog
+        if job.key in self._pending or job.key in self._queued:
+            return
+
+        waiting: Iterable[ReviewKey] = itertools.chain(self._pending, self._queued)
+        self.policy.admit(
+            job.project_id,
+            backlog=len(self._pending) + len(self._queued),
+            project_backlog=sum(key[0] == job.project_id for key in waiting),
+        )
+
+    def submit(
+        self, project_id: int, mr_iid: int, sha: Optional[str], priority: int = 0
+    ) -> ReviewJob:
+        job = ReviewJob(
+            project_id=project_id, mr_iid=mr_iid, sha=sha, priority=priority
+        )
+
+        with self._lock:
+            running: Optional[ReviewJob] = self._running.get(job.key)
+
+            if running is not None and running.sha == sha:
+                LOGGER.info(f"Review of {job.key}@{sha} already running, skipping")
+                return running
+
+            self._admit(job)
+
+            if running is not None:
+                LOGGER.info(f"Cancelling review of {job.key}@{running.sha}")
+                running.cancel.set()
+
+            if job.key in self._pending:
+                superseded, timer = self._pending.pop(job.key)
+                timer.cancel()
+                superseded.cancel.set()
+                LOGGER.info(f"Coalesced review of {job.key}@{superseded.sha}")
+
+            if job.key in self._queued:
+                superseded = self._queued.pop(job.key)
+                self.queue.remove(project_id, superseded)
+                superseded.cancel.set()
+                LOGGER.info(f"Coalesced review of {job.key}@{superseded.sha}")
+
+            timer = Timer(self.debounce_seconds, self._enqueue, args=(job,))
+            timer.daemon = True
+            self._pending[job.key] = (job, timer)
+            timer.start()
+
+        return job
+
+    def _enqueue(self, job: ReviewJob) -> None:
+        with self._lock:
+            pending: Optional[Tuple[ReviewJob, Timer]] = self._pending.get(job.key)
+
+            if pending is None or pending[0] is not job:
+                return
+
+            del self._pending[job.key]
+            job.queued_at = time.monotonic()
+            self._queued[job.key] = job
+            self.queue.push(job.project_id, job, job.priority)
+
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        with self._lock:
+            while self._active < self.max_concurrent:
+                job: Optional[ReviewJob] = self.queue.pop()
+
+                if job is None:
+                    return
+
+                del self._queued[job.key]
+                running: Optional[ReviewJob] = self._running.get(job.key)
+
+                if running is not None:
+                    running.cancel.set()
+
+                self._running[job.key] = job
+                self._active += 1
+                self.executor.submit(self._run, job)
+
+    def _run(self, job: ReviewJob) -> None:
+        job.started_at = time.monotonic()
+        wait_time: float = round(job.started_at - job.submitted_at, 2)
+        QUEUE_WAIT_SECONDS.observe(
+            job.started_at - job.queued_at, project=str(job.project_id)
+        )
+        LOGGER.info(f"Starting review of {job.key}@{job.sha} after {wait_time}s")
+
+        try:
+            self.review(job.project_id, job.mr_iid, job.cancel)
+            REVIEWS.inc(outcome="done")
+        except ReviewCancelled:
+            LOGGER.info(f"Review of {job.key}@{job.sha} was superseded")
+            REVIEWS.inc(outcome="superseded")
+        except Exception:
+            LOGGER.exception(f"Review of {job.key}@{job.sha} failed")
+            REVIEWS.inc(outcome="failed")
+        finally:
+            with self._lock:
+                if self._running.get(job.key) is job:
+                    del self._running[job.key]
+
+                self._active -= 1
+                self.queue.finished(job.project_id)
+
+            self._dispatch()
+
+
+class AsyncReviewScheduler:
+    """
+    asyncio counterpart of ReviewScheduler for the async review pipeline.
+
+    Every review is a task instead of a thread, so reviews waiting on GitLab
+    or the model cost no thread each. A newer SHA cancels the task of an
+    older one as well as setting its `cancel` event, which stops any stage
+    running in a worker thread. Debounced tasks wait for a slot in a
+    FairQueue, which grants at most `max_concurrent` slots at once.
+    """
+
+    def __init__(
+        self,
+        review: Callable[[int, int, Event], Awaitable[None]],
+        debounce_seconds: float,
+        max_concurrent: int,
+        policy: SchedulingPolicy | None = None,
+    ):
+        self.review = review
+        self.debounce_seconds = debounce_seconds
+        self.max_concurrent = max_concurrent
+        self.policy = policy or SchedulingPolicy()
+        self.queue: FairQueue[Tuple[ReviewJob, asyncio.Future]] = FairQueue(self.policy)
+        self._tasks: Dict[ReviewKey, Tuple[ReviewJob, asyncio.Task]] = {}
+        self._active: int = 0
+
+    def waiting(self) -> List[ReviewJob]:
+        return [job for job, _ in list(self._tasks.values()) if job.started_at is None]
+
+    def depth(self) -> int:
+        return len(self.waiting())
+
+    def in_flight(self) -> int:
+        return len(self._tasks) - self.depth()
+
+    def submit(
+        self, project_id: int, mr_iid: int, sha: Optional[str], priority: int = 0
+    ) -> ReviewJob:
+        job = ReviewJob(
+            project_id=project_id, mr_iid=mr_iid, sha=sha, priority=priority
+        )
+        current: Optional[Tuple[ReviewJob, asyncio.Task]] = self._tasks.get(job.key)
+
+        if current is not None and current[0].sha == sha:
+            LOGGER.info(f"Review of {job.key}@{sha} already scheduled, skipping")
+            return current[0]
+
+        # Replacing a waiting review of the MR does not grow the backlog
+        if current is None or current[0].started_at is not None:
+            waiting: List[ReviewJob] = self.waiting()
+            self.policy.admit(
+                project_id,
+                backlog=len(waiting),
+                project_backlog=sum(w.project_id == project_id for w in waiting),
+            )
+
+        if current is not None:
+            superseded, task = current
+            LOGGER.info(f"Cancelling review of {job.key}@{superseded.sha}")
+            superseded.cancel.set()
+            task.cancel()
+
+        task = asyncio.get_running_loop().create_task(self._run(job))
+        self._tasks[job.key] = (job, task)
+
+        return job
+
+    async def _acquire(self, job: ReviewJob) -> None:
+        job.queued_at = time.monotonic()
+        entry: Tuple[ReviewJob, asyncio.Future] = (
+            job,
+            asyncio.get_running_loop().create_future(),
+        )
+        self.queue.push(job.project_id, entry, job.priority)
+        self._dispatch()
+
+        try:
+            await entry[1]
+        except asyncio.CancelledError:
+            if entry[1].done() and not entry[1].cancelled():
+                # Cancelled after being granted a slot, give it back
+                self._release(job)
+            else:
+                self.queue.remove(job.project_id, entry)
+
+            raise
+
+    def _release(self, job: ReviewJob) -> None:
+        self._active -= 1
+        self.queue.finished(job.project_id)
+        self._dispatch()
+
+    def _dispatch(self) -> None:
+        while self._active < self.max_concurrent:
+            entry: Optional[Tuple[ReviewJob, asyncio.Future]] = self.queue.pop()
+
+            if entry is None:
+                return
+
+            job, granted = entry
+
+            if granted.cancelled():
+                # Its task is being cancelled, skip it
+                self.queue.finished(job.project_id)
+                continue
+
+            self._active += 1
+            granted.set_result(None)
+
+    async def _run(self, job: ReviewJob) -> None:
+        try:
+            await asyncio.sleep(self.debounce_seconds)
+            await self._acquire(job)
+
+            try:
+                job.started_at = time.monotonic()
+                wait_time: float = round(job.started_at - job.submitted_at, 2)
+                QUEUE_WAIT_SECONDS.observe(
+                    job.started_at - job.queued_at, project=str(job.project_id)
+                )
+                LOGGER.info(
+                    f"Starting review of {job.key}@{job.sha} after {wait_time}s"
+                )
+                await self.review(job.project_id, job.mr_iid, job.cancel)
+                REVIEWS.inc(outcome="done")
+            finally:
+                self._release(job)
+        except (ReviewCancelled, asyncio.CancelledError):
+            LOGGER.info(f"Review of {job.key}@{job.sha} was superseded")
+            REVIEWS.inc(outcome="superseded")
+        except Exception:
+            LOGGER.exception(f"Review of {job.key}@{job.sha} failed")
+            REVIEWS.inc(outcome="failed")
+        finally:
+            if self._tasks.get(job.key, (None,))[0] is job:
+                del self._tasks[job.key]
@@ -0,0 +1,163 @@
+import logging
+import os
+import shutil
+import time
+from pathlib import Path
+from threading import Lock
+from typing import Callable, List, Optional, Tuple
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+SNAPSHOT_ARCHIVE = "archive.zip"
+# Snapshots share this many download locks, so the locks never grow in number
+LOCK_STRIPES = 64
+
+
+def directory_size(path: Path) -> int:
+    total: int = 0
+
+    for root, _, files in os.walk(path):
+        for file in files:
+            try:
+                total += os.lstat(os.path.join(root, file)).st_size
+            except FileNotFoundError:
+                continue
+
+    return total
+
+
+class SnapshotStore:
+    """
+    On-disk cache of repository snapshots keyed by project id and commit SHA.
+
+    Each snapshot lives in `{base_path}/snapshots/{project_id}/{sha}`, next to
+    any indexes built from it, and is only downloaded on a cache miss. The
+    zipped archive is kept as downloaded and read without extracting it. New
+    archives are written to a staging file and renamed into place so readers
+    never see a partial archive.
+    The least recently used snapshots are evicted once the store grows past
+    `quota_bytes`.
+    """
+
+    def __init__(self, base_path: str, quota_bytes: int):
+        self.root = Path(base_path) / "snapshots"
+        self.quota_bytes = quota_bytes
+        self._locks: List[Lock] = [Lock() for _ in range(LOCK_STRIPES)]
+
+    def path_for(self, project_id: int, sha: str) -> Path:
+        return self.root / str(project_id) / sha
+
+    def archive_for(self, project_id: int, sha: str) -> Path:
+        return self.path_for(project_id, sha) / SNAPSHOT_ARCHIVE
+
+    def latest_sibling(self, project_id: int, sha: str, name: str) -> Optional[Path]:
+        """
+        Returns `name` from the most recently used other snapshot of a project,
+        used to seed per-snapshot indexes so they can be updated incrementally.
+        """
+        project_root: Path = self.root / str(project_id)
+
+        if not project_root.exists():
+            return None
+
+        candidates: List[Path] = [
+            snapshot / name
+            for snapshot in project_root.iterdir()
+            if snapshot.name != sha and (snapshot / name).exists()
+        ]
+
+        return max(candidates, key=lambda c: c.parent.stat().st_mtime, default=None)
+
+    def _lock_for(self, project_id: int, sha: str) -> Lock:
+        return self._locks[hash((project_id, sha)) % LOCK_STRIPES]
+
+    def touch(self, project_id: int, sha: str) -> None:
+        """
+        Marks a snapshot as just used, for reviews reading it from memory.
+        """
+        try:
+            os.utime(self.path_for(project_id, sha))
+        except FileNotFoundError:
+            pass
+
+    def get(self, project_id: int, sha: str, download: Callable[[], bytes]) -> Path:
+        """
+        Returns the path of the snapshot archive, downloading it if missing.
+
+        Args:
+        - `project_id`: ID of the project the snapshot belongs to.
+        - `sha`: Commit SHA of the snapshot.
+        - `download`: Callable returning the zipped repository archive.
+
+        Returns:
+        - Path to the zipped repository archive.
+        """
+        path: Path = self.path_for(project_id, sha)
+
+        with self._lock_for(project_id, sha):
+            if (path / SNAPSHOT_ARCHIVE).exists():
+                LOGGER.info(f"Snapshot cache hit for {project_id}@{sha}")
+                os.utime(path)
+                return path / SNAPSHOT_ARCHIVE
+
+            LOGGER.info(f"Snapshot cache miss for {project_id}@{sha}")
+            self._install(path, download())
+
+        self.evict(keep=path)
+        return path / SNAPSHOT_ARCHIVE
+
+    def _install(self, path: Path, zipped_archive: bytes) -> None:
+        # Indexes may already sit in the snapshot folder, only swap the archive
+        path.mkdir(parents=True, exist_ok=True)
+        staging: Path = path / f".staging-{os.getpid()}-{time.time_ns()}"
+
+        try:
+            staging.write_bytes(zipped_archive)
+            os.replace(staging, path / SNAPSHOT_ARCHIVE)
+        finally:
+            staging.unlink(missing_ok=True)
+
+    def _snapshots(self) -> List[Path]:
+        if not self.root.exists():
+            return []
+
+        return [
+            snapshot
+            for project in self.root.iterdir()
+            if project.is_dir()
+            for snapshot in project.iterdir()
+            if snapshot.is_dir() and not snapshot.name.startswith(".")
+        ]
+
+    def evict(self, keep: Path = None) -> None:
+        """
+        Removes the least recently used snapshots until the store fits its quota.
+        """
+        snapshots: List[Tuple[float, int, Path]] = []
+
+        for snapshot in self._snapshots():
+            try:
+                last_used: float = snapshot.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            snapshots.append((last_used, directory_size(snapshot), snapshot))
+
+        total: int = sum(size for _, size, _ in snapshots)
+
+        for _, size, snapshot in sorted(snapshots, key=lambda s: s[0]):
+            if total <= self.quota_bytes:
+                break
+
+            if snapshot == keep:
+                continue
+
+            # Rename first so concurrent readers never walk a half-deleted tree
+            trash: Path = snapshot.parent / f".evicted-{snapshot.name}-{time.time_ns()}"
+            try:
+                os.rename(snapshot, trash)
+            except FileNotFoundError:
+                continue
+
+            shutil.rmtree(trash, ignore_errors=True)
+            total -= size
+            LOGGER.info(f"Evicted snapshot {snapshot} ({size} bytes)")
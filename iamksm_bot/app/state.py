@@ -0,0 +1,103 @@
+import sqlite3
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterator, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reviews (
+    project_id INTEGER NOT NULL,
+    mr_iid INTEGER NOT NULL,
+    head_sha TEXT NOT NULL,
+    summary TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (project_id, mr_iid)
+);
+"""
+# Columns added after the first release, keyed by name
+MIGRATIONS = {
+    "discussion_id": "ALTER TABLE reviews ADD COLUMN discussion_id TEXT",
+}
+
+# The review sections worth carrying over to a follow-up review
+SUMMARY_MARKERS = ("🧐", "💬")
+
+
+@dataclass
+class ReviewState:
+    project_id: int
+    mr_iid: int
+    head_sha: str
+    summary: str
+    updated_at: float
+    # The discussion holding the verdict while the MR is not approved
+    discussion_id: Optional[str] = None
+
+
+def summarize_review(response: str, max_chars: int) -> str:
+    """
+    Keeps the review, comments and decision sections of a response, trimmed
+    to `max_chars` from the end so the decision is never cut off.
+    """
+    starts = [response.find(marker) for marker in SUMMARY_MARKERS]
+    start: int = min((s for s in starts if s >= 0), default=0)
+    summary: str = response[start:].strip()
+
+    return summary[-max_chars:]
+
+
+class ReviewStateStore:
+    """
+    Remembers the last head SHA reviewed for each MR, a summary of that
+    review and the discussion holding its verdict, in a local SQLite file
+    shared by every process on the host.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+        with self._connect() as db:
+            db.execute("PRAGMA journal_mode=WAL")
+            db.executescript(SCHEMA)
+            columns = {row["name"] for row in db.execute("PRAGMA table_info(reviews)")}
+
+            for column, statement in MIGRATIONS.items():
+                if column not in columns:
+                    db.execute(statement)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        db = sqlite3.connect(self.path, timeout=30)
+        db.row_factory = sqlite3.Row
+
+        try:
+            with db:
+                yield db
+        finally:
+            db.close()
+
+    def get(self, project_id: int, mr_iid: int) -> Optional[ReviewState]:
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT * FROM reviews WHERE project_id = ? AND mr_iid = ?",
+                (project_id, mr_iid),
+            ).fetchone()
+
+        return ReviewState(**dict(row)) if row else None
+
+    def save(
+        self,
+        project_id: int,
+        mr_iid: int,
+        head_sha: str,
+        summary: str,
+        discussion_id: Optional[str] = None,
+    ) -> None:
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO reviews (project_id, mr_iid, head_sha, "
+                "summary, updated_at, discussion_id) VALUES (?, ?, ?, ?, ?, ?)",
+                (project_id, mr_iid, head_sha, summary, time.time(), discussion_id),
+            )
@@ -1,3 +1,6 @@
+# Bump whenever a template changes so cached responses are not reused
+TEMPLATE_VERSION = 3
+
 SYSTEM_PERSONA = """
 You are known as iamksm-bot, serving as a dedicated AI assistant.
 Your primary role is to conduct comprehensive reviews of
@@ -6,43 +9,7 @@ thoroughness and precision in code reviewing.
 """
 
 
-PROMPT_TEMPLATE = """
-I kindly request you to perform an exhaustive review of the modifications
-proposed in this Merge Request (MR). Your feedback is invaluable, and I
-encourage you to provide constructive criticism and suggest enhancements
-to the code if necessary.
-
-- For **test files** (those with filenames commencing with `test_`):
-    - Verify that the test coverage is comprehensive, encapsulating the
-        majority, if not all, possible scenarios.
-    - Ensure adherence to the highest standards of coding.
-    - Implement industry-recognized best practices.
-
-- For **non-test files**:
-    - Strive to maintain unparalleled code quality.
-    - Implement best practices and consider all possible edge cases.
-
-Please refer to the Google Style Guides to ensure the code meets the highest
-quality standards. The file extension will help you determine the programming
-language used.
-
-Here is the current snapshot of the entire repository:
-{repo}
-
-Here are the details of the Merge Request:
-Merge Request Title: {mr_title}
-Description: {mr_desc}
-Commit Message(s): {commits}
-
-Here are the changes introduced:
-{changes}
-
-You can find the modified files in the following mapping:
-{file_paths_context}
-
-For a more detailed overview of the changes:
-{all_changes}
-
+REVIEW_FORMAT = """
 Please structure your review using the following Markdown format, ensuring that
 the section headings 1, 2, and 3 are bold:
 
@@ -100,3 +67,136 @@ Kindly ensure that:
     - You must strictly stick to the format I have given you above.
     - You must retain the emojis and their position as shown above.
 """
+
+
+# Prompts start with a prefix that is identical for every review of a project
+# at a given commit, so Ollama can reuse its evaluated KV cache, and end with
+# the parts specific to the MR.
+REVIEW_INSTRUCTIONS = """
+I kindly request you to perform an exhaustive review of the modifications
+proposed in this Merge Request (MR). Your feedback is invaluable, and I
+encourage you to provide constructive criticism and suggest enhancements
+to the code if necessary.
+
+- For **test files** (those with filenames commencing with `test_`):
+    - Verify that the test coverage is comprehensive, encapsulating the
+        majority, if not all, possible scenarios.
+    - Ensure adherence to the highest standards of coding.
+    - Implement industry-recognized best practices.
+
+- For **non-test files**:
+    - Strive to maintain unparalleled code quality.
+    - Implement best practices and consider all possible edge cases.
+
+Please refer to the Google Style Guides to ensure the code meets the highest
+quality standards. The file extension will help you determine the programming
+language used.
+""" + REVIEW_FORMAT
+
+
+PROJECT_CONTEXT = """
+Here is an overview of the {project} repository at commit {project_sha}:
+{project_context}
+"""
+
+
+PROMPT_TEMPLATE = REVIEW_INSTRUCTIONS + PROJECT_CONTEXT + """
+Here is the context from the repository relevant to this MR:
+{repo}
+
+Here are the details of the Merge Request:
+Merge Request Title: {mr_title}
+Description: {mr_desc}
+Commit Message(s):
+{commits}
+
+Here are the changes introduced:
+{changes}
+
+Here are the modified files after the changes:
+{file_paths_context}
+
+Write your review of this Merge Request now, strictly following the format
+given above.
+"""
+
+
+UNIT_REVIEW_TEMPLATE = (
+    """
+This Merge Request (MR) is too large to review at once, so you are reviewing
+one part of it. Another pass will merge your findings with those of the other
+parts, so only report findings and do not give a decision.
+
+- For **test files** (those with filenames commencing with `test_`), check
+    that the tests cover the changed behaviour and its edge cases.
+- For **non-test files**, look for bugs, unhandled edge cases, code smells
+    and deviations from the Google Style Guides.
+
+Reply with a Markdown list of findings. Start each point with a hyphen,
+name the file it concerns and be precise and specific. Reply with
+`- No findings` if this part needs no changes.
+"""
+    + PROJECT_CONTEXT
+    + """
+Here is the context from the repository relevant to this part:
+{repo}
+
+Merge Request Title: {mr_title}
+Description: {mr_desc}
+
+Here are the changes in this part of the MR:
+{changes}
+
+Here are the modified files after the changes:
+{file_paths_context}
+"""
+)
+
+
+REDUCE_TEMPLATE = (
+    """
+I kindly request you to write the final review of a Merge Request (MR).
+The MR was reviewed in parts and the findings for each part are listed
+below. Merge them into a single review, dropping duplicates and findings
+that contradict each other, and decide on the MR as a whole.
+"""
+    + REVIEW_FORMAT
+    + """
+Here are the details of the Merge Request:
+Merge Request Title: {mr_title}
+Description: {mr_desc}
+Commit Message(s):
+{commits}
+
+Here are the findings for each part of the MR:
+{findings}
+"""
+)
+
+
+FOLLOWUP_TEMPLATE = REVIEW_INSTRUCTIONS + PROJECT_CONTEXT + """
+You have already reviewed this Merge Request and new commits were pushed
+since. Focus on the changes since your last review, check whether they
+address your earlier points, and update your decision.
+
+Here is a summary of your previous review:
+{previous_review}
+
+Here is the context from the repository relevant to this MR:
+{repo}
+
+Here are the details of the Merge Request:
+Merge Request Title: {mr_title}
+Description: {mr_desc}
+New Commit Message(s):
+{commits}
+
+Here are the changes since your last review:
+{changes}
+
+Here are the modified files after the changes:
+{file_paths_context}
+
+Write your updated review of this Merge Request now, strictly following the
+format given above.
+"""
@@ -0,0 +1,106 @@
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator
+
+from iamksm_bot.app.metrics import (
+    EVAL_TOKENS_PER_SECOND,
+    PROMPT_TOKENS,
+    STAGE_BYTES,
+    STAGE_ERRORS,
+    STAGE_FILES,
+    STAGE_SECONDS,
+)
+from iamksm_bot.app.profiling import PROFILE, ReviewProfile, profile_review
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# The review a span belongs to, copied into threads started with
+# `asyncio.to_thread` or `contextvars.copy_context().run`
+TRACE_ID: ContextVar[str] = ContextVar("trace_id", default="-")
+
+
+@dataclass
+class Span:
+    """
+    One stage of a review, with the counts recorded while it ran.
+
+    Attributes named `bytes`, `files`, `prompt_tokens` and
+    `eval_tokens_per_second` are exported as metrics, every attribute is
+    logged with the duration of the stage.
+    """
+
+    stage: str
+    trace_id: str
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    start: float = field(default_factory=time.perf_counter)
+
+    def record(self, **attributes: Any) -> None:
+        self.attributes.update(attributes)
+
+    def export(self, duration: float) -> None:
+        attributes: Dict[str, Any] = self.attributes
+        STAGE_SECONDS.observe(duration, stage=self.stage)
+
+        if "bytes" in attributes:
+            STAGE_BYTES.inc(attributes["bytes"], stage=self.stage)
+
+        if "files" in attributes:
+            STAGE_FILES.inc(attributes["files"], stage=self.stage)
+
+        if "prompt_tokens" in attributes:
+            PROMPT_TOKENS.observe(attributes["prompt_tokens"])
+
+        if "eval_tokens_per_second" in attributes:
+            EVAL_TOKENS_PER_SECOND.observe(
+                attributes["eval_tokens_per_second"],
+                model=attributes.get("model", ""),
+            )
+
+        details: str = " ".join(f"{key}={value}" for key, value in attributes.items())
+        LOGGER.info(f"[{self.trace_id}] {self.stage} took {duration:.3f}s {details}")
+
+
+@contextmanager
+def trace(trace_id: str, profile: bool = True) -> Iterator[None]:
+    """
+    Marks the spans opened inside as stages of review `trace_id`, profiling
+    the review when profiling was armed, unless `profile` is false.
+    """
+    token = TRACE_ID.set(trace_id)
+
+    try:
+        if not profile:
+            yield
+            return
+
+        with profile_review(trace_id):
+            yield
+    finally:
+        TRACE_ID.reset(token)
+
+
+@contextmanager
+def span(stage: str, **attributes: Any) -> Iterator[Span]:
+    """
+    Times a review stage, exporting it as metrics and a log line on exit.
+
+    Counts only known once the stage ran are added with `Span.record`.
+    """
+    current = Span(stage=stage, trace_id=TRACE_ID.get(), attributes=attributes)
+
+    try:
+        yield current
+    except Exception:
+        STAGE_ERRORS.inc(stage=stage)
+        current.record(error=True)
+        raise
+    finally:
+        duration: float = time.perf_counter() - current.start
+        current.export(duration)
+        profile: ReviewProfile | None = PROFILE.get()
+
+        if profile is not None:
+            profile.stage(stage, duration)
@@ -1,19 +1,20 @@
 import logging
-import os
 import time
-import zipfile
-from collections import defaultdict
+from collections import OrderedDict
 from functools import wraps
-from pathlib import Path
+from threading import Lock
+from typing import Callable, Dict, Generic, Hashable, TypeVar
 
 LOGGER: logging.Logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
 
 def timer(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
         start: float = time.perf_counter()
-        func(*args, **kwargs)
+        result = func(*args, **kwargs)
         finish: float = time.perf_counter()
 
         function_name: str = func.__name__
@@ -22,44 +23,89 @@ def timer(func):
 
         LOGGER.info(msg)
 
+        return result
+
     return wrapper
 
 
-def download_and_read_repo_files_from_path(
-    name: str, zipped_archive: bytes, base_path="/tmp/repos"
-):
-    Path(base_path).mkdir(exist_ok=True)
+def is_ignored_path(path: str) -> bool:
+    *folders, file = path.split("/")
+
+    if any(folder.startswith(".") for folder in folders):
+        return True
+
+    return file.endswith((".ini", ".pyc")) or file.startswith(".")
+
+
+class Lazy(Generic[T]):
+    """
+    Builds a value with `factory` the first time it is needed, from whichever
+    thread asks first, and returns that same value afterwards.
+    """
+
+    def __init__(self, factory: Callable[[], T]):
+        self.factory = factory
+        self._value: T | None = None
+        self._lock = Lock()
+
+    @property
+    def built(self) -> bool:
+        return self._value is not None
 
-    repos = defaultdict()
-    path_to_downloaded_zipped_repo = f"{base_path}/{name}.zip"
-    path_to_unzipped_repo = f"{base_path}/{name}"
+    def get(self) -> T:
+        if self._value is None:
+            with self._lock:
+                if self._value is None:
+                    self._value = self.factory()
 
-    if not Path(path_to_unzipped_repo).exists():
-        with open(path_to_downloaded_zipped_repo, "wb") as f:
-            f.write(zipped_archive)
+        return self._value
 
-        with zipfile.ZipFile(path_to_downloaded_zipped_repo) as f:
-            Path(path_to_unzipped_repo).mkdir(exist_ok=True)
-            f.extractall(path_to_unzipped_repo)
-            os.remove(path_to_downloaded_zipped_repo)
 
-    repo_folder_path = os.path.join(
-        path_to_unzipped_repo, os.listdir(path_to_unzipped_repo)[0]
-    )
-    for root, dirs, files in os.walk(repo_folder_path):
-        # Filter out unwanted directories first
-        dirs[:] = [dir for dir in dirs if not dir.startswith(".")]
+class LruCache(Generic[T]):
+    """
+    Values built once per key, by whichever thread asks first while the
+    others wait for it, keeping the `size` most recently used.
+    """
 
-        for file in files:
-            if file.endswith((".ini", ".pyc")) or file.startswith("."):
-                continue
+    def __init__(self, size: int):
+        self.size = size
+        self._values: OrderedDict[Hashable, T] = OrderedDict()
+        self._building: Dict[Hashable, Lock] = {}
+        self._lock = Lock()
 
-            path = os.path.join(root, file)
+    def cached(self, key: Hashable) -> T | None:
+        with self._lock:
+            if key not in self._values:
+                return None
+
+            self._values.move_to_end(key)
+            return self._values[key]
+
+    def get(self, key: Hashable, build: Callable[[], T]) -> T:
+        value: T | None = self.cached(key)
+
+        if value is not None:
+            return value
+
+        with self._lock:
+            building: Lock = self._building.setdefault(key, Lock())
+
+        with building:
+            value = self.cached(key)
+
+            if value is not None:
+                return value
 
             try:
-                repos[path] = Path(path).read_text()
-            except UnicodeDecodeError:
-                continue
+                value = build()
+
+                with self._lock:
+                    self._values[key] = value
+
+                    while len(self._values) > self.size:
+                        self._values.popitem(last=False)
+            finally:
+                with self._lock:
+                    self._building.pop(key, None)
 
-    LOGGER.info(f"Done reading the {name} repository contents")
-    return repos
+        return value
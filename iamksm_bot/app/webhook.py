@@ -1,108 +1,192 @@
 import logging
-from threading import Thread
-from typing import Dict
-
-from flask import Flask, request
-from gitlab.v4.objects.projects import Project
-
-from iamksm_bot.app.ai import IAMKSM
+from threading import Event, Thread
+from typing import TYPE_CHECKING, Dict
+
+from flask import Flask, Response, current_app, jsonify, request
+
+from iamksm_bot.app.events import (
+    can_review_event,
+    event_head_sha,
+    is_merge_request_body,
+    is_push_event,
+    push_event_target,
+    review_priority,
+)
+from iamksm_bot.app.fairqueue import RETRY_AFTER_SECONDS, BacklogFull, SchedulingPolicy
+from iamksm_bot.app.jobqueue import JobQueue
+from iamksm_bot.app.metrics import (
+    CONTENT_TYPE,
+    QUEUE_DEPTH,
+    REGISTRY,
+    REVIEWS_IN_FLIGHT,
+)
+from iamksm_bot.app.prewarm import Prewarmer
+from iamksm_bot.app.profiling import profile_command
+from iamksm_bot.app.scheduler import ReviewScheduler
+from iamksm_bot.app.utils import Lazy
 from iamksm_bot.config.settings import settings
 
+if TYPE_CHECKING:
+    from iamksm_bot.app.ai import IAMKSM
+
 LOGGER: logging.Logger = logging.getLogger(__name__)
-FLASK_APP = Flask(__name__)
-GITLAB_TOKEN = settings.GITLAB_TOKEN
-GITLAB_HEADER_TOKEN = settings.GITLAB_HEADER_TOKEN
 
 
-@FLASK_APP.route("/review-mr", methods=["POST"])
-def mr_review_webhook() -> tuple[str, int]:
+def build_reviewer() -> "IAMKSM":
+    # Imported here so workers serve webhooks without loading the review stack
+    from iamksm_bot.app.ai import IAMKSM
+
+    return IAMKSM()
+
+
+REVIEWER: Lazy["IAMKSM"] = Lazy(build_reviewer)
+
+
+def review_merge_request(project_id: int, mr_id: int, cancel: Event) -> None:
+    REVIEWER.get().review_merge_request(project_id, mr_id, cancel)
+
+
+def prewarm_branch(project_id: int, branch: str, sha: str) -> bool:
+    return REVIEWER.get().prewarm(project_id, branch, sha)
+
+
+def create_queue() -> ReviewScheduler | JobQueue:
+    policy = SchedulingPolicy.from_settings(settings)
+
+    if settings.REVIEW_QUEUE == "sqlite":
+        queue = JobQueue(
+            path=settings.REVIEW_QUEUE_PATH,
+            visibility_timeout=settings.REVIEW_VISIBILITY_TIMEOUT,
+            max_attempts=settings.REVIEW_MAX_ATTEMPTS,
+            policy=policy,
+        )
+    else:
+        queue = ReviewScheduler(
+            review=review_merge_request,
+            debounce_seconds=settings.REVIEW_DEBOUNCE_SECONDS,
+            max_concurrent=settings.REVIEW_CONCURRENCY,
+            policy=policy,
+        )
+
+    QUEUE_DEPTH.set_function(queue.depth)
+    REVIEWS_IN_FLIGHT.set_function(queue.in_flight)
+    return queue
+
+
+def mr_review_webhook() -> tuple:
     X_GITLAB_TOKEN = request.headers.get("X-Gitlab-Token")
 
-    if X_GITLAB_TOKEN != GITLAB_HEADER_TOKEN:
+    if X_GITLAB_TOKEN != settings.GITLAB_HEADER_TOKEN:
         LOGGER.error(f"UNAUTHORIZED: {X_GITLAB_TOKEN = } is incorrect")
         return "UNAUTHORIZED", 401
 
-    data: Dict = request.json
+    data: Dict | None = request.get_json(silent=True)
+
+    if isinstance(data, dict) and is_push_event(data):
+        return queue_prewarm(data)
+
+    if not is_merge_request_body(data):
+        LOGGER.error("BAD REQUEST: the webhook body is not a merge request event")
+        return "BAD REQUEST", 400
+
     project = data["project"]
-    obj_attrs = data["object_attributes"]
-    mr_id = obj_attrs["iid"]
-
-    is_an_mr = data["event_type"] == "merge_request"
-    is_not_draft = obj_attrs["draft"] is False
-    is_not_wip = obj_attrs["work_in_progress"] is False
-    no_unresolved_comments: bool = obj_attrs["blocking_discussions_resolved"] is True
-    mr_action_is_valid = obj_attrs["action"] in ("update", "open")
-    is_an_open_mr = obj_attrs["state"] == "opened"
-
-    can_review: bool = all(
-        (
-            is_an_open_mr,
-            is_not_draft,
-            is_not_wip,
-            no_unresolved_comments,
-            is_an_mr,
-            mr_action_is_valid,
-        )
-    )
+    mr_id = data["object_attributes"]["iid"]
 
-    if not can_review:
-        return log_and_forbid_review(
-            data,
-            obj_attrs,
-            is_an_mr,
-            is_not_draft,
-            is_not_wip,
-            no_unresolved_comments,
-            mr_action_is_valid,
-            is_an_open_mr,
-        )
+    if not can_review_event(data):
+        return "FORBIDDEN", 403
 
-    project: Project = AIR.gl.projects.get(project["id"])
-    thread = Thread(
-        target=AIR.review_project_open_merge_request, args=(project, mr_id), daemon=True
+    head_sha: str | None = event_head_sha(data)
+    priority: int = review_priority(
+        data,
+        labels=settings.REVIEW_PRIORITY_LABELS,
+        followups=settings.REVIEW_PRIORITY_FOLLOWUPS and settings.INCREMENTAL_REVIEW,
     )
-    thread.start()
+    queue: ReviewScheduler | JobQueue = current_app.extensions["review_queue"]
+
+    try:
+        if isinstance(queue, JobQueue):
+            queue.enqueue(
+                project_id=project["id"],
+                mr_iid=mr_id,
+                sha=head_sha,
+                delay=settings.REVIEW_DEBOUNCE_SECONDS,
+                priority=priority,
+            )
+        else:
+            queue.submit(
+                project_id=project["id"], mr_iid=mr_id, sha=head_sha, priority=priority
+            )
+    except BacklogFull as error:
+        LOGGER.warning(f"Not queueing review of {project['id']}!{mr_id}: {error}")
+        return "BUSY", error.status, {"Retry-After": str(RETRY_AFTER_SECONDS)}
 
     return "OK", 200
 
 
-def log_and_forbid_review(
-    data,
-    obj_attrs,
-    is_an_mr,
-    is_not_draft,
-    is_not_wip,
-    no_unresolved_comments,
-    mr_action_is_valid,
-    is_an_open_mr,
-):
-    event_type = f"\n {data['event_type'] = } should be `merge_request`"
-    draft_status = f"\n {obj_attrs['draft'] = } should be `False`"
-    work_in_progress = f"\n {obj_attrs['work_in_progress'] = } should be `False`"
-    pending_threads = (
-        f"\n {obj_attrs['blocking_discussions_resolved'] = } should be `True`"
-    )
-    is_valid_action = f"\n {obj_attrs['action'] = } should be either open or update"
-    mr_status = f" \n {obj_attrs['state'] = } should be opened"
+def queue_prewarm(data: Dict) -> tuple:
+    target = push_event_target(data)
+    prewarmer: Prewarmer | None = current_app.extensions.get("prewarmer")
 
-    msg_to_state_map: Dict[bool, str] = {
-        is_an_mr: event_type,
-        is_not_draft: draft_status,
-        is_not_wip: work_in_progress,
-        no_unresolved_comments: pending_threads,
-        mr_action_is_valid: is_valid_action,
-        is_an_open_mr: mr_status,
-    }
+    if target is None or prewarmer is None:
+        return "IGNORED", 200
+
+    prewarmer.submit(*target)
+    return "OK", 200
+
+
+def metrics() -> Response:
+    return Response(REGISTRY.render(), mimetype=CONTENT_TYPE)
 
-    final_msg = "Cannot Review due to: "
 
-    for status, msg in msg_to_state_map.items():
-        if not status:
-            final_msg += msg
+def profile_admin() -> tuple:
+    admin_token: str = settings.PROFILE_ADMIN_TOKEN
 
-    LOGGER.error(final_msg)
+    if not admin_token or request.headers.get("X-Admin-Token") != admin_token:
+        LOGGER.error("UNAUTHORIZED: admin token is missing or incorrect")
+        return "UNAUTHORIZED", 401
+
+    try:
+        body: Dict = request.get_json(silent=True) or {}
+        return jsonify(profile_command(request.method, body)), 200
+    except (TypeError, ValueError) as error:
+        return str(error), 400
+
+
+def create_app() -> Flask:
+    """
+    Creates the webhook app, serving `POST /review-mr`, `GET /metrics` and
+    `/admin/profile`.
+
+    Explanation:
+    - Nothing is sent over the network while the app is created, so a worker
+        accepts and queues events as soon as it boots, even with GitLab slow
+        or unreachable.
+    - With the in-process queue, the reviewer and its GitLab and Ollama
+        clients are built by a background thread, or by the first review if
+        that comes sooner, and GitLab credentials are validated afterwards
+        in the background.
+    - Push events to the branches MRs target have their repository context
+        built in the background while a review slot is free.
+    - With `REVIEW_QUEUE: sqlite` the reviewer is only built by
+        `iamksm-bot worker` and push events are ignored.
+    """
+    app = Flask(__name__)
+    queue: ReviewScheduler | JobQueue = create_queue()
+    app.extensions["review_queue"] = queue
+    app.add_url_rule("/review-mr", view_func=mr_review_webhook, methods=["POST"])
+    app.add_url_rule("/metrics", view_func=metrics, methods=["GET"])
+    app.add_url_rule(
+        "/admin/profile", view_func=profile_admin, methods=["GET", "POST", "DELETE"]
+    )
 
-    return "FORBIDDEN", 403
+    if settings.REVIEW_QUEUE != "sqlite":
+        Thread(target=REVIEWER.get, name="reviewer-warmup", daemon=True).start()
 
+    if settings.REVIEW_QUEUE != "sqlite" and settings.PREWARM_ENABLED:
+        app.extensions["prewarmer"] = Prewarmer(
+            prewarm=prewarm_branch,
+            busy=lambda: queue.in_flight() >= settings.REVIEW_CONCURRENCY,
+            max_pending=settings.PREWARM_MAX_PENDING,
+        )
 
-AIR = IAMKSM()
+    return app
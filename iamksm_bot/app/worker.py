@@ -0,0 +1,128 @@
+import logging
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor
+from threading import Event, Lock
+from typing import Callable, Dict, Tuple
+
+from iamksm_bot.app.jobqueue import Job, JobQueue, default_owner
+from iamksm_bot.app.metrics import REVIEWS
+from iamksm_bot.app.scheduler import ReviewCancelled
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+# Seconds between two purges of finished jobs
+PURGE_INTERVAL = 3600
+
+
+class ReviewWorker:
+    """
+    Consumes review jobs from a JobQueue, running up to `concurrency` at once.
+
+    Leases are extended while a review runs. When the heartbeat reports that
+    a job was superseded or its lease was lost, the review is cancelled.
+
+    Jobs that finished more than `retention` seconds ago are purged when the
+    worker starts and every `PURGE_INTERVAL` seconds.
+    """
+
+    def __init__(
+        self,
+        queue: JobQueue,
+        review: Callable[[int, int, Event], None],
+        concurrency: int,
+        poll_interval: float = 1.0,
+        retention: float = 7 * 24 * 3600,
+    ):
+        self.queue = queue
+        self.review = review
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.retention = retention
+        # Heartbeats double as the superseded check, so keep them frequent
+        self.heartbeat_interval: float = min(queue.visibility_timeout / 3, 10)
+        self.owner: str = default_owner()
+        self.executor = ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="review-worker"
+        )
+        self.stopping = Event()
+        self._lock = Lock()
+        self._active: Dict[int, Tuple[Job, Event]] = {}
+
+    def stop(self, *_) -> None:
+        LOGGER.info("Stopping worker, waiting for running reviews to finish")
+        self.stopping.set()
+
+    def run(self) -> None:
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        LOGGER.info(f"Worker {self.owner} consuming {self.queue.path}")
+        last_heartbeat: float = time.monotonic()
+        last_purge: float = float("-inf")
+
+        while not self.stopping.is_set():
+            if time.monotonic() - last_purge > PURGE_INTERVAL:
+                self.queue.purge(self.retention)
+                last_purge = time.monotonic()
+
+            leased: bool = False
+
+            if len(self._active) < self.concurrency:
+                job = self.queue.lease(self.owner)
+
+                if job is not None:
+                    leased = True
+                    self.start(job)
+
+            if time.monotonic() - last_heartbeat > self.heartbeat_interval:
+                self.heartbeat()
+                last_heartbeat = time.monotonic()
+
+            if not leased:
+                self.stopping.wait(self.poll_interval)
+
+        # Keep the leases alive while the running reviews drain
+        while self._active:
+            self.heartbeat()
+            time.sleep(self.poll_interval)
+
+        self.executor.shutdown(wait=True)
+
+    def start(self, job: Job) -> None:
+        cancel = Event()
+
+        with self._lock:
+            self._active[job.id] = (job, cancel)
+
+        self.executor.submit(self.process, job, cancel)
+
+    def heartbeat(self) -> None:
+        with self._lock:
+            active = list(self._active.values())
+
+        for job, cancel in active:
+            if not self.queue.heartbeat(job, self.owner):
+                LOGGER.info(f"Cancelling superseded job {job.id}")
+                cancel.set()
+
+    def process(self, job: Job, cancel: Event) -> None:
+        LOGGER.info(
+            f"Reviewing {job.project_id}!{job.mr_iid}@{job.sha} "
+            f"(job {job.id}, attempt {job.attempts})"
+        )
+
+        try:
+            self.review(job.project_id, job.mr_iid, cancel)
+        except ReviewCancelled:
+            self.queue.supersede(job)
+            REVIEWS.inc(outcome="superseded")
+        except Exception as error:
+            LOGGER.exception(f"Job {job.id} failed")
+            self.queue.fail(job, repr(error))
+            REVIEWS.inc(outcome="failed")
+        else:
+            self.queue.complete(job)
+            REVIEWS.inc(outcome="done")
+        finally:
+            with self._lock:
+                del self._active[job.id]
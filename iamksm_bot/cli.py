@@ -0,0 +1,165 @@
+import argparse
+import logging
+from typing import List, Optional
+
+LOGGER: logging.Logger = logging.getLogger(__name__)
+
+
+def run_worker(args: argparse.Namespace) -> None:
+    from iamksm_bot.app.ai import IAMKSM
+    from iamksm_bot.app.fairqueue import SchedulingPolicy
+    from iamksm_bot.app.jobqueue import JobQueue
+    from iamksm_bot.app.metrics import serve_metrics
+    from iamksm_bot.app.worker import ReviewWorker
+    from iamksm_bot.config.settings import settings
+
+    metrics_port: int = (
+        settings.WORKER_METRICS_PORT if args.metrics_port is None else args.metrics_port
+    )
+
+    if metrics_port:
+        serve_metrics(metrics_port)
+
+    queue = JobQueue(
+        path=settings.REVIEW_QUEUE_PATH,
+        visibility_timeout=settings.REVIEW_VISIBILITY_TIMEOUT,
+        max_attempts=settings.REVIEW_MAX_ATTEMPTS,
+        policy=SchedulingPolicy.from_settings(settings),
+    )
+    worker = ReviewWorker(
+        queue=queue,
+        review=IAMKSM().review_merge_request,
+        concurrency=args.concurrency or settings.REVIEW_CONCURRENCY,
+        retention=settings.REVIEW_QUEUE_RETENTION,
+    )
+    worker.run()
+
+
+def run_backfill(args: argparse.Namespace) -> None:
+    from pathlib import Path
+
+    from iamksm_bot.app.ai import IAMKSM
+    from iamksm_bot.app.backfill import Backfill, Checkpoint
+    from iamksm_bot.config.settings import settings
+
+    checkpoint = Checkpoint(
+        Path(args.checkpoint or f"{settings.REPO_INSTALL_PATH}/backfill.jsonl")
+    )
+    backfill = Backfill(
+        air=IAMKSM(), checkpoint=checkpoint, concurrency=args.concurrency or 0
+    )
+    items = backfill.eligible(groups=args.group, projects=args.project)
+
+    if args.dry_run:
+        for item in items:
+            print(f"{item.ref}@{item.sha} {item.title}")
+
+        return
+
+    stats = backfill.run(items)
+    print(stats.report())
+
+
+def run_profile(args: argparse.Namespace) -> None:
+    from iamksm_bot.app.profiling import ProfileRequest, arm, armed, disarm
+    from iamksm_bot.config.settings import settings
+
+    if args.action == "arm":
+        arm(
+            settings.PROFILE_DIR,
+            ProfileRequest(
+                reviews=args.reviews,
+                interval=args.interval or settings.PROFILE_INTERVAL,
+                memory=args.memory,
+            ),
+        )
+    elif args.action == "disarm":
+        disarm(settings.PROFILE_DIR)
+
+    request = armed(settings.PROFILE_DIR)
+
+    if request is None:
+        print(f"Profiling is not armed, profiles are in {settings.PROFILE_DIR}")
+    else:
+        memory: str = " with memory" if request.memory else ""
+        print(
+            f"Profiling the next {request.reviews} reviews{memory} every "
+            f"{request.interval}s into {settings.PROFILE_DIR}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="iamksm-bot")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    worker = commands.add_parser("worker", help="Consume reviews from the job queue")
+    worker.add_argument(
+        "--concurrency",
+        type=int,
+        help="Reviews to run at once, defaults to REVIEW_CONCURRENCY",
+    )
+    worker.add_argument(
+        "--metrics-port",
+        type=int,
+        help="Port serving GET /metrics, defaults to WORKER_METRICS_PORT, 0 for none",
+    )
+    worker.set_defaults(handler=run_worker)
+
+    backfill = commands.add_parser(
+        "backfill", help="Review every eligible open MR of groups or projects"
+    )
+    backfill.add_argument(
+        "--group",
+        action="append",
+        default=[],
+        help="ID or path of a group whose MRs, subgroups included, are reviewed",
+    )
+    backfill.add_argument(
+        "--project",
+        action="append",
+        default=[],
+        help="ID or path of a project whose MRs are reviewed",
+    )
+    backfill.add_argument(
+        "--concurrency",
+        type=int,
+        help="Reviews to run at once, defaults to twice the model pool capacity",
+    )
+    backfill.add_argument(
+        "--checkpoint",
+        help="File to resume from, defaults to REPO_INSTALL_PATH/backfill.jsonl",
+    )
+    backfill.add_argument(
+        "--dry-run", action="store_true", help="List the MRs that would be reviewed"
+    )
+    backfill.set_defaults(handler=run_backfill)
+
+    profile = commands.add_parser(
+        "profile", help="Profile the next reviews of the bot processes on this host"
+    )
+    profile.add_argument("action", choices=("arm", "disarm", "status"))
+    profile.add_argument(
+        "--reviews", type=int, default=1, help="Reviews to profile, one by default"
+    )
+    profile.add_argument(
+        "--interval",
+        type=float,
+        help="Seconds between stack samples, defaults to PROFILE_INTERVAL",
+    )
+    profile.add_argument(
+        "--memory",
+        action="store_true",
+        help="Also trace allocations per review stage, which slows reviews down",
+    )
+    profile.set_defaults(handler=run_profile)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "backfill" and not (args.group or args.project):
+        parser.error("backfill needs at least one --group or --project")
+
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
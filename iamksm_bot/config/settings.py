@@ -1,5 +1,7 @@
 import logging
 from importlib import import_module
+from threading import Lock
+from typing import Any
 
 LOGGER = logging.getLogger(__name__)
 
@@ -7,12 +9,34 @@ SETTINGS = "iamksm_bot.config.settings_file"
 
 
 class Settings:
+    """
+    The upper case names of `settings_file`, which is only imported, and the
+    config file read, the first time a setting is used.
+    """
+
     def __init__(self):
-        module = import_module(SETTINGS)
-        for setting in dir(module):
-            if setting.isupper():
-                setting_value = getattr(module, setting)
-                setattr(self, setting, setting_value)
+        self._lock = Lock()
+
+    def load(self) -> None:
+        with self._lock:
+            if "_loaded" in self.__dict__:
+                return
+
+            module = import_module(SETTINGS)
+            for setting in dir(module):
+                if setting.isupper():
+                    setting_value = getattr(module, setting)
+                    setattr(self, setting, setting_value)
+
+            self._loaded = True
+
+    def __getattr__(self, name: str) -> Any:
+        # Only called for names not set yet, that is before the first load
+        if not name.isupper() or "_loaded" in self.__dict__:
+            raise AttributeError(f"Unknown setting {name}")
+
+        self.load()
+        return getattr(self, name)
 
 
 settings = Settings()
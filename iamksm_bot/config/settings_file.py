@@ -1,7 +1,7 @@
 import logging
 import os
 from pathlib import Path
-from typing import Any, Dict
+from typing import Any, Dict, List
 
 import yaml
 
@@ -25,8 +25,89 @@ site_settings: Dict[Any, Any] = load_config()
 
 GITLAB_TOKEN: str = site_settings["GITLAB_TOKEN"]
 REPO_INSTALL_PATH: str = site_settings.get("REPO_INSTALL_PATH", "/tmp/repos")
+# Disk quota for cached repository snapshots, least recently used are evicted first
+REPO_CACHE_QUOTA_MB: int = int(site_settings.get("REPO_CACHE_QUOTA_MB", 2048))
+# Where repository files are read from, either `archive` or a local git `mirror`
+REPO_SOURCE: str = site_settings.get("REPO_SOURCE", "archive")
+# Repository snapshots kept open in memory, shared by reviews of the same commit
+REPO_CONTENTS_CACHE_SIZE: int = int(site_settings.get("REPO_CONTENTS_CACHE_SIZE", 4))
+# Archive files larger than this, or matching these extensions or globs, are
+# never read as review context
+INGEST_MAX_FILE_KB: int = int(site_settings.get("INGEST_MAX_FILE_KB", 256))
+INGEST_SKIP_EXTENSIONS: List[str] = site_settings.get(
+    "INGEST_SKIP_EXTENSIONS",
+    [
+        ".lock",
+        ".min.js",
+        ".min.css",
+        ".map",
+        ".svg",
+        ".csv",
+        ".pdf",
+        ".zip",
+        ".png",
+        ".jpg",
+        ".jpeg",
+        ".gif",
+        ".ico",
+        ".webp",
+        ".woff",
+        ".woff2",
+        ".ttf",
+        ".otf",
+        ".eot",
+    ],
+)
+INGEST_DENYLIST: List[str] = site_settings.get(
+    "INGEST_DENYLIST",
+    ["package-lock.json", "*/node_modules/*", "node_modules/*", "vendor/*"],
+)
 GITLAB_URL: str = site_settings["GITLAB_URL"]
 GITLAB_HEADER_TOKEN: str = site_settings.get("GITLAB_HEADER_TOKEN", "")
+# Repository files fetched per GraphQL request, GitLab allows at most 100
+GITLAB_BLOB_BATCH_SIZE: int = int(site_settings.get("GITLAB_BLOB_BATCH_SIZE", 100))
+# Connections the async review pipeline keeps open to GitLab
+GITLAB_MAX_CONNECTIONS: int = int(site_settings.get("GITLAB_MAX_CONNECTIONS", 20))
+
+# Events for the same MR within this window are reviewed once, at the latest push
+REVIEW_DEBOUNCE_SECONDS: float = float(site_settings.get("REVIEW_DEBOUNCE_SECONDS", 30))
+# Maximum number of reviews sent to the model at the same time
+REVIEW_CONCURRENCY: int = int(site_settings.get("REVIEW_CONCURRENCY", 2))
+# `memory` reviews inside the web process, `sqlite` hands them to `iamksm-bot worker`
+REVIEW_QUEUE: str = site_settings.get("REVIEW_QUEUE", "memory")
+REVIEW_QUEUE_PATH: str = site_settings.get(
+    "REVIEW_QUEUE_PATH", f"{REPO_INSTALL_PATH}/reviews.sqlite3"
+)
+# Seconds a worker may hold a review without a heartbeat before it is retried
+REVIEW_VISIBILITY_TIMEOUT: float = float(
+    site_settings.get("REVIEW_VISIBILITY_TIMEOUT", 300)
+)
+REVIEW_MAX_ATTEMPTS: int = int(site_settings.get("REVIEW_MAX_ATTEMPTS", 3))
+# Seconds finished, failed and superseded reviews are kept in the queue
+REVIEW_QUEUE_RETENTION: float = float(
+    site_settings.get("REVIEW_QUEUE_RETENTION", 7 * 24 * 3600)
+)
+# Port each `iamksm-bot worker` serves its metrics on, 0 for none
+WORKER_METRICS_PORT: int = int(site_settings.get("WORKER_METRICS_PORT", 9100))
+# Webhooks get a 503 while this many reviews wait, and a 429 while their project
+# has `REVIEW_PROJECT_MAX_BACKLOG` waiting, 0 for no limit
+REVIEW_MAX_BACKLOG: int = int(site_settings.get("REVIEW_MAX_BACKLOG", 200))
+REVIEW_PROJECT_MAX_BACKLOG: int = int(
+    site_settings.get("REVIEW_PROJECT_MAX_BACKLOG", 50)
+)
+# Most reviews of one project running at once, 0 for no limit
+REVIEW_PROJECT_MAX_CONCURRENT: int = int(
+    site_settings.get("REVIEW_PROJECT_MAX_CONCURRENT", 0)
+)
+# Per project `weight`, the share of review slots relative to other busy
+# projects, and overrides of the limits above
+REVIEW_PROJECTS: List[Dict[str, Any]] = site_settings.get("REVIEW_PROJECTS", [])
+# Reviews of MRs with any of these labels, and of follow-up pushes when reviews
+# are incremental, are started before other waiting reviews
+REVIEW_PRIORITY_LABELS: List[str] = site_settings.get("REVIEW_PRIORITY_LABELS", [])
+REVIEW_PRIORITY_FOLLOWUPS: bool = bool(
+    site_settings.get("REVIEW_PRIORITY_FOLLOWUPS", True)
+)
 
 # For options details see the below link
 # https://github.com/ollama/ollama/blob/main/docs/modelfile.md#valid-parameters-and-values  # noqa
@@ -38,3 +119,84 @@ ollama_default_options = {
 }
 OLLAMA_OPTIONS: Dict = site_settings.get("OLLAMA_OPTIONS", ollama_default_options)
 OLLAMA_MODEL: str = str(site_settings.get("OLLAMA_MODEL", "llama3:8b"))
+# Wall-clock limit in seconds and token cap for generating a single review
+OLLAMA_TIMEOUT: float = float(site_settings.get("OLLAMA_TIMEOUT", 600))
+OLLAMA_MAX_TOKENS: int = int(site_settings.get("OLLAMA_MAX_TOKENS", 2048))
+# Maximum number of generations sent to the model at once by each process
+OLLAMA_CONCURRENCY: int = int(site_settings.get("OLLAMA_CONCURRENCY", 2))
+# Ollama servers shared by the reviews, each running at most `concurrency`
+# generations at once. Defaults to the server in `OLLAMA_HOST`.
+OLLAMA_ENDPOINTS: List[Dict[str, Any]] = site_settings.get(
+    "OLLAMA_ENDPOINTS", [{"host": None, "concurrency": OLLAMA_CONCURRENCY}]
+)
+# Seconds between health checks of each Ollama server
+OLLAMA_HEALTH_INTERVAL: float = float(site_settings.get("OLLAMA_HEALTH_INTERVAL", 30))
+# The first rule matching the diff size and labels of an MR picks its model,
+# MRs matching no rule are reviewed with `OLLAMA_MODEL`
+OLLAMA_MODEL_RULES: List[Dict[str, Any]] = site_settings.get("OLLAMA_MODEL_RULES", [])
+# How long Ollama keeps the model and its prompt cache loaded between reviews
+OLLAMA_KEEP_ALIVE: str = str(site_settings.get("OLLAMA_KEEP_ALIVE", "30m"))
+
+# MRs with this many files or diff tokens are reviewed in parts, then merged
+MAP_REDUCE_MIN_FILES: int = int(site_settings.get("MAP_REDUCE_MIN_FILES", 15))
+MAP_REDUCE_MIN_DIFF_TOKENS: int = int(
+    site_settings.get("MAP_REDUCE_MIN_DIFF_TOKENS", 6000)
+)
+MAP_REDUCE_UNIT_TOKENS: int = int(site_settings.get("MAP_REDUCE_UNIT_TOKENS", 2000))
+
+# Reuse model responses for identical diffs and context, e.g. after a rebase
+RESPONSE_CACHE_ENABLED: bool = bool(site_settings.get("RESPONSE_CACHE_ENABLED", True))
+RESPONSE_CACHE_PATH: str = site_settings.get(
+    "RESPONSE_CACHE_PATH", f"{REPO_INSTALL_PATH}/responses"
+)
+RESPONSE_CACHE_TTL_HOURS: float = float(
+    site_settings.get("RESPONSE_CACHE_TTL_HOURS", 168)
+)
+RESPONSE_CACHE_MAX_MB: int = int(site_settings.get("RESPONSE_CACHE_MAX_MB", 64))
+# `skip` does not comment again on an MR that already got the cached review,
+# `repost` always comments it
+RESPONSE_CACHE_HIT_ACTION: str = site_settings.get("RESPONSE_CACHE_HIT_ACTION", "skip")
+
+# Changed files are cached by git blob id, in memory and on disk
+BLOB_CACHE_PATH: str = site_settings.get(
+    "BLOB_CACHE_PATH", f"{REPO_INSTALL_PATH}/blobs"
+)
+BLOB_CACHE_MEMORY_MB: int = int(site_settings.get("BLOB_CACHE_MEMORY_MB", 32))
+BLOB_CACHE_MAX_MB: int = int(site_settings.get("BLOB_CACHE_MAX_MB", 256))
+
+# Re-review only the commits pushed since the last reviewed SHA of an MR
+INCREMENTAL_REVIEW: bool = bool(site_settings.get("INCREMENTAL_REVIEW", True))
+REVIEW_STATE_PATH: str = site_settings.get(
+    "REVIEW_STATE_PATH", f"{REPO_INSTALL_PATH}/state.sqlite3"
+)
+# Characters of the previous review passed to a follow-up review
+REVIEW_SUMMARY_CHARS: int = int(site_settings.get("REVIEW_SUMMARY_CHARS", 2000))
+
+# Tokens of repository context sent with a review, most relevant files first
+CONTEXT_TOKEN_BUDGET: int = int(site_settings.get("CONTEXT_TOKEN_BUDGET", 4096))
+# Files whose content is read and scored for the context, picked by path first
+CONTEXT_SHORTLIST_SIZE: int = int(site_settings.get("CONTEXT_SHORTLIST_SIZE", 200))
+# Unchanged lines kept around each change in the diffs sent to the model
+PROMPT_CONTEXT_LINES: int = int(site_settings.get("PROMPT_CONTEXT_LINES", 3))
+# Tokens of the file listing that opens every prompt for a project and commit
+PROJECT_OVERVIEW_TOKENS: int = int(site_settings.get("PROJECT_OVERVIEW_TOKENS", 1024))
+# Use embedding retrieval instead of ranking whole files, requires numpy
+RETRIEVAL_ENABLED: bool = bool(site_settings.get("RETRIEVAL_ENABLED", False))
+RETRIEVAL_TOP_K: int = int(site_settings.get("RETRIEVAL_TOP_K", 20))
+EMBEDDING_MODEL: str = str(site_settings.get("EMBEDDING_MODEL", "nomic-embed-text"))
+
+# Build the context of pushes to the default branch, protected branches and
+# branches matching these patterns before MRs targeting them are reviewed
+PREWARM_ENABLED: bool = bool(site_settings.get("PREWARM_ENABLED", True))
+PREWARM_BRANCHES: List[str] = site_settings.get("PREWARM_BRANCHES", [])
+# Pushes waiting to be prewarmed, the oldest are dropped first
+PREWARM_MAX_PENDING: int = int(site_settings.get("PREWARM_MAX_PENDING", 20))
+
+# Profiles of reviews armed with `iamksm-bot profile` or `/admin/profile`
+PROFILE_DIR: str = site_settings.get("PROFILE_DIR", f"{REPO_INSTALL_PATH}/profiles")
+# `X-Admin-Token` of the admin endpoints, which are disabled while it is empty
+PROFILE_ADMIN_TOKEN: str = site_settings.get("PROFILE_ADMIN_TOKEN", "")
+# Seconds between two stack samples of a profiled review
+PROFILE_INTERVAL: float = float(site_settings.get("PROFILE_INTERVAL", 0.01))
+# Allocating lines listed per stage when memory is profiled
+PROFILE_MEMORY_TOP: int = int(site_settings.get("PROFILE_MEMORY_TOP", 10))
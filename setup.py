@@ -17,13 +17,28 @@ setup(
     author_email="koss.797@gmail.com",
     url="https://github.com/iamksm/ai-mr-reviewer#ai-mr-reviewer",
     packages=find_packages(exclude=["tests"]),
-    python_requires=">=3.8,<3.12",
+    python_requires=">=3.10,<3.12",
+    classifiers=[
+        "Programming Language :: Python :: 3",
+        "Programming Language :: Python :: 3 :: Only",
+        "Programming Language :: Python :: 3.10",
+        "Programming Language :: Python :: 3.11",
+        "Operating System :: POSIX :: Linux",
+    ],
     install_requires=[
         "flask~=3.0.3",
         "requests~=2.32.3",
+        "httpx~=0.27.0",
         "python-gitlab~=4.6.0",
         "gunicorn[gevent]~=22.0.0",
         "ollama~=0.2.1",
         "pyyaml~=6.0.1",
     ],
+    entry_points={
+        "console_scripts": ["iamksm-bot=iamksm_bot.cli:main"],
+    },
+    extras_require={
+        "retrieval": ["numpy>=1.24"],
+        "asgi": ["uvicorn~=0.30.1"],
+    },
 )
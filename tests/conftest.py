@@ -0,0 +1,33 @@
+import sys
+from pathlib import Path
+from typing import Any, Callable, Iterator, List
+
+import pytest
+
+# The fake servers of the benchmarks double as test servers
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "benchmarks"))
+
+from fake_ollama import FakeOllamaServer, start_fake_ollama  # noqa: E402
+
+
+def server_url(server: FakeOllamaServer) -> str:
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+
+@pytest.fixture
+def fake_ollama() -> Iterator[Callable[..., FakeOllamaServer]]:
+    """
+    Starts fake Ollama servers taking `start_fake_ollama` options, and stops
+    them after the test.
+    """
+    servers: List[FakeOllamaServer] = []
+
+    def start(**options: Any) -> FakeOllamaServer:
+        servers.append(start_fake_ollama(**options))
+        return servers[-1]
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
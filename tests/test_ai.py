@@ -0,0 +1,64 @@
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+from gitlab.exceptions import GitlabGetError
+
+from iamksm_bot.app.ai import GITLAB_BOT_USER_ID, IAMKSM
+
+CHANGES = {"title": "Change"}
+NOT_APPROVED = "💬 Comments\n\n❌ Not Approved"
+APPROVED = "💬 Comments\n\n✅ Approved"
+
+
+def post(mr, response: str, approved_by=(), discussion_id=None):
+    # Posting only needs the merge request, not a configured reviewer
+    approvals = SimpleNamespace(
+        approved_by=[{"user": {"id": user}} for user in approved_by]
+    )
+    return IAMKSM.process_response(
+        IAMKSM.__new__(IAMKSM), mr, response, CHANGES, approvals, discussion_id
+    )
+
+
+def test_first_verdict_opens_a_discussion():
+    mr = MagicMock()
+    mr.discussions.create.return_value.id = "d1"
+
+    assert post(mr, NOT_APPROVED) == "d1"
+    mr.discussions.create.assert_called_once_with({"body": NOT_APPROVED})
+
+
+def test_follow_up_verdict_replies_in_the_previous_discussion():
+    mr = MagicMock()
+
+    assert post(mr, NOT_APPROVED, discussion_id="d1") == "d1"
+    mr.discussions.get.assert_called_once_with("d1", lazy=True)
+    mr.discussions.get.return_value.notes.create.assert_called_once_with(
+        {"body": NOT_APPROVED}
+    )
+    mr.discussions.create.assert_not_called()
+
+
+def test_deleted_discussion_is_replaced():
+    mr = MagicMock()
+    mr.discussions.get.return_value.notes.create.side_effect = GitlabGetError()
+    mr.discussions.create.return_value.id = "d2"
+
+    assert post(mr, NOT_APPROVED, discussion_id="d1") == "d2"
+
+
+def test_approval_resolves_the_previous_discussion():
+    mr = MagicMock()
+
+    assert post(mr, APPROVED, discussion_id="d1") is None
+    mr.discussions.update.assert_called_once_with("d1", {"resolved": True})
+    mr.approve.assert_called_once_with()
+
+
+def test_approval_is_withdrawn_in_the_same_discussion():
+    mr = MagicMock()
+
+    post(mr, NOT_APPROVED, approved_by=[GITLAB_BOT_USER_ID], discussion_id="d1")
+
+    mr.unapprove.assert_called_once_with()
+    mr.discussions.create.assert_not_called()
@@ -0,0 +1,50 @@
+import asyncio
+from typing import Any, Dict, List
+
+import pytest
+
+from iamksm_bot.app import asgi
+from iamksm_bot.config.settings import settings
+
+
+@pytest.fixture
+def app(monkeypatch):
+    settings.load()
+    monkeypatch.setattr(settings, "GITLAB_HEADER_TOKEN", "hook")
+    monkeypatch.setattr(settings, "PROFILE_ADMIN_TOKEN", "admin")
+    monkeypatch.setattr(settings, "REVIEW_QUEUE", "memory")
+    monkeypatch.setattr(settings, "PREWARM_ENABLED", False)
+    return asgi.create_app()
+
+
+def call(app, path: str, body: bytes, headers: Dict[bytes, bytes]) -> int:
+    sent: List[Dict[str, Any]] = []
+    scope: Dict[str, Any] = {
+        "type": "http",
+        "method": "POST",
+        "path": path,
+        "headers": list(headers.items()),
+    }
+
+    async def receive() -> Dict[str, Any]:
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    async def send(message: Dict[str, Any]) -> None:
+        sent.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return sent[0]["status"]
+
+
+@pytest.mark.parametrize("body", [b"{not json", b"[1, 2]", b"", b"{}"])
+def test_webhook_rejects_bodies_that_are_not_merge_request_events(app, body: bytes):
+    assert call(app, "/review-mr", body, {b"x-gitlab-token": b"hook"}) == 400
+
+
+def test_webhook_checks_the_token_first(app):
+    assert call(app, "/review-mr", b"{not json", {b"x-gitlab-token": b"x"}) == 401
+
+
+@pytest.mark.parametrize("body", [b"{not json", b'"arm"'])
+def test_profile_admin_rejects_bodies_that_are_not_json_objects(app, body: bytes):
+    assert call(app, "/admin/profile", body, {b"x-admin-token": b"admin"}) == 400
@@ -0,0 +1,125 @@
+from pathlib import Path
+from threading import Lock
+from types import SimpleNamespace
+from typing import Any, Dict, List, Set, Tuple
+
+from iamksm_bot.app.backfill import (
+    FAILED,
+    REVIEWED,
+    SKIPPED,
+    Backfill,
+    BackfillItem,
+    Checkpoint,
+)
+
+
+def merge_request(project_id: int, iid: int, sha: str, **attributes: Any):
+    values: Dict[str, Any] = {
+        "project_id": project_id,
+        "iid": iid,
+        "sha": sha,
+        "title": f"MR {project_id}!{iid}",
+        "draft": False,
+        "work_in_progress": False,
+        "blocking_discussions_resolved": True,
+        "state": "opened",
+        "labels": [],
+        **attributes,
+    }
+    return SimpleNamespace(project_id=project_id, iid=iid, attributes=values)
+
+
+class Listing:
+    def __init__(self, merge_requests: List[SimpleNamespace]):
+        self.mergerequests = SimpleNamespace(list=lambda **_: iter(merge_requests))
+
+
+class FakeIAMKSM:
+    """
+    Lists the given MRs per group and project and reviews them, failing
+    those in `failing` and skipping those in `skipping`.
+    """
+
+    def __init__(self, groups: Dict[str, List], projects: Dict[str, List]):
+        self.failing: Set[int] = set()
+        self.skipping: Set[int] = set()
+        self.reviewed: List[Tuple[int, int]] = []
+        self._lock = Lock()
+        self.model_pool = SimpleNamespace(capacity=1)
+        self.gl = SimpleNamespace(
+            groups=SimpleNamespace(get=lambda group, lazy: Listing(groups[group])),
+            projects=SimpleNamespace(get=self.get_project),
+        )
+        self.project_listings = projects
+
+    def get_project(self, project: Any, lazy: bool = False):
+        if lazy:
+            return Listing(self.project_listings[project])
+
+        return SimpleNamespace(id=project)
+
+    def review_project_open_merge_request(self, project, mr_iid: int, cancel):
+        with self._lock:
+            self.reviewed.append((project.id, mr_iid))
+
+        if mr_iid in self.failing:
+            raise RuntimeError("The model is down")
+
+        return mr_iid not in self.skipping
+
+
+def test_mrs_listed_by_group_and_project_are_reviewed_once(tmp_path: Path):
+    air = FakeIAMKSM(
+        groups={"group": [merge_request(1, 1, "a"), merge_request(2, 1, "a")]},
+        projects={"1": [merge_request(1, 1, "a"), merge_request(1, 2, "a")]},
+    )
+    backfill = Backfill(air, Checkpoint(tmp_path / "checkpoint.jsonl"))
+
+    items: List[BackfillItem] = backfill.eligible(["group"], ["1"])
+
+    assert [item.ref for item in items] == ["1!1", "1!2", "2!1"]
+
+
+def test_mrs_the_webhook_would_not_review_are_left_out(tmp_path: Path):
+    air = FakeIAMKSM(
+        groups={
+            "group": [merge_request(1, 1, "a"), merge_request(1, 2, "a", draft=True)]
+        },
+        projects={},
+    )
+    backfill = Backfill(air, Checkpoint(tmp_path / "checkpoint.jsonl"))
+
+    assert [item.ref for item in backfill.eligible(["group"], [])] == ["1!1"]
+
+
+def test_resumed_backfills_only_pick_failed_and_pushed_to_mrs(tmp_path: Path):
+    path: Path = tmp_path / "checkpoint.jsonl"
+    listing = [merge_request(1, iid, "a") for iid in (1, 2, 3)]
+    air = FakeIAMKSM(groups={"group": listing}, projects={})
+    air.failing = {2}
+    air.skipping = {3}
+    backfill = Backfill(air, Checkpoint(path))
+
+    stats = backfill.run(backfill.eligible(["group"], []))
+
+    assert stats.outcomes == {REVIEWED: 1, FAILED: 1, SKIPPED: 1}
+
+    # MR 3 was pushed to since, MR 2 failed, MR 1 is done
+    listing[2] = merge_request(1, 3, "b")
+    resumed = Backfill(
+        FakeIAMKSM(groups={"group": listing}, projects={}), Checkpoint(path)
+    )
+
+    assert [item.key for item in resumed.eligible(["group"], [])] == [
+        (1, 2, "a"),
+        (1, 3, "b"),
+    ]
+
+
+def test_checkpoints_survive_a_restart(tmp_path: Path):
+    path: Path = tmp_path / "checkpoint.jsonl"
+    item = BackfillItem(project_id=1, mr_iid=2, sha="a", title="MR")
+    Checkpoint(path).record(item, REVIEWED)
+
+    assert item in Checkpoint(path)
+    assert BackfillItem(1, 2, "b", "MR") not in Checkpoint(path)
@@ -0,0 +1,68 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from iamksm_bot.app.cache import EVICT_INTERVAL, ResponseCache
+
+
+def test_concurrent_puts_of_one_key_all_land(tmp_path: Path):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=60, max_bytes=1 << 20)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(
+            executor.map(
+                lambda number: cache.put("key", f"review {number}", ["1!1"]),
+                range(64),
+            )
+        )
+
+    assert cache.get("key")["response"].startswith("review ")
+    assert not list(tmp_path.glob("*/*.tmp"))
+
+
+def test_expired_responses_are_dropped(tmp_path: Path):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=-1, max_bytes=1 << 20)
+    cache.put("key", "review", [])
+
+    assert cache.get("key") is None
+
+
+def test_hits_on_entries_evicted_meanwhile_are_still_returned(
+    tmp_path: Path, monkeypatch
+):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=60, max_bytes=1 << 20)
+    cache.put("key", "review", [])
+
+    def evicted(path):
+        raise FileNotFoundError(path)
+
+    monkeypatch.setattr(os, "utime", evicted)
+
+    assert cache.get("key")["response"] == "review"
+
+
+def test_puts_walk_the_cache_at_most_once_per_interval(tmp_path: Path, monkeypatch):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=60, max_bytes=1)
+    walks = []
+    monkeypatch.setattr(cache, "evict", lambda: walks.append(1))
+
+    for number in range(10):
+        cache.put(f"key{number}", "review", [])
+
+    assert walks == [1]
+
+    monkeypatch.setattr(cache, "_evicted_at", time.monotonic() - EVICT_INTERVAL)
+    cache.put("key", "review", [])
+
+    assert walks == [1, 1]
+
+
+def test_eviction_keeps_the_cache_within_max_bytes(tmp_path: Path):
+    cache = ResponseCache(str(tmp_path), ttl_seconds=60, max_bytes=1)
+    cache.put("key1", "review", [])
+    cache.put("key2", "review", [])
+
+    cache.evict()
+
+    assert not list(tmp_path.glob("*/*.json"))
@@ -0,0 +1,78 @@
+from typing import Dict, List
+
+from iamksm_bot.app.context import ContextPlanner
+from iamksm_bot.app.depindex import DependencyIndex
+
+
+class CountingContents(dict):
+    def __init__(self, files: Dict[str, str]):
+        super().__init__(files)
+        self.read: List[str] = []
+
+    def __getitem__(self, path: str) -> str:
+        self.read.append(path)
+        return super().__getitem__(path)
+
+
+CHANGES = [
+    {
+        "new_path": "billing/invoice.py",
+        "diff": "@@ -1 +1 @@\n-def total(invoice):\n+def total(invoice, vat_rate):\n",
+    }
+]
+
+
+def repository() -> Dict[str, str]:
+    files: Dict[str, str] = {
+        f"unrelated/module_{number}.py": f"def helper_{number}():\n    pass\n"
+        for number in range(50)
+    }
+    files.update(
+        {
+            "billing/invoice.py": "def total(invoice):\n    return 0\n",
+            "billing/tax.py": "def vat_rate(country):\n    return 0.2\n",
+            "reports/summary.py": "from billing.invoice import total\n",
+        }
+    )
+    return files
+
+
+def test_rank_only_reads_the_shortlist():
+    contents = CountingContents(repository())
+    planner = ContextPlanner(token_budget=1000, shortlist_size=5)
+
+    ranking = planner.rank(contents, CHANGES, related={"reports/summary.py"})
+
+    assert len(contents.read) == 5
+    assert [path for _, path in ranking][:2] == ["reports/summary.py", "billing/tax.py"]
+
+
+def test_mentions_shortlist_files_far_from_the_diff():
+    contents = CountingContents(repository())
+    contents["shared/rates.py"] = "def vat_rate(country):\n    return 0.2\n"
+    planner = ContextPlanner(token_budget=1000, shortlist_size=3)
+
+    ranking = planner.rank(contents, CHANGES, mentions={"shared/rates.py"})
+
+    assert "shared/rates.py" in [path for _, path in ranking]
+
+
+def test_defining_leaves_out_generic_symbols(tmp_path):
+    index = DependencyIndex(tmp_path / "deps.json")
+    index.update(
+        {
+            "billing/tax.py": "def vat_rate(country):\n    return 0.2\n",
+            **{f"m{n}.py": "def run():\n    pass\n" for n in range(5)},
+        }
+    )
+
+    assert index.defining(["vat_rate", "run", "missing"]) == {"billing/tax.py"}
+
+
+def test_plan_keeps_the_changed_files_out():
+    planner = ContextPlanner(token_budget=1000)
+
+    plan = planner.plan(repository(), {"changes": CHANGES})
+
+    assert "billing/invoice.py" not in plan.files
+    assert "billing/tax.py" in plan.files
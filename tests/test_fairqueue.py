@@ -0,0 +1,128 @@
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+from iamksm_bot.app.fairqueue import (
+    BacklogFull,
+    FairQueue,
+    ProjectPolicy,
+    SchedulingPolicy,
+)
+
+
+def config(**overrides) -> SimpleNamespace:
+    values = dict(
+        REVIEW_PROJECT_MAX_CONCURRENT=0,
+        REVIEW_PROJECT_MAX_BACKLOG=0,
+        REVIEW_MAX_BACKLOG=0,
+        REVIEW_PROJECTS=[],
+    )
+    return SimpleNamespace(**{**values, **overrides})
+
+
+def drain(queue: FairQueue) -> List[str]:
+    taken: List[str] = []
+
+    while (item := queue.pop()) is not None:
+        taken.append(item)
+
+    return taken
+
+
+@pytest.mark.parametrize("weight", [0, -1])
+def test_projects_without_a_positive_weight_are_rejected(weight: float):
+    projects = [{"project_id": 7, "weight": weight}]
+
+    with pytest.raises(ValueError, match="Project 7"):
+        SchedulingPolicy.from_settings(config(REVIEW_PROJECTS=projects))
+
+
+def test_project_settings_override_the_defaults():
+    policy = SchedulingPolicy.from_settings(
+        config(
+            REVIEW_PROJECT_MAX_BACKLOG=5,
+            REVIEW_PROJECTS=[{"project_id": "7", "weight": 3, "max_concurrent": 2}],
+        )
+    )
+
+    assert policy.project(7) == ProjectPolicy(3.0, 2, 5)
+    assert policy.project(8) == ProjectPolicy(1.0, 0, 5)
+
+
+def test_busy_projects_take_turns_by_weight():
+    queue: FairQueue[str] = FairQueue(
+        SchedulingPolicy(projects={1: ProjectPolicy(weight=2)})
+    )
+
+    for number in range(4):
+        queue.push(1, f"a{number}")
+        queue.push(2, f"b{number}")
+
+    assert drain(queue)[:6] == ["a0", "b0", "a1", "b1", "a2", "a3"]
+
+
+def test_idle_projects_cannot_bank_turns():
+    queue: FairQueue[str] = FairQueue(SchedulingPolicy())
+
+    for number in range(3):
+        queue.push(1, f"a{number}")
+
+    for item in drain(queue):
+        queue.finished(1)
+
+    queue.push(1, "a3")
+    queue.push(1, "a4")
+    queue.push(2, "b0")
+    queue.push(2, "b1")
+
+    # Project 2 starts at the clock, not with the three turns it missed
+    assert drain(queue) == ["b0", "a3", "b1", "a4"]
+
+
+def test_projects_at_max_concurrent_are_skipped_until_one_finishes():
+    queue: FairQueue[str] = FairQueue(
+        SchedulingPolicy(projects={1: ProjectPolicy(max_concurrent=1)})
+    )
+    queue.push(1, "a0")
+    queue.push(1, "a1")
+    queue.push(2, "b0")
+
+    assert drain(queue) == ["a0", "b0"]
+
+    queue.finished(1)
+
+    assert queue.pop() == "a1"
+
+
+def test_priority_reviews_come_first():
+    queue: FairQueue[str] = FairQueue(SchedulingPolicy())
+    queue.push(1, "a0")
+    queue.push(2, "b0")
+    queue.push(2, "b1", priority=1)
+
+    assert drain(queue) == ["b1", "a0", "b0"]
+
+
+def test_removed_reviews_are_not_taken():
+    queue: FairQueue[str] = FairQueue(SchedulingPolicy())
+    item = "a0"
+    queue.push(1, item)
+
+    assert queue.remove(1, item)
+    assert queue.pop() is None
+    assert len(queue) == 0
+
+
+def test_full_backlogs_answer_503_and_full_projects_429():
+    policy = SchedulingPolicy(default=ProjectPolicy(max_backlog=2), max_backlog=3)
+
+    with pytest.raises(BacklogFull) as everyone:
+        policy.admit(1, backlog=3, project_backlog=0)
+
+    with pytest.raises(BacklogFull) as project:
+        policy.admit(1, backlog=2, project_backlog=2)
+
+    policy.admit(2, backlog=2, project_backlog=0)
+    assert everyone.value.status == 503
+    assert project.value.status == 429
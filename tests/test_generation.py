@@ -0,0 +1,145 @@
+import asyncio
+import time
+from threading import Event
+from typing import Any, Dict, Iterator, List
+
+import pytest
+
+from iamksm_bot.app.generation import (
+    GenerationTimeout,
+    astream_generate,
+    stream_generate,
+)
+from iamksm_bot.app.scheduler import ReviewCancelled
+
+DONE = {
+    "response": "",
+    "done": True,
+    "done_reason": "stop",
+    "prompt_eval_count": 100,
+    "prompt_eval_duration": 2e9,
+    "eval_count": 3,
+    "eval_duration": 1e9,
+}
+
+
+class Stream:
+    """
+    Yields `chunks`, waiting `delay` seconds before each, and records
+    whether it was closed.
+    """
+
+    def __init__(self, chunks: List[Dict[str, Any]], delay: float = 0.0):
+        self.chunks = chunks
+        self.delay = delay
+        self.closed = False
+        self.sent = 0
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for chunk in self.chunks:
+            time.sleep(self.delay)
+            self.sent += 1
+            yield chunk
+
+    def close(self) -> None:
+        self.closed = True
+
+    async def __aiter__(self):
+        for chunk in self.chunks:
+            await asyncio.sleep(self.delay)
+            self.sent += 1
+            yield chunk
+
+    async def aclose(self) -> None:
+        self.closed = True
+
+
+class Client:
+    def __init__(self, stream: Stream):
+        self.stream = stream
+        self.options: Dict[str, Any] = {}
+
+    def generate(self, options: Dict[str, Any], **kwargs: Any) -> Stream:
+        self.options = options
+        return self.stream
+
+
+class AsyncClient(Client):
+    async def generate(self, options: Dict[str, Any], **kwargs: Any) -> Stream:
+        return super().generate(options, **kwargs)
+
+
+def tokens(count: int) -> List[Dict[str, Any]]:
+    return [{"response": f"t{number} ", "done": False} for number in range(count)]
+
+
+def generate(client: Client, **overrides: Any):
+    arguments: Dict[str, Any] = dict(
+        model="m", prompt="p", system="s", options={"temperature": 0}
+    )
+    arguments.update({"timeout": 5.0, "max_tokens": 100, **overrides})
+    return stream_generate(client, **arguments)
+
+
+def test_completions_report_ollama_throughput():
+    client = Client(Stream(tokens(3) + [DONE]))
+
+    text, stats = generate(client)
+
+    assert text == "t0 t1 t2 "
+    assert client.options == {"temperature": 0, "num_predict": 100}
+    assert client.stream.closed
+    assert stats.prompt_tokens_per_second == 50.0
+    assert stats.eval_tokens_per_second == 3.0
+    assert not stats.truncated
+
+
+def test_generation_stops_at_the_token_cap_of_servers_ignoring_it():
+    client = Client(Stream(tokens(50)))
+
+    text, stats = generate(client, max_tokens=5)
+
+    assert client.stream.sent == 6
+    assert client.stream.closed
+    assert stats.truncated
+    assert stats.eval_tokens == 6
+
+
+def test_slow_generations_time_out_and_close_the_stream():
+    client = Client(Stream(tokens(50), delay=0.02))
+
+    with pytest.raises(GenerationTimeout):
+        generate(client, timeout=0.05)
+
+    assert client.stream.closed
+    assert client.stream.sent < 50
+
+
+def test_superseded_reviews_stop_generating():
+    cancel = Event()
+    cancel.set()
+    client = Client(Stream(tokens(50)))
+
+    with pytest.raises(ReviewCancelled):
+        generate(client, cancel=cancel)
+
+    assert client.stream.sent == 1
+    assert client.stream.closed
+
+
+def test_async_generation_enforces_the_same_limits():
+    capped = AsyncClient(Stream(tokens(50)))
+    slow = AsyncClient(Stream(tokens(50), delay=0.02))
+    arguments: Dict[str, Any] = dict(model="m", prompt="p", system="s", options={})
+
+    text, stats = asyncio.run(
+        astream_generate(capped, timeout=5.0, max_tokens=5, **arguments)
+    )
+
+    assert capped.stream.sent == 6 and capped.stream.closed
+    assert stats.truncated
+
+    with pytest.raises(GenerationTimeout):
+        asyncio.run(astream_generate(slow, timeout=0.05, max_tokens=100, **arguments))
+
+    assert slow.stream.closed
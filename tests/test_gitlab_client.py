@@ -0,0 +1,120 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List
+
+import gitlab
+import pytest
+import requests
+
+from iamksm_bot.app.gitlab_client import (
+    RateLimitedSession,
+    create_gitlab,
+    header_number,
+    retry_delay,
+)
+
+
+class FlakyGitLab(ThreadingHTTPServer):
+    """
+    Answers 429, with the rate limit headers in `headers`, to the first
+    `failures` requests and 200 to the others.
+    """
+
+    def __init__(self, failures: int, headers: Dict[str, str]):
+        super().__init__(("127.0.0.1", 0), FlakyHandler)
+        self.failures = failures
+        self.headers = headers
+        self.requests: List[str] = []
+
+
+class FlakyHandler(BaseHTTPRequestHandler):
+    server: FlakyGitLab
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests.append(self.path)
+        failed: bool = len(self.server.requests) <= self.server.failures
+        body: bytes = json.dumps({"id": 1}).encode()
+        self.send_response(429 if failed else 200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+
+        for name, value in self.server.headers.items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def flaky():
+    servers: List[FlakyGitLab] = []
+
+    def start(failures: int, headers: Dict[str, str] = None) -> FlakyGitLab:
+        servers.append(FlakyGitLab(failures, headers or {"Retry-After": "0"}))
+        threading.Thread(target=servers[-1].serve_forever, daemon=True).start()
+        return servers[-1]
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def client(server: FlakyGitLab, max_retries: int) -> gitlab.Gitlab:
+    gl = create_gitlab(f"http://127.0.0.1:{server.server_address[1]}", "token", 2)
+    gl.session.max_retries = max_retries
+    return gl
+
+
+def test_rate_limited_requests_are_retried_once_by_the_session(flaky):
+    server = flaky(failures=10)
+
+    with pytest.raises(gitlab.GitlabHttpError):
+        client(server, max_retries=2).http_get("/projects/1")
+
+    assert len(server.requests) == 3
+
+
+def test_session_retries_until_gitlab_answers(flaky):
+    server = flaky(failures=2)
+
+    assert client(server, max_retries=2).http_get("/projects/1") == {"id": 1}
+    assert len(server.requests) == 3
+
+
+def test_malformed_rate_limit_headers_are_ignored(flaky):
+    server = flaky(
+        failures=1,
+        headers={
+            "Retry-After": "soon",
+            "RateLimit-Remaining": "a few",
+            "RateLimit-Reset": "",
+        },
+    )
+    gl = client(server, max_retries=1)
+    gl.session.backoff = 0
+
+    assert gl.http_get("/projects/1") == {"id": 1}
+
+
+def test_low_remaining_requests_are_paced():
+    session = RateLimitedSession(pool_size=1, min_remaining=10)
+    response = requests.Response()
+    response.headers["RateLimit-Remaining"] = "2"
+    response.headers["RateLimit-Reset"] = str(time.time() + 10)
+
+    session.observe(response)
+
+    assert session._resume_at - time.monotonic() == pytest.approx(5, abs=0.5)
+
+
+def test_retry_delay_falls_back_to_backoff():
+    assert header_number({"RateLimit-Remaining": "5.0"}, "RateLimit-Remaining") == 5
+    assert retry_delay({"Retry-After": "-3"}, attempt=0, backoff=1) == 0
+    assert retry_delay({"Retry-After": "soon"}, attempt=2, backoff=0.5) == 2
@@ -0,0 +1,47 @@
+import zipfile
+from pathlib import Path
+
+from iamksm_bot.app.context import ContextPlanner
+from iamksm_bot.app.ingest import ArchiveContents, IngestFilter
+
+FILES = {
+    "project-abc/app/main.py": b"def main():\n    return 0\n",
+    "project-abc/app/huge.py": b"x = 1\n" * 1000,
+    "project-abc/data/blob.dat": b"header\0binary",
+    "project-abc/vendor/lib.py": b"def vendored():\n    pass\n",
+    "project-abc/.gitattributes": b"vendor/** linguist-vendored\n",
+}
+
+
+def archive(tmp_path: Path) -> Path:
+    path: Path = tmp_path / "archive.zip"
+
+    with zipfile.ZipFile(path, "w") as archive:
+        for name, content in FILES.items():
+            archive.writestr(name, content)
+
+    return path
+
+
+def test_archive_contents_skip_filtered_files(tmp_path: Path):
+    contents = ArchiveContents(archive(tmp_path), IngestFilter(max_file_bytes=1000))
+
+    assert list(contents) == ["app/main.py"]
+    assert len(contents) == 1
+    assert contents["app/main.py"] == FILES["project-abc/app/main.py"].decode()
+
+
+def test_binaries_never_reach_the_context_plan(tmp_path: Path):
+    path: Path = tmp_path / "archive.zip"
+
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("project-abc/app/foo.py", "def foo():\n    return 1\n")
+        archive.writestr("project-abc/app/data.bin2", b"\x89\0\x01" * 100)
+
+    contents = ArchiveContents(path, IngestFilter(max_file_bytes=1000))
+    changes = {"changes": [{"new_path": "app/bar.py", "diff": "+foo()\n"}]}
+
+    plan = ContextPlanner(token_budget=1000).plan(contents, changes)
+
+    assert list(plan.files) == ["app/foo.py"]
+    assert list(contents) == ["app/foo.py"]
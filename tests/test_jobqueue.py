@@ -0,0 +1,67 @@
+import sqlite3
+import time
+from pathlib import Path
+
+from iamksm_bot.app.jobqueue import FAIR_SHARE_WINDOW, JobQueue
+
+
+def queue(tmp_path: Path) -> JobQueue:
+    return JobQueue(
+        str(tmp_path / "jobs.sqlite3"), visibility_timeout=60, max_attempts=3
+    )
+
+
+def age(queue: JobQueue, seconds: float) -> None:
+    with sqlite3.connect(queue.path) as db:
+        db.execute("UPDATE jobs SET updated_at = updated_at - ?", (seconds,))
+
+
+def states(queue: JobQueue) -> list:
+    with sqlite3.connect(queue.path) as db:
+        return sorted(row[0] for row in db.execute("SELECT state FROM jobs"))
+
+
+def test_purge_deletes_old_finished_jobs(tmp_path: Path):
+    jobs = queue(tmp_path)
+    jobs.enqueue(1, 1, "a")
+    jobs.complete(jobs.lease("worker"))
+    jobs.enqueue(1, 2, "a")
+    jobs.enqueue(1, 2, "b")
+    jobs.enqueue(1, 3, "a")
+    age(jobs, 2 * FAIR_SHARE_WINDOW)
+
+    assert jobs.purge(retention=60) == 2
+    assert states(jobs) == ["queued", "queued"]
+
+
+def test_purge_keeps_jobs_within_retention(tmp_path: Path):
+    jobs = queue(tmp_path)
+    jobs.enqueue(1, 1, "a")
+    jobs.complete(jobs.lease("worker"))
+    age(jobs, FAIR_SHARE_WINDOW / 2)
+
+    # Jobs leased within the fair share window are kept whatever the retention
+    assert jobs.purge(retention=0) == 0
+    assert states(jobs) == ["done"]
+
+
+def test_indexes_are_created_on_queues_predating_leased_at(tmp_path: Path):
+    path: Path = tmp_path / "jobs.sqlite3"
+
+    with sqlite3.connect(path) as db:
+        db.execute(
+            "CREATE TABLE jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "project_id INTEGER NOT NULL, mr_iid INTEGER NOT NULL, sha TEXT, "
+            "state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0, "
+            "available_at REAL NOT NULL, leased_until REAL, lease_owner TEXT, "
+            "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+
+    jobs = JobQueue(str(path), visibility_timeout=60, max_attempts=3)
+
+    with sqlite3.connect(path) as db:
+        indexes = {row[0] for row in db.execute("SELECT name FROM sqlite_master")}
+
+    assert {"jobs_expired", "jobs_leased_at", "jobs_finished"} <= indexes
+    assert jobs.enqueue(1, 1, "a") is not None
+    assert jobs.lease("worker").created_at <= time.time()
@@ -0,0 +1,58 @@
+from typing import Any, Dict, List
+
+from iamksm_bot.app.context import estimate_tokens
+from iamksm_bot.app.mapreduce import diff_tokens, split_change, split_review_units
+
+
+def hunk(start: int, lines: int) -> str:
+    body: str = "".join(f"+line {number}\n" for number in range(lines))
+    return f"@@ -{start},0 +{start},{lines} @@\n{body}"
+
+
+def change(path: str, *hunks: str) -> Dict[str, Any]:
+    return {"new_path": path, "diff": "".join(hunks)}
+
+
+def paths(unit: List[Dict[str, Any]]) -> List[str]:
+    return [part["new_path"] for part in unit]
+
+
+def test_small_files_are_packed_together_in_path_order():
+    changes = [change(f"{name}.py", hunk(1, 2)) for name in "cba"]
+
+    units = split_review_units(changes, unit_tokens=1000)
+
+    assert [paths(unit) for unit in units] == [["a.py", "b.py", "c.py"]]
+
+
+def test_files_move_to_a_new_unit_once_one_is_full():
+    changes = [change(f"{name}.py", hunk(1, 20)) for name in "abc"]
+    budget: int = diff_tokens(changes[:2])
+
+    units = split_review_units(changes, unit_tokens=budget)
+
+    assert [paths(unit) for unit in units] == [["a.py", "b.py"], ["c.py"]]
+
+
+def test_large_files_are_split_by_hunks_without_losing_any():
+    hunks: List[str] = [hunk(start, 20) for start in (1, 100, 200, 300)]
+    large = change("big.py", *hunks)
+
+    parts = split_change(large, unit_tokens=estimate_tokens(hunks[0]) + 1)
+    units = split_review_units([large], unit_tokens=estimate_tokens(hunks[0]) + 1)
+
+    assert [part["diff"] for part in parts] == hunks
+    assert len(units) == 4
+    assert "".join(part["diff"] for unit in units for part in unit) == large["diff"]
+
+
+def test_hunks_larger_than_a_unit_stay_whole():
+    large = change("big.py", hunk(1, 200))
+
+    assert split_change(large, unit_tokens=10) == [large]
+
+
+def test_changes_without_a_diff_still_get_reviewed():
+    renamed = {"new_path": "moved.py", "old_path": "old.py", "renamed_file": True}
+
+    assert split_review_units([renamed], unit_tokens=100) == [[renamed]]
@@ -0,0 +1,35 @@
+import urllib.error
+import urllib.request
+
+import pytest
+
+from iamksm_bot.app.metrics import REVIEWS, Counter, Metric, serve_metrics
+
+
+def test_metric_needs_samples():
+    with pytest.raises(TypeError):
+        Metric("iamksm_test", "Abstract")
+
+    counter = Counter("iamksm_test_total", "Things", ("kind",))
+    counter.inc(kind="a")
+
+    assert counter.render()[-1] == 'iamksm_test_total{kind="a"} 1.0'
+
+
+def test_serve_metrics_exposes_the_registry():
+    server = serve_metrics(0, host="127.0.0.1")
+    url: str = f"http://127.0.0.1:{server.server_address[1]}"
+    REVIEWS.inc(outcome="done")
+
+    try:
+        with urllib.request.urlopen(f"{url}/metrics") as response:
+            body: str = response.read().decode()
+
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(f"{url}/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert response.headers["Content-Type"].startswith("text/plain")
+    assert 'iamksm_reviews_total{outcome="done"}' in body
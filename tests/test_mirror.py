@@ -0,0 +1,121 @@
+import subprocess
+from pathlib import Path
+from typing import Dict, List
+
+import pytest
+
+from iamksm_bot.app import mirror
+from iamksm_bot.app.ingest import IngestFilter
+from iamksm_bot.app.mirror import GitMirror, GitMirrorError
+
+FILES: Dict[str, bytes] = {
+    "app/main.py": b"def main():\n    return 0\n",
+    "app/large.py": b"x = 1\n" * 1000,
+    "docs/logo.png": b"\x89PNG not really",
+    "data/blob.dat": b"header\0binary",
+    "package-lock.json": b"{}",
+    "vendor/lib.py": b"def vendored():\n    pass\n",
+    "generated/api.py": b"def generated():\n    pass\n",
+    ".gitattributes": b"vendor/** linguist-vendored\n",
+    "generated/.gitattributes": b"*.py linguist-generated\n",
+    "README.md": b"# Project\n",
+}
+
+INGEST_FILTER = IngestFilter(
+    max_file_bytes=1000,
+    skip_extensions=(".png",),
+    denylist=("package-lock.json",),
+)
+
+
+def git(cwd: Path, *args: str) -> str:
+    result = subprocess.run(
+        ["git", *args], cwd=cwd, capture_output=True, check=True, text=True
+    )
+    return result.stdout.strip()
+
+
+@pytest.fixture
+def remote(tmp_path: Path) -> Path:
+    path: Path = tmp_path / "remote"
+    path.mkdir()
+    git(path, "init", "--quiet", "--initial-branch=main")
+
+    for name, content in FILES.items():
+        (path / name).parent.mkdir(parents=True, exist_ok=True)
+        (path / name).write_bytes(content)
+
+    git(path, "add", "--all")
+    git(
+        path,
+        "-c",
+        "user.name=Test",
+        "-c",
+        "user.email=test@example.com",
+        "commit",
+        "--quiet",
+        "--message=Initial commit",
+    )
+    return path
+
+
+@pytest.fixture
+def local(tmp_path: Path, remote: Path) -> GitMirror:
+    return GitMirror(tmp_path / "mirror.git", f"file://{remote}", token="secret")
+
+
+def test_fetch_and_read_tree_from_a_file_remote(local: GitMirror, remote: Path):
+    sha: str = git(remote, "rev-parse", "HEAD")
+
+    local.fetch(refs=("refs/heads/main",), wanted=(sha,))
+
+    assert local.has_commits([sha])
+    assert local.read_tree(sha) == {
+        path: content.decode()
+        for path, content in FILES.items()
+        if path not in ("docs/logo.png", ".gitattributes", "generated/.gitattributes")
+    }
+
+
+def test_read_tree_applies_the_ingest_filter(local: GitMirror, remote: Path):
+    sha: str = git(remote, "rev-parse", "HEAD")
+    local.fetch(refs=("refs/heads/main",))
+
+    files: Dict[str, str] = local.read_tree(sha, INGEST_FILTER)
+
+    assert sorted(files) == ["README.md", "app/main.py"]
+
+
+def test_read_files_skips_missing_paths(local: GitMirror, remote: Path):
+    sha: str = git(remote, "rev-parse", "HEAD")
+    local.fetch(refs=("refs/heads/main",))
+
+    assert local.read_files(sha, ["app/main.py", "missing.py"]) == {
+        "app/main.py": FILES["app/main.py"].decode()
+    }
+
+
+def test_token_stays_out_of_the_command_line(local: GitMirror, monkeypatch):
+    commands: List[List[str]] = []
+    run = subprocess.run
+
+    def record(command, **kwargs):
+        commands.append(command)
+
+        if "fetch" in command:
+            assert "Authorization: Basic" in kwargs["env"]["GIT_CONFIG_VALUE_0"]
+
+        return run(command, **kwargs)
+
+    monkeypatch.setattr(mirror.subprocess, "run", record)
+    local.fetch(refs=("refs/heads/main",))
+
+    assert any("fetch" in command for command in commands)
+    assert not any(
+        "secret" in arg or "extraHeader" in arg for c in commands for arg in c
+    )
+
+
+def test_fetch_of_an_unknown_ref_raises(local: GitMirror):
+    with pytest.raises(GitMirrorError):
+        local.fetch(refs=("refs/heads/missing",))
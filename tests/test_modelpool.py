@@ -0,0 +1,134 @@
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List
+
+import pytest
+
+from iamksm_bot.app.modelpool import (
+    ModelPool,
+    ModelRule,
+    NoHealthyEndpoint,
+    select_model,
+)
+from tests.conftest import server_url
+
+# Generations stream 5 tokens at 50 per second, about 0.1s each
+SLOW = dict(tokens_per_second=50, response_tokens=5)
+FAST = dict(tokens_per_second=1000, response_tokens=5)
+
+
+def generate(pool: ModelPool, model: str = "fake") -> str:
+    response, _ = pool.generate(
+        model=model,
+        prompt="Review this",
+        system="You review code",
+        options={},
+        timeout=10,
+        max_tokens=50,
+    )
+    return response
+
+
+def closed_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def endpoint(url: str, concurrency: int = 1) -> Dict[str, Any]:
+    return {"host": url, "concurrency": concurrency}
+
+
+def test_generations_go_to_the_least_loaded_endpoint(fake_ollama):
+    wide = fake_ollama(parallel=3, **SLOW)
+    narrow = fake_ollama(parallel=1, **SLOW)
+    pool = ModelPool(
+        [endpoint(server_url(narrow), 1), endpoint(server_url(wide), 3)], timeout=10
+    )
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        responses: List[str] = list(executor.map(lambda _: generate(pool), range(4)))
+
+    assert all("Approved" in response for response in responses)
+    assert (wide.generations, narrow.generations) == (3, 1)
+    assert all(e.in_flight == 0 and e.queued == 0 for e in pool.endpoints)
+
+
+def test_fails_over_from_an_unreachable_endpoint(fake_ollama):
+    server = fake_ollama(**FAST)
+    pool = ModelPool(
+        [endpoint(f"http://127.0.0.1:{closed_port()}"), endpoint(server_url(server))],
+        timeout=10,
+        health_interval=3600,
+    )
+    # Skip the health checks, so the first generation tries the dead endpoint
+    for member in pool.endpoints:
+        member.checked_at = float("inf")
+
+    pool.endpoints[1].in_flight = 1
+    assert "Approved" in generate(pool)
+
+    assert not pool.endpoints[0].healthy
+    assert server.generations == 1
+
+
+def test_unhealthy_endpoint_recovers_after_a_health_check(fake_ollama):
+    port: int = closed_port()
+    backup = fake_ollama(**FAST)
+    pool = ModelPool(
+        [endpoint(f"http://127.0.0.1:{port}"), endpoint(server_url(backup))],
+        timeout=10,
+        health_interval=0,
+    )
+
+    generate(pool)
+    assert not pool.endpoints[0].healthy
+    assert backup.generations == 1
+
+    recovered = fake_ollama(port=port, **FAST)
+    pool.endpoints[1].in_flight = 1
+    generate(pool)
+
+    assert pool.endpoints[0].healthy
+    assert recovered.generations == 1
+
+
+def test_generations_go_to_endpoints_serving_the_model(fake_ollama):
+    small = fake_ollama(models=["small:latest"], **FAST)
+    large = fake_ollama(models=["large:latest"], **FAST)
+    pool = ModelPool(
+        [endpoint(server_url(small)), endpoint(server_url(large))], timeout=10
+    )
+
+    for _ in range(3):
+        generate(pool, model="large")
+
+    assert (small.generations, large.generations) == (0, 3)
+
+
+def test_every_endpoint_down_raises(fake_ollama):
+    pool = ModelPool([endpoint(f"http://127.0.0.1:{closed_port()}")], timeout=10)
+
+    with pytest.raises(NoHealthyEndpoint):
+        generate(pool)
+
+
+RULES: List[ModelRule] = [
+    ModelRule.from_config({"model": "security", "labels": ["security"]}),
+    ModelRule.from_config({"model": "small", "max_diff_tokens": 500}),
+    ModelRule.from_config({"model": "large", "min_diff_tokens": 4000}),
+]
+
+
+@pytest.mark.parametrize(
+    "tokens, labels, model",
+    [
+        (100, [], "small"),
+        (100, ["security"], "security"),
+        (5000, ["docs"], "large"),
+        (1000, [], "default"),
+        (500, [], "small"),
+    ],
+)
+def test_select_model_picks_the_first_matching_rule(tokens, labels, model):
+    assert select_model(RULES, "default", tokens, labels) == model
@@ -0,0 +1,110 @@
+import time
+from threading import Event
+from types import SimpleNamespace
+from typing import Callable, List, Tuple
+
+import pytest
+
+from iamksm_bot.app import ai, prewarm
+from iamksm_bot.app.ai import IAMKSM
+from iamksm_bot.app.prewarm import Prewarmer
+
+
+class Recorder:
+    def __init__(self):
+        self.free = Event()
+        self.calls: List[Tuple[int, str, str]] = []
+
+    def prewarm(self, project_id: int, branch: str, sha: str) -> bool:
+        self.calls.append((project_id, branch, sha))
+        return True
+
+    def busy(self) -> bool:
+        return not self.free.is_set()
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5.0) -> None:
+    deadline: float = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+@pytest.fixture(autouse=True)
+def fast_polling(monkeypatch):
+    monkeypatch.setattr(prewarm, "BUSY_POLL_SECONDS", 0.01)
+
+
+def test_nothing_is_built_while_review_slots_are_busy():
+    recorder = Recorder()
+    prewarmer = Prewarmer(recorder.prewarm, recorder.busy, max_pending=4)
+    prewarmer.submit(1, "main", "a")
+
+    time.sleep(0.1)
+    assert recorder.calls == []
+    assert prewarmer.depth() == 1
+
+    recorder.free.set()
+    wait_for(lambda: recorder.calls == [(1, "main", "a")])
+
+
+def test_newer_pushes_replace_the_waiting_one_of_their_branch():
+    recorder = Recorder()
+    prewarmer = Prewarmer(recorder.prewarm, recorder.busy, max_pending=4)
+    prewarmer.submit(1, "main", "a")
+    prewarmer.submit(1, "dev", "b")
+    prewarmer.submit(1, "main", "c")
+
+    assert prewarmer.depth() == 2
+
+    recorder.free.set()
+    wait_for(lambda: len(recorder.calls) == 2)
+    assert recorder.calls == [(1, "dev", "b"), (1, "main", "c")]
+
+
+def test_the_oldest_pushes_are_dropped_past_max_pending():
+    recorder = Recorder()
+    prewarmer = Prewarmer(recorder.prewarm, recorder.busy, max_pending=2)
+
+    for number, branch in enumerate(["a", "b", "c"]):
+        prewarmer.submit(1, branch, str(number))
+
+    assert prewarmer.depth() == 2
+
+    recorder.free.set()
+    wait_for(lambda: len(recorder.calls) == 2)
+    assert recorder.calls == [(1, "b", "1"), (1, "c", "2")]
+
+
+def test_failed_builds_do_not_stop_the_prewarmer():
+    recorder = Recorder()
+    recorder.free.set()
+
+    def flaky(project_id: int, branch: str, sha: str) -> bool:
+        if branch == "broken":
+            raise RuntimeError("GitLab is down")
+
+        return recorder.prewarm(project_id, branch, sha)
+
+    prewarmer = Prewarmer(flaky, recorder.busy, max_pending=4)
+    prewarmer.submit(1, "broken", "a")
+    prewarmer.submit(1, "main", "b")
+
+    wait_for(lambda: recorder.calls == [(1, "main", "b")])
+
+
+@pytest.mark.parametrize(
+    "branch, expected",
+    [("main", True), ("release/1.0", True), ("protected", True), ("feature", False)],
+)
+def test_only_branches_mrs_target_are_prewarmed(monkeypatch, branch, expected):
+    monkeypatch.setattr(ai, "PREWARM_BRANCHES", ["release/*"])
+    project = SimpleNamespace(
+        default_branch="main",
+        branches=SimpleNamespace(
+            get=lambda name: SimpleNamespace(protected=name == "protected")
+        ),
+    )
+
+    assert IAMKSM.should_prewarm(IAMKSM.__new__(IAMKSM), project, branch) is expected
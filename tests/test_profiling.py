@@ -0,0 +1,104 @@
+import re
+import time
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from iamksm_bot.app import profiling
+from iamksm_bot.app.profiling import (
+    PROFILE,
+    ProfileRequest,
+    arm,
+    armed,
+    claim,
+    disarm,
+    frame_name,
+    profile_command,
+    profile_review,
+)
+from iamksm_bot.config.settings import settings
+
+FOLDED_LINE = re.compile(r"^\S.*(;.+)* \d+$")
+
+
+@pytest.fixture
+def profile_dir(monkeypatch, tmp_path: Path) -> str:
+    settings.load()
+    monkeypatch.setattr(settings, "PROFILE_DIR", str(tmp_path))
+    return str(tmp_path)
+
+
+def test_armed_profiles_count_down_across_claims(tmp_path: Path):
+    arm(str(tmp_path), ProfileRequest(reviews=2, interval=0.01))
+
+    assert claim(str(tmp_path)).reviews == 2
+    assert armed(str(tmp_path)).reviews == 1
+    assert claim(str(tmp_path)).reviews == 1
+    assert armed(str(tmp_path)) is None
+    assert claim(str(tmp_path)) is None
+
+
+def test_disarming_drops_the_remaining_reviews(tmp_path: Path):
+    arm(str(tmp_path), ProfileRequest(reviews=3, interval=0.01))
+    disarm(str(tmp_path))
+
+    assert claim(str(tmp_path)) is None
+
+
+@pytest.mark.parametrize("reviews, interval", [(0, 0.01), (1, 0)])
+def test_invalid_requests_are_not_armed(tmp_path: Path, reviews, interval):
+    with pytest.raises(ValueError):
+        arm(str(tmp_path), ProfileRequest(reviews=reviews, interval=interval))
+
+    assert armed(str(tmp_path)) is None
+
+
+def test_frame_names_never_split_collapsed_stacks():
+    assert frame_name("a;b.py", "run", 3) == "run (a:b.py:3)"
+
+
+def test_profiled_reviews_write_folded_stacks(profile_dir: str):
+    profile_command("POST", {"reviews": 1, "interval": 0.005, "memory": True})
+
+    with profile_review("1!2"):
+        PROFILE.get().stage("fetch", 0.0)
+        blocks: List[bytes] = [bytes(1024) for _ in range(100)]
+        time.sleep(0.1)
+        PROFILE.get().stage("generate", 0.1)
+
+    assert blocks
+    assert PROFILE.get() is None
+    cpu: List[Path] = list(Path(profile_dir).glob("*-1_2.cpu.folded"))
+    memory: List[Path] = list(Path(profile_dir).glob("*-1_2.memory.folded"))
+    report: List[Path] = list(Path(profile_dir).glob("*-1_2.memory.txt"))
+    assert len(cpu) == len(memory) == len(report) == 1
+
+    cpu_lines: List[str] = cpu[0].read_text().splitlines()
+    assert cpu_lines and all(FOLDED_LINE.match(line) for line in cpu_lines)
+    assert any(line.startswith("MainThread;") for line in cpu_lines)
+
+    memory_lines: List[str] = memory[0].read_text().splitlines()
+    assert all(FOLDED_LINE.match(line) for line in memory_lines)
+    assert any(line.startswith("generate;") for line in memory_lines)
+    assert "generate took" in report[0].read_text()
+
+
+def test_reviews_are_not_profiled_once_the_count_is_used(profile_dir: str):
+    profile_command("POST", {"reviews": 1, "interval": 0.005})
+
+    with profile_review("1!2"):
+        assert PROFILE.get() is not None
+
+    with profile_review("1!3"):
+        assert PROFILE.get() is None
+
+    assert profile_command("GET", {})["armed"] is None
+    assert not list(Path(profile_dir).glob("*-1_3.*"))
+
+
+def test_nothing_is_profiled_unless_armed(profile_dir: str, monkeypatch):
+    monkeypatch.setattr(profiling, "ReviewProfile", lambda *args: 1 / 0)
+
+    with profile_review("1!2"):
+        assert PROFILE.get() is None
@@ -0,0 +1,130 @@
+import zipfile
+from pathlib import Path
+from types import SimpleNamespace
+
+from iamksm_bot.app.ai import IAMKSM
+from iamksm_bot.app.context import ContextPlanner
+from iamksm_bot.app.ingest import ArchiveContents, IngestFilter
+from iamksm_bot.app.prompt import (
+    EMPTY_SECTION,
+    PromptBuilder,
+    collapse_context,
+    render_commits,
+    render_tree,
+)
+from iamksm_bot.app.template import (
+    PROJECT_CONTEXT,
+    PROMPT_TEMPLATE,
+    REVIEW_INSTRUCTIONS,
+)
+
+SHA = "0123abcd"
+
+
+def snapshot(tmp_path: Path) -> ArchiveContents:
+    path: Path = tmp_path / "archive.zip"
+
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("project-abc/app/foo.py", "def foo():\n    return 1\n")
+        archive.writestr("project-abc/app/bar.py", "from app.foo import foo\n")
+        archive.writestr("project-abc/app/data.bin2", b"\x89\0\x01" * 100)
+
+    return ArchiveContents(path, IngestFilter(max_file_bytes=1000))
+
+
+def render(contents: ArchiveContents, title: str, changes) -> str:
+    reviewer = IAMKSM.__new__(IAMKSM)
+    project = SimpleNamespace(path_with_namespace="group/project")
+    builder = PromptBuilder()
+    sections = builder.sections(
+        **reviewer.project_overview(project, SHA, contents),
+        repo=ContextPlanner(token_budget=1000).plan(contents, changes).files,
+        mr_title=title,
+        mr_desc="",
+        commits=[],
+        changes=changes["changes"],
+        file_paths_context={},
+    )
+    return builder.render(PROMPT_TEMPLATE, sections).text
+
+
+def test_reviews_of_one_commit_share_the_prompt_prefix(tmp_path: Path):
+    contents: ArchiveContents = snapshot(tmp_path)
+    first = render(
+        contents,
+        "First",
+        {"changes": [{"new_path": "app/foo.py", "diff": "+def foo():\n"}]},
+    )
+    second = render(
+        contents,
+        "Second",
+        {"changes": [{"new_path": "app/bar.py", "diff": "+foo()\n"}]},
+    )
+    prefix: str = REVIEW_INSTRUCTIONS + PROJECT_CONTEXT.format(
+        project="group/project", project_sha=SHA, project_context="app/: bar.py, foo.py"
+    )
+
+    assert first.startswith(prefix)
+    assert second.startswith(prefix)
+
+
+def test_long_unchanged_runs_keep_context_lines_around_changes():
+    unchanged: str = "\n".join(f" same {number}" for number in range(10))
+    diff: str = f"@@ -1,21 +1,21 @@\n{unchanged}\n-old\n+new\n{unchanged}"
+
+    assert collapse_context(diff, context_lines=2).splitlines() == [
+        "@@ -1,21 +1,21 @@",
+        " ... 8 unchanged lines",
+        " same 8",
+        " same 9",
+        "-old",
+        "+new",
+        " same 0",
+        " same 1",
+        " ... 8 unchanged lines",
+    ]
+
+
+def test_short_unchanged_runs_are_kept_whole():
+    diff: str = "@@ -1,4 +1,4 @@\n-a\n+b\n same 1\n same 2\n same 3\n-c\n+d"
+
+    assert collapse_context(diff, context_lines=1) == diff
+
+
+def test_every_piece_of_content_is_rendered_once():
+    builder = PromptBuilder(context_lines=3)
+    sections = builder.sections(
+        changes=[
+            {"new_path": "app/new.py", "new_file": True, "diff": "+def new():\n"},
+            {"new_path": "app/old.py", "diff": "-x = 1\n+x = 2\n"},
+        ],
+        repo={"app/old.py": "x = 1\n", "app/other.py": "y = 1\n"},
+        file_paths_context={"app/new.py": "def new():\n", "app/old.py": "x = 2\n"},
+    )
+
+    assert "app/old.py" not in sections["repo"]
+    assert "app/other.py" in sections["repo"]
+    assert "app/new.py" not in sections["file_paths_context"]
+    assert "### app/new.py (new file)" in sections["changes"]
+    assert sections["changes"].count("+x = 2") == 1
+
+
+def test_empty_sections_render_as_none():
+    sections = PromptBuilder().sections(changes=[], repo={}, commits=[], mr_desc="")
+
+    assert set(sections.values()) == {EMPTY_SECTION}
+
+
+def test_commit_bodies_do_not_repeat_their_title():
+    commits = [{"title": "Fix bug", "message": "Fix bug\n\nIt was off by one"}]
+
+    assert render_commits(commits) == "- Fix bug\n  It was off by one"
+
+
+def test_project_trees_are_cut_at_their_budget():
+    paths = [f"dir{number}/file.py" for number in range(100)]
+
+    tree: str = render_tree(paths, token_budget=20)
+
+    assert tree.startswith("dir0/: file.py\ndir1/: file.py")
+    assert tree.endswith("more files")
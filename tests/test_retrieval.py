@@ -0,0 +1,126 @@
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List
+
+import ollama
+import pytest
+
+from iamksm_bot.app.retrieval import (
+    META_FILENAME,
+    EmbeddingIndex,
+    OllamaEmbedder,
+    chunk_file,
+    retrieve_context,
+)
+from tests.conftest import server_url
+
+MODEL = "fake"
+
+
+class CountingEmbedder(OllamaEmbedder):
+    def __init__(self, url: str, executor: ThreadPoolExecutor):
+        super().__init__(MODEL, executor, ollama.Client(host=url))
+        self.texts: List[str] = []
+
+    def __call__(self, texts: List[str]) -> List[List[float]]:
+        self.texts.extend(texts)
+        return super().__call__(texts)
+
+
+@pytest.fixture
+def embedder(fake_ollama):
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        yield CountingEmbedder(server_url(fake_ollama()), executor)
+
+
+def repository() -> Dict[str, str]:
+    return {
+        "billing/invoice.py": "def total_amount(invoice):\n"
+        "    return sum(line.amount for line in invoice.lines)\n",
+        "billing/tax.py": "def vat_rate(country):\n    return RATES[country]\n",
+        "users/profile.py": "def avatar_url(user):\n    return user.avatar\n",
+    }
+
+
+def test_chunk_file_overlaps_and_covers_every_line():
+    content: str = "\n".join(f"line {number}" for number in range(10))
+
+    chunks = chunk_file("a.py", content, chunk_lines=4, overlap=1)
+
+    assert [(c["start"], c["end"]) for c in chunks] == [(0, 4), (3, 7), (6, 10)]
+    assert chunks[1]["text"] == "line 3\nline 4\nline 5\nline 6"
+
+
+def test_chunk_file_skips_blank_chunks():
+    assert chunk_file("a.py", "\n\n\n", chunk_lines=2, overlap=0) == []
+
+
+def test_build_reuses_unchanged_chunks_of_the_seed(tmp_path: Path, embedder):
+    contents: Dict[str, str] = repository()
+    seed = EmbeddingIndex.build(tmp_path / "old", contents, embedder, MODEL)
+    assert len(embedder.texts) == 3
+
+    embedder.texts.clear()
+    contents["users/profile.py"] = "def avatar_url(user):\n    return user.photo\n"
+    index = EmbeddingIndex.build(tmp_path / "new", contents, embedder, MODEL, seed=seed)
+
+    assert embedder.texts == [contents["users/profile.py"].rstrip("\n")]
+    assert len(index.meta) == 3
+    assert index.vectors.shape == seed.vectors.shape
+
+
+def test_search_orders_chunks_by_similarity(tmp_path: Path, embedder):
+    contents: Dict[str, str] = repository()
+    index = EmbeddingIndex.build(tmp_path, contents, embedder, MODEL)
+
+    matches = index.search(embedder(["sum of invoice lines amount"]), k=2)
+
+    assert [match["path"] for match in matches][0] == "billing/invoice.py"
+    assert len(matches) == 2
+    assert matches[0]["score"] >= matches[1]["score"]
+
+
+def test_retrieve_context_keys_chunks_by_line_range(tmp_path: Path, embedder):
+    contents: Dict[str, str] = repository()
+    index = EmbeddingIndex.build(tmp_path, contents, embedder, MODEL)
+    changes = [{"diff": "@@ -1,2 +1,2 @@\n-    return RATES[country]\n+    rate\n"}]
+
+    context = retrieve_context(index, contents, changes, embedder, k=1)
+
+    assert context == {"billing/tax.py:1-2": contents["billing/tax.py"].rstrip("\n")}
+
+
+def test_rewrite_switches_to_the_new_vectors(tmp_path: Path, embedder):
+    EmbeddingIndex.build(tmp_path, repository(), embedder, MODEL)
+    first = EmbeddingIndex.load(tmp_path, MODEL)
+
+    EmbeddingIndex.build(tmp_path, repository(), embedder, MODEL)
+
+    assert len(list(tmp_path.glob("vectors*.npy"))) == 1
+    assert EmbeddingIndex.load(tmp_path, MODEL).meta == first.meta
+    # The previous index stays readable through its memory map
+    assert first.vectors.sum() == pytest.approx(
+        EmbeddingIndex.load(tmp_path, MODEL).vectors.sum()
+    )
+
+
+def test_load_ignores_indexes_of_other_models(tmp_path: Path, embedder):
+    EmbeddingIndex.build(tmp_path, repository(), embedder, MODEL)
+
+    assert (tmp_path / META_FILENAME).exists()
+    assert EmbeddingIndex.load(tmp_path, "other") is None
+
+
+def test_concurrent_writes_leave_a_complete_index(tmp_path: Path, embedder):
+    contents: Dict[str, str] = repository()
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        indexes = list(
+            executor.map(
+                lambda _: EmbeddingIndex.build(tmp_path, contents, embedder, MODEL),
+                range(8),
+            )
+        )
+
+    assert all(index is not None for index in indexes)
+    assert len(EmbeddingIndex.load(tmp_path, MODEL).meta) == 3
@@ -0,0 +1,220 @@
+import asyncio
+import time
+from threading import Event, Lock
+from typing import Callable, List, Tuple
+
+import pytest
+
+from iamksm_bot.app.fairqueue import BacklogFull, ProjectPolicy, SchedulingPolicy
+from iamksm_bot.app.scheduler import (
+    AsyncReviewScheduler,
+    ReviewJob,
+    ReviewScheduler,
+)
+
+
+class FakeReview:
+    """
+    Records the reviews it is called for and holds them until `gate` is set.
+    """
+
+    def __init__(self):
+        self.gate = Event()
+        self.started: List[Tuple[int, int]] = []
+        self.cancelled: List[Tuple[int, int]] = []
+        self._lock = Lock()
+
+    def __call__(self, project_id: int, mr_iid: int, cancel: Event) -> None:
+        with self._lock:
+            self.started.append((project_id, mr_iid))
+
+        while not self.gate.wait(0.01):
+            if cancel.is_set():
+                with self._lock:
+                    self.cancelled.append((project_id, mr_iid))
+                return
+
+
+def wait_for(condition: Callable[[], bool], timeout: float = 5.0) -> None:
+    deadline: float = time.monotonic() + timeout
+
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_submit_answers_503_for_a_full_backlog_and_429_for_a_full_project():
+    policy = SchedulingPolicy(default=ProjectPolicy(max_backlog=1), max_backlog=2)
+    scheduler = ReviewScheduler(FakeReview(), 60, max_concurrent=1, policy=policy)
+    scheduler.submit(1, 1, "a")
+
+    with pytest.raises(BacklogFull) as project:
+        scheduler.submit(1, 2, "a")
+
+    scheduler.submit(1, 1, "b")
+    scheduler.submit(2, 1, "a")
+
+    with pytest.raises(BacklogFull) as everyone:
+        scheduler.submit(3, 1, "a")
+
+    assert project.value.status == 429
+    assert everyone.value.status == 503
+    assert scheduler.depth() == 2
+
+
+def test_projects_at_max_concurrent_leave_slots_to_others():
+    review = FakeReview()
+    policy = SchedulingPolicy(projects={1: ProjectPolicy(max_concurrent=1)})
+    scheduler = ReviewScheduler(review, 0.01, max_concurrent=2, policy=policy)
+    scheduler.submit(1, 1, "a")
+    wait_for(lambda: review.started == [(1, 1)])
+    scheduler.submit(1, 2, "a")
+    scheduler.submit(2, 1, "a")
+
+    wait_for(lambda: len(review.started) == 2)
+    assert review.started == [(1, 1), (2, 1)]
+
+    review.gate.set()
+    wait_for(lambda: len(review.started) == 3 and not scheduler.in_flight())
+    assert review.started[2] == (1, 2)
+
+
+def test_async_slots_granted_to_a_cancelled_review_are_given_back():
+    async def scenario() -> AsyncReviewScheduler:
+        scheduler = AsyncReviewScheduler(None, 0, max_concurrent=1)
+        first = ReviewJob(project_id=1, mr_iid=1, sha="a")
+        second = ReviewJob(project_id=1, mr_iid=2, sha="a")
+        await scheduler._acquire(first)
+        waiter = asyncio.create_task(scheduler._acquire(second))
+        await asyncio.sleep(0)
+
+        # The slot goes to the waiting review, cancelled before it resumes
+        scheduler._release(first)
+        waiter.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        return scheduler
+
+    scheduler: AsyncReviewScheduler = asyncio.run(scenario())
+
+    assert scheduler._active == 0
+    assert len(scheduler.queue) == 0
+
+
+def test_async_reviews_cancelled_while_waiting_leave_the_queue():
+    async def scenario() -> AsyncReviewScheduler:
+        scheduler = AsyncReviewScheduler(None, 0, max_concurrent=1)
+        await scheduler._acquire(ReviewJob(project_id=1, mr_iid=1, sha="a"))
+        waiter = asyncio.create_task(
+            scheduler._acquire(ReviewJob(project_id=1, mr_iid=2, sha="a"))
+        )
+        await asyncio.sleep(0)
+        waiter.cancel()
+
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+
+        return scheduler
+
+    scheduler: AsyncReviewScheduler = asyncio.run(scenario())
+
+    assert scheduler._active == 1
+    assert len(scheduler.queue) == 0
+
+
+def test_async_newer_pushes_cancel_the_running_review():
+    reviewed: List[str] = []
+
+    async def scenario() -> AsyncReviewScheduler:
+        started = asyncio.Event()
+
+        async def review(project_id: int, mr_iid: int, cancel: Event) -> None:
+            started.set()
+            await asyncio.sleep(0.05)
+            reviewed.append(scheduler._tasks[(project_id, mr_iid)][0].sha)
+
+        scheduler = AsyncReviewScheduler(review, 0.01, max_concurrent=1)
+        scheduler.submit(1, 1, "a")
+        await started.wait()
+        scheduler.submit(1, 1, "b")
+        await asyncio.sleep(0.2)
+        return scheduler
+
+    scheduler: AsyncReviewScheduler = asyncio.run(scenario())
+
+    assert reviewed == ["b"]
+    assert scheduler._active == 0
+    assert scheduler.in_flight() == 0
+
+
+def test_async_submit_rejects_a_full_project():
+    async def scenario() -> None:
+        policy = SchedulingPolicy(default=ProjectPolicy(max_backlog=1))
+        scheduler = AsyncReviewScheduler(None, 60, max_concurrent=1, policy=policy)
+        scheduler.submit(1, 1, "a")
+
+        with pytest.raises(BacklogFull) as project:
+            scheduler.submit(1, 2, "a")
+
+        assert project.value.status == 429
+
+        for _, task in scheduler._tasks.values():
+            task.cancel()
+
+    asyncio.run(scenario())
+
+
+def test_events_within_the_debounce_window_collapse_into_one_review():
+    review = FakeReview()
+    review.gate.set()
+    scheduler = ReviewScheduler(review, 0.2, max_concurrent=1)
+
+    first: ReviewJob = scheduler.submit(1, 1, "a")
+    second: ReviewJob = scheduler.submit(1, 1, "b")
+    last: ReviewJob = scheduler.submit(1, 1, "c")
+
+    assert scheduler.depth() == 1
+    assert first.cancel.is_set() and second.cancel.is_set()
+
+    wait_for(lambda: review.started and not scheduler.in_flight())
+    time.sleep(0.3)
+    assert review.started == [(1, 1)]
+    assert not last.cancel.is_set()
+
+
+def test_a_newer_sha_cancels_the_running_review():
+    review = FakeReview()
+    scheduler = ReviewScheduler(review, 0.01, max_concurrent=2)
+    running: ReviewJob = scheduler.submit(1, 1, "a")
+    wait_for(lambda: review.started == [(1, 1)])
+
+    assert scheduler.submit(1, 1, "a") is running
+
+    scheduler.submit(1, 1, "b")
+
+    wait_for(lambda: review.cancelled == [(1, 1)])
+    assert running.cancel.is_set()
+    wait_for(lambda: len(review.started) == 2)
+
+    review.gate.set()
+    wait_for(lambda: not scheduler.in_flight())
+    assert scheduler.depth() == 0
+
+
+def test_active_reviews_never_exceed_max_concurrent():
+    review = FakeReview()
+    scheduler = ReviewScheduler(review, 0.01, max_concurrent=2)
+
+    for mr_iid in range(5):
+        scheduler.submit(1, mr_iid, "a")
+
+    wait_for(lambda: scheduler.in_flight() == 2)
+    time.sleep(0.1)
+    assert len(review.started) == 2
+    assert scheduler.depth() == 3
+
+    review.gate.set()
+    wait_for(lambda: len(review.started) == 5 and not scheduler.in_flight())
+    assert scheduler.depth() == 0
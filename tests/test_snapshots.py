@@ -0,0 +1,107 @@
+import os
+import time
+from pathlib import Path
+from types import SimpleNamespace
+from typing import List
+
+import pytest
+
+from iamksm_bot.app.ai import IAMKSM
+from iamksm_bot.app.snapshots import LOCK_STRIPES, SNAPSHOT_ARCHIVE, SnapshotStore
+from iamksm_bot.app.utils import LruCache
+
+
+def downloads(content: bytes, calls: List[bytes]):
+    def download() -> bytes:
+        calls.append(content)
+        return content
+
+    return download
+
+
+def age(store: SnapshotStore, sha: str, seconds: float) -> None:
+    path: Path = store.path_for(1, sha)
+    when: float = path.stat().st_mtime - seconds
+    os.utime(path, (when, when))
+
+
+def test_snapshots_are_downloaded_once(tmp_path: Path):
+    store = SnapshotStore(str(tmp_path), quota_bytes=1 << 20)
+    calls: List[bytes] = []
+
+    first: Path = store.get(1, "a", downloads(b"zip", calls))
+    second: Path = store.get(1, "a", downloads(b"other", calls))
+
+    assert first == second
+    assert first.read_bytes() == b"zip"
+    assert calls == [b"zip"]
+
+
+def test_least_recently_used_snapshots_are_evicted_past_the_quota(tmp_path: Path):
+    store = SnapshotStore(str(tmp_path), quota_bytes=250)
+    store.get(1, "old", downloads(b"x" * 100, []))
+    store.get(1, "used", downloads(b"x" * 100, []))
+    age(store, "old", 60)
+    age(store, "used", 120)
+
+    store.touch(1, "used")
+    store.get(1, "new", downloads(b"x" * 100, []))
+
+    assert not store.path_for(1, "old").exists()
+    assert store.archive_for(1, "used").exists()
+    assert store.archive_for(1, "new").exists()
+    assert not [p for p in (tmp_path / "snapshots" / "1").iterdir() if p.name[0] == "."]
+
+
+def test_the_new_snapshot_is_kept_even_over_quota(tmp_path: Path):
+    store = SnapshotStore(str(tmp_path), quota_bytes=10)
+
+    archive: Path = store.get(1, "big", downloads(b"x" * 100, []))
+
+    assert archive.exists()
+
+
+def test_installing_keeps_indexes_and_leaves_no_staging_file(tmp_path: Path):
+    store = SnapshotStore(str(tmp_path), quota_bytes=1 << 20)
+    path: Path = store.path_for(1, "a")
+    path.mkdir(parents=True)
+    (path / "index.json").write_text("{}")
+
+    store.get(1, "a", downloads(b"zip", []))
+
+    assert sorted(p.name for p in path.iterdir()) == [SNAPSHOT_ARCHIVE, "index.json"]
+
+
+def test_failed_downloads_leave_no_archive(tmp_path: Path):
+    store = SnapshotStore(str(tmp_path), quota_bytes=1 << 20)
+
+    def download() -> bytes:
+        raise ConnectionError("GitLab is down")
+
+    with pytest.raises(ConnectionError):
+        store.get(1, "a", download)
+
+    assert not store.archive_for(1, "a").exists()
+
+
+def test_download_locks_are_bounded(tmp_path: Path):
+    store = SnapshotStore(str(tmp_path), quota_bytes=1 << 20)
+
+    locks = {id(store._lock_for(1, f"sha{n}")) for n in range(1000)}
+
+    assert len(locks) <= LOCK_STRIPES
+    assert store._lock_for(1, "sha1") is store._lock_for(1, "sha1")
+
+
+def test_snapshots_read_from_memory_stay_recent_on_disk(tmp_path: Path):
+    store = SnapshotStore(str(tmp_path), quota_bytes=1 << 20)
+    store.get(1, "a", downloads(b"zip", []))
+    age(store, "a", 60)
+    reviewer = IAMKSM.__new__(IAMKSM)
+    reviewer.snapshots = store
+    reviewer._contents = LruCache(1)
+    reviewer._contents.get((1, "a"), dict)
+
+    reviewer.get_repository_contents(SimpleNamespace(id=1), "a")
+
+    assert time.time() - store.path_for(1, "a").stat().st_mtime < 30
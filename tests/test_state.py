@@ -0,0 +1,35 @@
+import sqlite3
+from pathlib import Path
+
+from iamksm_bot.app.state import ReviewStateStore
+
+
+def test_discussion_ids_are_kept(tmp_path: Path):
+    store = ReviewStateStore(str(tmp_path / "state.sqlite3"))
+    store.save(1, 2, "abc", "summary", "d1")
+
+    assert store.get(1, 2).discussion_id == "d1"
+
+    store.save(1, 2, "def", "summary")
+
+    assert store.get(1, 2).discussion_id is None
+
+
+def test_stores_without_discussion_ids_are_migrated(tmp_path: Path):
+    path: str = str(tmp_path / "state.sqlite3")
+
+    with sqlite3.connect(path) as db:
+        db.execute(
+            "CREATE TABLE reviews (project_id INTEGER NOT NULL, mr_iid INTEGER "
+            "NOT NULL, head_sha TEXT NOT NULL, summary TEXT NOT NULL, updated_at "
+            "REAL NOT NULL, PRIMARY KEY (project_id, mr_iid))"
+        )
+        db.execute("INSERT INTO reviews VALUES (1, 2, 'abc', 'summary', 0)")
+
+    store = ReviewStateStore(path)
+
+    assert store.get(1, 2).discussion_id is None
+
+    store.save(1, 2, "def", "summary", "d1")
+
+    assert store.get(1, 2).discussion_id == "d1"
@@ -0,0 +1,22 @@
+from iamksm_bot.app import profiling
+from iamksm_bot.app.tracing import TRACE_ID, trace
+
+
+def test_trace_claims_an_armed_profile(monkeypatch):
+    claims = []
+    monkeypatch.setattr(profiling, "claim", lambda directory: claims.append(1))
+
+    with trace("1!2"):
+        assert TRACE_ID.get() == "1!2"
+
+    assert claims == [1]
+    assert TRACE_ID.get() == "-"
+
+
+def test_trace_without_profiling_leaves_armed_profiles(monkeypatch):
+    monkeypatch.setattr(profiling, "claim", lambda directory: 1 / 0)
+
+    with trace("1@main", profile=False):
+        assert TRACE_ID.get() == "1@main"
+
+    assert TRACE_ID.get() == "-"
@@ -0,0 +1,100 @@
+import json
+import time
+from threading import Event
+from typing import Any, Dict, List, Tuple
+
+import pytest
+
+from iamksm_bot.app import webhook
+from iamksm_bot.app.utils import Lazy
+from iamksm_bot.config.settings import settings
+
+
+class FakeReviewer:
+    def __init__(self):
+        self.reviewed: List[Tuple[int, int]] = []
+
+    def review_merge_request(self, project_id: int, mr_id: int, cancel: Event):
+        self.reviewed.append((project_id, mr_id))
+
+
+def merge_request_event(**attributes: Any) -> Dict[str, Any]:
+    return {
+        "event_type": "merge_request",
+        "project": {"id": 1},
+        "labels": [],
+        "object_attributes": {
+            "iid": 2,
+            "draft": False,
+            "work_in_progress": False,
+            "blocking_discussions_resolved": True,
+            "action": "open",
+            "state": "opened",
+            "last_commit": {"id": "abc"},
+            **attributes,
+        },
+    }
+
+
+@pytest.fixture
+def reviewer(monkeypatch) -> FakeReviewer:
+    fake = FakeReviewer()
+    monkeypatch.setattr(webhook, "REVIEWER", Lazy(lambda: fake))
+    return fake
+
+
+@pytest.fixture
+def app(monkeypatch, reviewer):
+    settings.load()
+    monkeypatch.setattr(settings, "GITLAB_HEADER_TOKEN", "hook")
+    monkeypatch.setattr(settings, "REVIEW_QUEUE", "memory")
+    monkeypatch.setattr(settings, "REVIEW_DEBOUNCE_SECONDS", 0)
+    monkeypatch.setattr(settings, "PREWARM_ENABLED", False)
+    return webhook.create_app()
+
+
+def post(app, body: bytes, token: str = "hook") -> int:
+    response = app.test_client().post(
+        "/review-mr",
+        data=body,
+        headers={"X-Gitlab-Token": token, "Content-Type": "application/json"},
+    )
+    return response.status_code
+
+
+@pytest.mark.parametrize(
+    "body",
+    [
+        b"{not json",
+        b"[1, 2]",
+        b"",
+        b"{}",
+        json.dumps({"event_type": "note", "object_attributes": {}}).encode(),
+        json.dumps(dict(merge_request_event(), project=None)).encode(),
+    ],
+)
+def test_webhook_rejects_bodies_that_are_not_merge_request_events(app, body: bytes):
+    assert post(app, body) == 400
+
+
+def test_webhook_checks_the_token_first(app):
+    assert post(app, b"{not json", token="wrong") == 401
+
+
+def test_webhook_forbids_draft_merge_requests(app):
+    assert post(app, json.dumps(merge_request_event(draft=True)).encode()) == 403
+
+
+def test_reviewer_is_built_in_the_background_and_reviews_queued_events(
+    app, reviewer: FakeReviewer
+):
+    assert post(app, json.dumps(merge_request_event()).encode()) == 200
+
+    deadline: float = time.monotonic() + 5
+
+    while not reviewer.reviewed:
+        assert time.monotonic() < deadline, "the review never ran"
+        time.sleep(0.01)
+
+    assert webhook.REVIEWER.built
+    assert reviewer.reviewed == [(1, 2)]